@@ -12,8 +12,8 @@ with open(os.path.join(HERE, 'VERSION.txt')) as fp:
 setup(
     name='zenmarket',
     version=VERSION,
-    packages=find_packages(),
-    install_requires=['click', 'colander', 'aiohttp'],
+    packages=find_packages(exclude=['zenmarket.test']),
+    install_requires=['click', 'colander', 'aiohttp>=3.9'],
     extras_require={
         'dev': ['ipdb', 'ipython', 'pytest', 'pytest-cov', 'pytest-pylint'],
     },
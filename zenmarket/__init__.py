@@ -1,35 +1,155 @@
 '''
 CLI for zenmarket
 '''
+import contextlib
+import functools
+import gzip
+import hashlib
+import mmap
+import os
+import stat
 import sys
 import traceback
 import json
 from typing import Callable, NewType
 import click
 
-from zenmarket.algo import level1 as l1, level2 as l2, level3 as l3
-from zenmarket import app
+from zenmarket.algo import analytics, differential, engines, scenarios
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+from zenmarket import checkpoint, daemon, wire
+from zenmarket.server.slowlog import StreamSink
 
 
 # pylint: disable=C0103,W0702
 PriceFunc = NewType('PriceFunc', Callable[[dict], dict])
 
+GZIP_MAGIC = b'\x1f\x8b'
 
-def pricing(infile: click.File, outfile: click.File, price: PriceFunc) -> None:
+
+def decode_json(raw: bytes) -> dict:
+    '''
+    Default input decoder, raw is bytes or a mapped file. Pages of a mapped
+    file are dropped once decoded, before the text is parsed.
+    '''
+    text = str(raw, 'utf-8')
+    if isinstance(raw, mmap.mmap) and hasattr(mmap, 'MADV_DONTNEED'):
+        raw.madvise(mmap.MADV_DONTNEED)
+    return json.loads(text)
+
+
+def encode_json(response: dict) -> bytes:
+    '''
+    Default output encoder
+    '''
+    return ('%s\n' % json.dumps(response, indent=2, sort_keys=True)).encode()
+
+
+def map_file(infile: click.File):
+    '''
+    :returns read-only map of infile when it is a non empty regular file,
+    None otherwise (pipes, terminals)
+    '''
+    try:
+        info = os.fstat(infile.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    if not stat.S_ISREG(info.st_mode) or not info.st_size:
+        return None
+    return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@contextlib.contextmanager
+def read_input(infile: click.File):
+    '''
+    Context manager giving infile content: regular files are mapped rather
+    than read, gzip compressed content is gunzipped
+    '''
+    mapped = map_file(infile)
+    raw = infile.read() if mapped is None else mapped
+    try:
+        if raw[:2] == GZIP_MAGIC:
+            yield gzip.decompress(raw)
+        else:
+            yield raw
+    except BaseException:
+        if mapped is not None:
+            try:
+                mapped.close()
+            except BufferError:
+                # the traceback holds views of the map, which is closed once
+                # they are collected
+                pass
+        raise
+    if mapped is not None:
+        mapped.close()
+
+
+def write_output(outfile: click.File, body: bytes) -> None:
+    '''
+    Writes body to outfile, gzip compressed when its name ends with .gz
+    '''
+    if str(getattr(outfile, 'name', '')).endswith('.gz'):
+        body = gzip.compress(body, mtime=0)
+    outfile.write(body)
+    outfile.flush()
+
+
+def pricing(infile: click.File, outfile: click.File, price: PriceFunc,
+            decode=decode_json, encode=encode_json) -> None:
     '''
     Gets data from infile, computes price(data), writes the result to outfile
     '''
     try:
-        data = json.loads(infile.read().decode())
+        with read_input(infile) as raw:
+            data = decode(raw)
         response = price(data)
-        outfile.write(('%s\n' % json.dumps(
-            response, outfile, indent=2, sort_keys=True)).encode())
-        outfile.flush()
+        write_output(outfile, encode(response))
+    except:
+        print(traceback.format_exception(*sys.exc_info())[-1], file=sys.stderr)
+        sys.exit(1)
+
+
+def engine_pricing(level: int, engine: str) -> PriceFunc:
+    '''
+    :returns price function of engine (the default one when None) for level
+    :raises click.UsageError
+    '''
+    try:
+        return functools.partial(engines.get(
+            engine or engines.DEFAULT_ENGINE, level).price, level)
+    except engines.UnknownEngine as exc:
+        raise click.UsageError(str(exc))
+
+
+def daemon_pricing(infile: click.File, outfile: click.File, path: str,
+                   level: int, engine: str, encode=encode_json) -> None:
+    '''
+    pricing, except that infile is priced by the daemon listening on the
+    Unix socket path. Output and errors are the ones of local pricing.
+    '''
+    try:
+        with read_input(infile) as raw:
+            response = daemon.price(path, level, raw, engine)
+        write_output(outfile, encode(response))
+    except daemon.PricingFailed as exc:
+        print(str(exc) + '\n', file=sys.stderr)
+        sys.exit(1)
     except:
         print(traceback.format_exception(*sys.exc_info())[-1], file=sys.stderr)
         sys.exit(1)
 
 
+ENGINE_OPTION = click.option(
+    '--engine', type=click.Choice(engines.names()), default=None,
+    help='pricing engine, {} by default (the daemon default engine with '
+    '--daemon)'.format(engines.DEFAULT_ENGINE))
+
+DAEMON_OPTION = click.option(
+    '--daemon', 'daemon_socket', type=click.Path(dir_okay=False),
+    default=None, help='Unix socket of a zm-cli serve --unix process '
+    'pricing the input instead of this one')
+
+
 @click.group()
 def cli():
     '''
@@ -41,54 +161,479 @@ def cli():
 @cli.command()
 @click.argument('infile', type=click.File('rb'))
 @click.argument('outfile', type=click.File('wb'))
-def level1(infile: click.File, outfile: click.File) -> None:
+@ENGINE_OPTION
+@DAEMON_OPTION
+def level1(infile: click.File, outfile: click.File, engine: str,
+           daemon_socket: str) -> None:
     '''
     cli for level1 pricing algo
     usage:
     level1 data.json outfile.json
     cat data.json | zm-cli level1 - outfile.json
     cat data.json | zm-cli level1 - - > outfile.json
+    zm-cli level1 --engine fused data.json outfile.json
+    zm-cli level1 --daemon /tmp/zenmarket.sock data.json outfile.json
     '''
-    return pricing(infile, outfile, l1.price)
+    if daemon_socket is not None:
+        return daemon_pricing(infile, outfile, daemon_socket, 1, engine)
+    return pricing(infile, outfile, engine_pricing(1, engine))
 
 
 @cli.command()
 @click.argument('infile', type=click.File('rb'))
 @click.argument('outfile', type=click.File('wb'))
-def level2(infile: click.File, outfile: click.File) -> None:
+@ENGINE_OPTION
+@DAEMON_OPTION
+def level2(infile: click.File, outfile: click.File, engine: str,
+           daemon_socket: str) -> None:
     '''
     cli for level2 pricing algo
     usage:
     level2 data.json outfile.json
     cat data.json | zm-cli level2 - outfile.json
     cat data.json | zm-cli level2 - - > outfile.json
+    zm-cli level2 --engine fused data.json outfile.json
+    zm-cli level2 --daemon /tmp/zenmarket.sock data.json outfile.json
     '''
-    return pricing(infile, outfile, l2.price)
+    if daemon_socket is not None:
+        return daemon_pricing(infile, outfile, daemon_socket, 2, engine)
+    return pricing(infile, outfile, engine_pricing(2, engine))
 
 
 @cli.command()
 @click.argument('infile', type=click.File('rb'))
 @click.argument('outfile', type=click.File('wb'))
-def level3(infile: click.File, outfile: click.File) -> None:
+@click.option('--catalog', type=click.Path(exists=True, dir_okay=False),
+              help='compiled catalog to price infile carts against')
+@click.option('--input-format', type=click.Choice(['json', 'binary']),
+              default='json', help='binary requires --catalog')
+@click.option('--output-format', type=click.Choice(['json', 'binary']),
+              default='json')
+@ENGINE_OPTION
+@DAEMON_OPTION
+def level3(infile: click.File, outfile: click.File, catalog: str,
+           input_format: str, output_format: str, engine: str,
+           daemon_socket: str) -> None:
     '''
     cli for level3 pricing algo
     usage:
     level3 data.json outfile.json
     cat data.json | zm-cli level3 - outfile.json
     cat data.json | zm-cli level3 - - > outfile.json
+    zm-cli level3 --engine fused data.json outfile.json
+    zm-cli level3 --daemon /tmp/zenmarket.sock data.json outfile.json
+    zm-cli level3 --catalog catalog.zmc carts.json outfile.json
+    zm-cli level3 --catalog catalog.zmc --input-format binary \\
+        --output-format binary carts.zmb totals.zmt
+    '''
+    encode = wire.encode_totals if output_format == 'binary' else encode_json
+    if daemon_socket is not None:
+        if catalog is not None or input_format == 'binary':
+            raise click.UsageError(
+                '--daemon prices JSON inputs, without --catalog')
+        return daemon_pricing(
+            infile, outfile, daemon_socket, 3, engine, encode=encode)
+    if catalog is None:
+        if input_format == 'binary':
+            raise click.UsageError('--input-format binary needs --catalog')
+        return pricing(
+            infile, outfile, engine_pricing(3, engine), encode=encode)
+    with CompiledCatalog.open(catalog) as compiled:
+        if input_format == 'binary':
+            return pricing(infile, outfile, compiled.price,
+                           decode=wire.decode_carts, encode=encode)
+        return pricing(infile, outfile, compiled.price_data, encode=encode)
+
+
+@cli.group('batch')
+def batch_group():
+    '''
+    Prices every file of a directory
+    '''
+    pass
+
+
+@batch_group.command('level3')
+@click.argument('indir', type=click.Path(exists=True, file_okay=False))
+@click.argument('outdir', type=click.Path(file_okay=False, writable=True))
+@click.option('--jobs', type=int, default=os.cpu_count() or 1,
+              help='worker processes (number of CPUs by default)')
+def batch_level3(indir: str, outdir: str, jobs: int) -> None:
+    '''
+    Prices every level3 file (*.json, *.json.gz) of indir into outdir under
+    the same name, as zm-cli level3 would, with a pool of workers and the
+    compiled engine. Each catalog is compiled once and mapped by the
+    workers.
+    usage:
+    zm-cli batch level3 incoming/ priced/ --jobs 8
+    '''
+    # imported here: zenmarket.batch uses this module
+    from zenmarket import batch as batching  # pylint: disable=import-outside-toplevel
+
+    def report(result):
+        if result.error is not None:
+            print('{}: {}'.format(result.name, result.error), file=sys.stderr)
+
+    summary = batching.price_directory(indir, outdir, jobs, on_result=report)
+    click.echo(summary.format())
+    if summary.failed:
+        sys.exit(1)
+
+
+@cli.command('level3-chunked')
+@click.argument('infile', type=click.File('rb'))
+@click.argument('outpath', type=click.Path(dir_okay=False, writable=True))
+@click.option('--catalog', type=click.Path(exists=True, dir_okay=False),
+              help='compiled catalog to price infile carts against')
+@click.option('--chunk-carts', type=click.IntRange(min=1), default=10000,
+              help='carts priced between two checkpoints')
+@click.option('--checkpoint', 'checkpoint_path',
+              type=click.Path(dir_okay=False), default=None,
+              help='checkpoint file, OUTPATH.ckpt by default')
+@click.option('--resume', is_flag=True,
+              help='continue an interrupted run from its checkpoint')
+def level3_chunked(infile: click.File, outpath: str, catalog: str,
+                   chunk_carts: int, checkpoint_path: str,
+                   resume: bool) -> None:
+    '''
+    level3 pricing of huge inputs, chunk by chunk with checkpoints. The
+    output is the one of level3.
+    usage:
+    zm-cli level3-chunked data.json output.json
+    zm-cli level3-chunked --resume data.json output.json
+    zm-cli level3-chunked --catalog catalog.zmc --chunk-carts 100000 \\
+        carts.json output.json
     '''
-    return pricing(infile, outfile, l3.price)
+    if outpath.endswith('.gz'):
+        raise click.UsageError('level3-chunked writes uncompressed outputs')
+    try:
+        with read_input(infile) as raw:
+            data = decode_json(raw)
+            input_digest = hashlib.sha256(raw).hexdigest()
+        if catalog is None:
+            return checkpoint.price_chunks(
+                data, outpath, chunk_carts, checkpoint_path, resume,
+                input_digest=input_digest)
+        with CompiledCatalog.open(catalog) as compiled:
+            return checkpoint.price_chunks(
+                data, outpath, chunk_carts, checkpoint_path, resume, compiled,
+                input_digest)
+    except:
+        print(traceback.format_exception(*sys.exc_info())[-1], file=sys.stderr)
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument('infile', type=click.File('rb'))
+@click.argument('outfile', type=click.File('wb'))
+@click.option('--catalog', type=click.Path(exists=True, dir_okay=False),
+              help='compiled catalog to price infile carts against')
+@click.option('--input-format', type=click.Choice(['json', 'binary']),
+              default='json', help='binary requires --catalog')
+def analyze(infile: click.File, outfile: click.File, catalog: str,
+            input_format: str) -> None:
+    '''
+    Aggregates of the priced carts: revenue, delivery fee revenue per tier,
+    units sold and discount cost per article
+    usage:
+    zm-cli analyze level3/data.json report.json
+    zm-cli analyze --catalog catalog.zmc --input-format binary \\
+        carts.zmb report.json
+    '''
+    if catalog is None:
+        if input_format == 'binary':
+            raise click.UsageError('--input-format binary needs --catalog')
+        return pricing(infile, outfile, analytics.analyze)
+
+    def report(batch: CartBatch) -> dict:
+        analyzer.add(batch)
+        return analyzer.report()
+
+    with CompiledCatalog.open(catalog) as compiled:
+        analyzer = analytics.Analyzer(compiled)
+        if input_format == 'binary':
+            return pricing(infile, outfile, report, decode=wire.decode_carts)
+        return pricing(infile, outfile, lambda data: report(
+            CartBatch.from_data(data)))
+
+
+@cli.command('scenarios')
+@click.argument('infile', type=click.File('rb'))
+@click.argument('outfile', type=click.File('wb'))
+@click.option('--summary-only', is_flag=True,
+              help='scenario summaries without the totals of each cart')
+def price_scenarios(infile: click.File, outfile: click.File,
+                    summary_only: bool) -> None:
+    '''
+    Prices the carts of a level3 input against its catalog and each of its
+    scenarios (catalog variants), with the revenue change of each scenario
+    usage:
+    zm-cli scenarios what-if.json matrix.json
+    zm-cli scenarios --summary-only what-if.json summary.json
+    '''
+    pricing(infile, outfile, functools.partial(
+        scenarios.evaluate, carts=not summary_only))
+
+
+@cli.command('engines')
+def list_engines() -> None:
+    '''
+    Lists pricing engines and the levels they support
+    '''
+    for name in engines.names():
+        engine = engines.get(name)
+        click.echo('{}\tlevels {}\t{}'.format(
+            name, ','.join(map(str, engine.levels)), engine.description))
+
+
+@cli.command('diff-engines')
+@click.option('--cases', type=int, default=1000, help='random payloads')
+@click.option('--seed', type=int, default=0)
+@click.option('--engine', 'names', multiple=True,
+              type=click.Choice(engines.names()),
+              help='engines to check, all by default')
+def diff_engines(cases: int, seed: int, names: tuple) -> None:
+    '''
+    Prices random payloads with the level processors and the engines and
+    reports any difference in output or exception type
+    usage:
+    zm-cli diff-engines --cases 10000 --seed 1 --engine fused
+    '''
+    report = differential.run(cases, seed, names or None)
+    for mismatch in report.mismatches:
+        click.echo(json.dumps(mismatch._asdict(), sort_keys=True))
+    click.echo('{} cases, {} mismatches'.format(
+        report.cases, len(report.mismatches)), err=True)
+    if report.mismatches:
+        sys.exit(1)
+
+
+@cli.command('compile-catalog')
+@click.argument('infile', type=click.File('rb'))
+@click.argument('outfile', type=click.File('wb'))
+@click.option('--strict-fees', is_flag=True,
+              help='reject delivery fee tiers that overlap or leave gaps')
+def compile_catalog(infile: click.File, outfile: click.File,
+                    strict_fees: bool) -> None:
+    '''
+    Compiles articles, delivery fees and discounts of infile into a binary
+    catalog that can be mmap-ed by level3 --catalog and serve --catalog
+    usage:
+    zm-cli compile-catalog data.json catalog.zmc
+    zm-cli compile-catalog --strict-fees data.json catalog.zmc
+    '''
+    try:
+        with read_input(infile) as raw:
+            data = decode_json(raw)
+        outfile.write(CompiledCatalog.compile(data, strict_fees=strict_fees))
+        outfile.flush()
+    except:
+        print(traceback.format_exception(*sys.exc_info())[-1], file=sys.stderr)
+        sys.exit(1)
+
+
+@cli.command('encode-carts')
+@click.argument('infile', type=click.File('rb'))
+@click.argument('outfile', type=click.File('wb'))
+@click.option('--width', type=click.Choice(['4', '8']), default='4',
+              help='integer size in bytes')
+def encode_carts(infile: click.File, outfile: click.File, width: str) -> None:
+    '''
+    Converts the carts of a JSON input to the binary wire format
+    usage:
+    zm-cli encode-carts data.json carts.zmb
+    '''
+    pricing(infile, outfile, CartBatch.from_data,
+            encode=lambda batch: wire.encode_carts(batch, int(width)))
 
 
 @cli.command()
 @click.argument('host', type=str, default='127.0.0.1')
 @click.argument('port', type=int, default=8888)
-def serve(host: str, port: int):
+@click.option('--catalog', type=click.Path(exists=True, dir_okay=False),
+              help='compiled (or JSON) catalog served on /api/catalog/price')
+@click.option('--watch-catalog', type=float, default=None,
+              help='reload --catalog when its file changes, checking every '
+              'that many seconds')
+@click.option('--batch-delay', type=float, default=None,
+              help='micro-batch /api/level3/price requests for up to that '
+              'many milliseconds')
+@click.option('--batch-carts', type=int, default=1000,
+              help='flush micro-batches as soon as they hold that many carts')
+@click.option('--cache-size', type=int, default=0,
+              help='number of cached responses, 0 disables the cache')
+@click.option('--cache-ttl', type=float, default=60,
+              help='cached responses lifetime in seconds')
+@click.option('--max-body-size', type=int, default=None,
+              help='bytes, larger requests get 413 (64 MiB by default)')
+@click.option('--max-carts', type=int, default=None,
+              help='carts per request, more get 413')
+@click.option('--max-items', type=int, default=None,
+              help='cart items per request, more get 413')
+@click.option('--max-in-flight', type=int, default=None,
+              help='concurrent pricing jobs, more get 503')
+@click.option('--slow-log-ms', type=float, default=None,
+              help='log requests slower than that many milliseconds')
+@click.option('--slow-log-sample', type=float, default=0,
+              help='probability to log any other request')
+@click.option('--slow-log-file', type=click.File('a'), default=None,
+              help='write slow log JSON lines there instead of logging')
+@click.option('--parallel-workers', type=int, default=None,
+              help='price huge requests on that many worker processes')
+@click.option('--parallel-min-carts', type=int, default=100000,
+              help='requests with that many carts are priced in parallel')
+@click.option('--engine', type=click.Choice(engines.names()),
+              default=engines.DEFAULT_ENGINE,
+              help='default pricing engine, ?engine=NAME overrides it')
+@click.option('--compress-min-size', type=int, default=None,
+              help='bytes, smaller responses are never compressed (1024 by '
+              'default)')
+@click.option('--no-compression', is_flag=True,
+              help='never compress responses')
+@click.option('--server-timing', is_flag=True,
+              help='add Server-Timing headers to pricing responses, clients '
+              'switch them with X-Server-Timing: 1 or 0')
+@click.option('--unix', 'unix_socket', type=click.Path(dir_okay=False),
+              default=None,
+              help='also listen on that Unix socket, see levelN --daemon')
+@click.option('--warmup-rounds', type=int, default=3,
+              help='runs of each route on synthetic payloads at startup, '
+              '/ready answers 200 once they are done (0 disables them)')
+@click.option('--stream-min-size', type=int, default=None,
+              help='bytes, larger JSON payloads are priced while they are '
+              'received (1 MiB by default)')
+@click.option('--no-streaming', is_flag=True,
+              help='read whole payloads before pricing them')
+def serve(host: str, port: int, catalog: str, watch_catalog: float,
+          batch_delay: float, batch_carts: int, cache_size: int,
+          cache_ttl: float, slow_log_ms: float, slow_log_sample: float,
+          slow_log_file: click.File, parallel_workers: int,
+          parallel_min_carts: int, engine: str, compress_min_size: int,
+          no_compression: bool, server_timing: bool, unix_socket: str,
+          warmup_rounds: int, stream_min_size: int, no_streaming: bool,
+          **limits):
     '''
     run zenmarket as webserver on port <port>
 
     usage:
 
     zenmarket serve --port 8080
+    zenmarket serve --catalog catalog.zmc
+    zenmarket serve --catalog catalog.zmc --watch-catalog 1
+    zenmarket serve --batch-delay 2 --batch-carts 5000
+    zenmarket serve --cache-size 1024 --cache-ttl 30
+    zenmarket serve --max-body-size 10000000 --max-in-flight 8
+    zenmarket serve --slow-log-ms 200 --slow-log-sample 0.01
+    zenmarket serve --parallel-workers 8 --parallel-min-carts 100000
+    zenmarket serve --engine fused
+    zenmarket serve --compress-min-size 4096
+    zenmarket serve --server-timing
+    zenmarket serve --unix /tmp/zenmarket.sock
+    zenmarket serve --warmup-rounds 10
+    zenmarket serve --stream-min-size 65536
+    '''
+    # imported here so that other commands, --daemon clients above all,
+    # don't pay for aiohttp
+    from zenmarket import app  # pylint: disable=import-outside-toplevel
+    config = app.ServerConfig(
+        catalog=catalog,
+        batch_delay=None if batch_delay is None else batch_delay / 1000,
+        batch_carts=batch_carts,
+        cache_size=cache_size,
+        cache_ttl=cache_ttl,
+        limits=app.Limits()._replace(**{
+            name: value for name, value in limits.items()
+            if value is not None}),
+        slow_log_threshold=None if slow_log_ms is None else slow_log_ms / 1000,
+        slow_log_sample=slow_log_sample,
+        parallel_workers=parallel_workers,
+        parallel_min_carts=parallel_min_carts,
+        engine=engine,
+        catalog_watch=watch_catalog,
+        server_timing=server_timing,
+        warmup_rounds=warmup_rounds)
+    if no_compression:
+        config = config._replace(compress_min_size=None)
+    elif compress_min_size is not None:
+        config = config._replace(compress_min_size=compress_min_size)
+    if no_streaming:
+        config = config._replace(stream_min_size=None)
+    elif stream_min_size is not None:
+        config = config._replace(stream_min_size=stream_min_size)
+    if watch_catalog is not None and catalog is None:
+        raise click.UsageError('--watch-catalog needs --catalog')
+    if slow_log_file is not None:
+        config = config._replace(slow_log_sink=StreamSink(slow_log_file))
+    app.run_app(host=host, port=port, config=config, path=unix_socket)
+
+
+@cli.command('client-bench')
+@click.argument('url', type=str)
+@click.argument('infile', type=click.File('rb'))
+@click.option('--level', type=click.Choice(['1', '2', '3']), default='3')
+@click.option('--calls', type=int, default=1000,
+              help='pricing calls, each with one cart of infile in turn')
+@click.option('--concurrency', type=int, default=32,
+              help='requests in flight')
+@click.option('--batch-delay', type=float, default=2,
+              help='milliseconds calls wait to be coalesced')
+@click.option('--mode', 'modes', multiple=True,
+              type=click.Choice(['coalesced', 'pooled', 'naive']),
+              help='client modes to compare, all of them by default')
+def client_bench(url: str, infile: click.File, level: str, calls: int,
+                 concurrency: int, batch_delay: float, modes: tuple) -> None:
+    '''
+    Benchmarks zenmarket.client against the server at <url>: <calls> small
+    pricing calls of the catalog of infile, coalesced, pooled without
+    coalescing and one connection per call
+
+    usage:
+
+    zm-cli client-bench http://127.0.0.1:8888 level3/data.json --calls 5000
+    '''
+    # pylint: disable=import-outside-toplevel
+    import asyncio
+    from zenmarket import client as pricing_client
+    data = decode_json(infile.read())
+    carts = data.get('carts') or [{'id': 0, 'items': []}]
+    inputs = [dict(data, carts=[carts[call % len(carts)]])
+              for call in range(calls)]
+    for mode in modes or ('coalesced', 'pooled', 'naive'):
+        result = asyncio.run(pricing_client.benchmark(
+            url, int(level), inputs, mode, concurrency=concurrency,
+            batch_delay=batch_delay / 1000))
+        click.echo(result.format())
+
+
+@cli.command()
+@click.argument('host', type=str, default='127.0.0.1')
+@click.argument('port', type=int, default=8080)
+@click.option('--backend', 'backends', multiple=True, required=True,
+              help='base URL of a zm-cli serve process, repeat for each')
+@click.option('--replicas', type=int, default=100,
+              help='points of each backend on the hash ring')
+@click.option('--health-interval', type=float, default=2,
+              help='seconds between backend health checks, 0 disables them')
+@click.option('--timeout', type=float, default=60,
+              help='seconds allowed to a backend to answer')
+@click.option('--pool-size', type=int, default=100,
+              help='keep-alive connections per backend')
+def router(host: str, port: int, backends: tuple, replicas: int,
+           health_interval: float, timeout: float, pool_size: int):
+    '''
+    run a catalog-affinity router on port <port>: requests go to the
+    backends by content hash of their catalog
+
+    usage:
+
+    zenmarket router --backend http://10.0.0.1:8888 --backend http://10.0.0.2:8888
+    zenmarket router 0.0.0.0 8080 --backend http://10.0.0.1:8888 --replicas 200
     '''
-    app.run_app(host=host, port=port)
+    # pylint: disable=import-outside-toplevel
+    from zenmarket.server import router as routing
+    routing.run_router(host=host, port=port, config=routing.RouterConfig(
+        backends=tuple(backend.rstrip('/') for backend in backends),
+        replicas=replicas,
+        health_interval=health_interval or None,
+        timeout=timeout,
+        pool_size=pool_size))
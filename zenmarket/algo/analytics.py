@@ -0,0 +1,147 @@
+'''
+Aggregate analytics over priced carts: revenue, delivery fee revenue per
+tier, units sold and discount cost per article.
+
+Aggregates are accumulated in one pass over the columnar carts, next to the
+pricing itself, into lists indexed like the compiled catalog sections; no
+per-cart response is built. They are Python ints, which can't overflow.
+Batches can be added one after the other, so inputs larger than memory are
+analyzed chunk by chunk:
+
+>>> analyzer = Analyzer(CompiledCatalog.open('catalog.zmc'))
+>>> for batch in batches:
+...     analyzer.add(batch)
+>>> analyzer.report()
+{'carts': 3, 'lines': 9, 'revenue': 6118, ...}
+'''
+from zenmarket.algo import level2
+from zenmarket.algo.catalog import INT64_MAX, CartBatch, CompiledCatalog
+
+# pylint: disable=too-few-public-methods
+
+
+class Analyzer:
+    '''
+    Accumulates aggregates of the carts priced against a compiled catalog.
+    Errors are the ones level3.price would raise for the carts added so far:
+    undefined articles are raised by add, negative totals and fee
+    interpolation errors by report. add leaves the aggregates as they were
+    when it raises.
+    '''
+
+    def __init__(self, compiled: CompiledCatalog):
+        self.compiled = compiled
+        self.carts = 0
+        self.lines = 0
+        self.units = [0] * len(compiled.article_ids)
+        self.tier_carts = [0] * len(compiled.fee_x)
+        self.negative = None  # (cart_id, total) of the first negative cart
+        self.beyond_tiers = False
+        self._known = {}
+
+    def add(self, batch: CartBatch) -> None:
+        '''
+        Prices the carts of batch and adds them to the aggregates, once the
+        whole batch is priced
+        :raises UndefinedArticleReference
+        '''
+        known = self._known
+        prices = self.compiled.prices
+        article_index = self.compiled.article_index
+        article_ids, quantities = batch.article_ids, batch.quantities
+        offsets = batch.offsets
+        has_fees = self.compiled.has_delivery_fees
+        tier = self.compiled.fee_table.tier
+        units, tier_carts = {}, {}
+        negative, beyond_tiers = self.negative, False
+        for i in range(len(batch.ids)):
+            total = 0
+            for j in range(offsets[i], offsets[i + 1]):
+                article_id = article_ids[j]
+                try:
+                    index = known[article_id]
+                except KeyError:
+                    index = known[article_id] = article_index(article_id)
+                quantity = quantities[j]
+                units[index] = units.get(index, 0) + quantity
+                total += prices[index] * quantity
+            if total < 0:
+                if negative is None:
+                    negative = (batch.ids[i], total)
+            elif has_fees:
+                try:
+                    index = tier(total)
+                except level2.InterpolationError:
+                    beyond_tiers = True
+                else:
+                    tier_carts[index] = tier_carts.get(index, 0) + 1
+        for index, count in units.items():
+            self.units[index] += count
+        for index, count in tier_carts.items():
+            self.tier_carts[index] += count
+        self.negative = negative
+        self.beyond_tiers = self.beyond_tiers or beyond_tiers
+        self.carts += len(batch.ids)
+        self.lines += len(article_ids)
+
+    def report(self) -> dict:
+        '''
+        :returns {'carts': <count>, 'lines': <count>,
+                  'revenue': <totals with fees>,
+                  'merchandise': <totals before fees>,
+                  'fee_revenue': <fees>, 'discount_cost': <discounts>,
+                  'fee_tiers': [{'max_price': <max_price>, 'fee': <fee>,
+                                 'carts': <count>, 'revenue': <fees>}, ...],
+                  'articles': [{'id': <id>, 'units': <count>,
+                                'revenue': <units * discounted price>,
+                                'discount_cost': <units * discount>}, ...]}
+        articles lists the articles sold, by id
+        :raises colander.Invalid, InterpolationError
+        '''
+        compiled = self.compiled
+        if self.negative is not None:
+            CompiledCatalog.response(*zip(self.negative))
+        if self.beyond_tiers:
+            raise level2.InterpolationError('Unknown error')
+        articles = []
+        merchandise = discount_cost = 0
+        for index, units in enumerate(self.units):
+            if not units:
+                continue
+            revenue = units * compiled.prices[index]
+            discount = units * (
+                compiled.base_prices[index] - compiled.prices[index])
+            merchandise += revenue
+            discount_cost += discount
+            articles.append({
+                'id': compiled.article_ids[index],
+                'units': units,
+                'revenue': revenue,
+                'discount_cost': discount,
+            })
+        fee_tiers = [
+            {'max_price': None if max_price == INT64_MAX else max_price,
+             'fee': fee, 'carts': carts, 'revenue': carts * fee}
+            for max_price, fee, carts in zip(
+                compiled.fee_x, compiled.fee_y, self.tier_carts)
+        ]
+        fee_revenue = sum(tier['revenue'] for tier in fee_tiers)
+        return {
+            'carts': self.carts,
+            'lines': self.lines,
+            'revenue': merchandise + fee_revenue,
+            'merchandise': merchandise,
+            'fee_revenue': fee_revenue,
+            'discount_cost': discount_cost,
+            'fee_tiers': fee_tiers,
+            'articles': articles,
+        }
+
+
+def analyze(data: dict) -> dict:
+    '''
+    Compiles the catalog part of level1/2/3 data and aggregates its carts
+    '''
+    analyzer = Analyzer(CompiledCatalog.from_data(data))
+    analyzer.add(CartBatch.from_data(data))
+    return analyzer.report()
@@ -0,0 +1,391 @@
+'''
+Compiled catalog: a fixed-layout binary snapshot of articles, delivery fees
+and discounts that can be mmap-ed and used for pricing without any parsing.
+
+File layout (little-endian):
+
+    header   magic b'ZMC1', uint32 version, uint32 flags, uint32 reserved,
+             int64 n_articles, int64 n_fees, int64 n_discounts
+    int64    article_ids[n_articles]           (sorted ascending)
+    int64    base_prices[n_articles]           (price before discount)
+    int64    prices[n_articles]                (discounted price)
+    int64    fee_x[n_fees]                     (max_price, INT64_MAX for null)
+    int64    fee_y[n_fees]                     (delivery fee)
+    int64    discount_article_ids[n_discounts]
+    int64    discount_types[n_discounts]       (1: amount, 2: percentage)
+    int64    discount_values[n_discounts]
+
+Fee breakpoints are the ones computed by
+`L2CartProcessor.DeliveryFeeFunction.from_list`, discounted prices the ones
+computed by `L3CartProcessor.stack_discounts` (all the discounts of an
+article, in input order), so pricing a cart against a compiled
+catalog gives the same totals as `level3.price`.
+'''
+import bisect
+import hashlib
+import mmap
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+import colander
+
+from zenmarket import model
+from zenmarket.algo import level1, level3
+from zenmarket.algo.fees import INT64_MAX, FeeTable
+
+# pylint: disable=too-few-public-methods
+
+MAGIC = b'ZMC1'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIqqq')
+
+FLAG_DELIVERY_FEES = 1
+
+DISCOUNT_TYPES = {'amount': 1, 'percentage': 2}
+
+
+class BadCatalogFormat(Exception):
+    '''
+    Exception raised when a buffer is not a compiled catalog
+    '''
+    pass
+
+
+class CartBatch(namedtuple('CartBatch', [
+        'ids', 'offsets', 'article_ids', 'quantities'])):
+    '''
+    Columnar representation of carts:
+    items of cart ids[i] are article_ids[offsets[i]:offsets[i + 1]]
+    (resp. quantities), so len(offsets) == len(ids) + 1
+    '''
+
+    @property
+    def cart_count(self):
+        '''
+        :returns number of carts in the batch
+        '''
+        return len(self.ids)
+
+    @classmethod
+    def from_list(cls, carts):
+        '''
+        Builds a batch from validated carts:
+        [{"id": 1, "items": [{"article_id": 1, "quantity": 6}]}]
+        '''
+        ids, offsets = array('q'), array('q', [0])
+        article_ids, quantities = array('q'), array('q')
+        for cart in carts:
+            ids.append(cart['id'])
+            for item in cart['items']:
+                article_ids.append(item['article_id'])
+                quantities.append(item['quantity'])
+            offsets.append(len(article_ids))
+        return cls(ids, offsets, article_ids, quantities)
+
+    @classmethod
+    def concat(cls, batches):
+        '''
+        :returns a batch holding the carts of batches, in order
+        '''
+        ids, offsets = array('q'), array('q', [0])
+        article_ids, quantities = array('q'), array('q')
+        for batch in batches:
+            base = len(article_ids)
+            ids.extend(batch.ids)
+            offsets.extend(base + offset for offset in batch.offsets[1:])
+            article_ids.extend(batch.article_ids)
+            quantities.extend(batch.quantities)
+        return cls(ids, offsets, article_ids, quantities)
+
+    @staticmethod
+    def validate(data: dict) -> list:
+        '''
+        :returns validated data['carts']
+        :raises BadDataFormat
+        '''
+        try:
+            return model.CartsDesc().deserialize(
+                {'carts': data.get('carts', colander.null)})['carts']
+        except colander.Invalid as exc:
+            raise level1.BadDataFormat(exc.msg)
+
+    @classmethod
+    def from_valid_list(cls, carts: list):
+        '''
+        from_list raising BadDataFormat for values out of int64 range
+        '''
+        try:
+            return cls.from_list(carts)
+        except OverflowError as exc:
+            raise level1.BadDataFormat(str(exc))
+
+    @classmethod
+    def from_data(cls, data: dict):
+        '''
+        Validates data['carts'] and builds the matching batch
+        :raises BadDataFormat
+        '''
+        return cls.from_valid_list(cls.validate(data))
+
+
+class CompiledCatalog:
+    '''
+    Read-only view over a compiled catalog buffer (bytes or mmap)
+
+    >>> compiled = CompiledCatalog.from_data(data)
+    >>> compiled.price(CartBatch.from_data(data)) == level3.price(data)
+    True
+    '''
+
+    def __init__(self, buffer, closer=None):
+        if sys.byteorder != 'little':
+            raise BadCatalogFormat('compiled catalogs are little-endian')
+        self._closer = closer
+        self._digest = None
+        self._view = memoryview(buffer)
+        try:
+            (magic, version, self.flags, _, n_articles, n_fees,
+             n_discounts) = HEADER.unpack_from(self._view)
+        except struct.error:
+            raise BadCatalogFormat('truncated header')
+        if magic != MAGIC or version != VERSION:
+            raise BadCatalogFormat(
+                'Unknown catalog format {!r} v{}'.format(magic, version))
+        words = self._view[HEADER.size:]
+        if len(words) != 8 * (3 * n_articles + 2 * n_fees + 3 * n_discounts):
+            raise BadCatalogFormat('truncated catalog')
+        self._words = words.cast('q')
+
+        sections = []
+        start = 0
+        for size in (n_articles, n_articles, n_articles, n_fees, n_fees,
+                     n_discounts, n_discounts, n_discounts):
+            sections.append(self._words[start:start + size])
+            start += size
+        (self.article_ids, self.base_prices, self.prices, self.fee_x,
+         self.fee_y, self.discount_article_ids, self.discount_types,
+         self.discount_values) = sections
+        self.fee_table = FeeTable(self.fee_x, self.fee_y)
+
+    @classmethod
+    def compile(cls, data: dict, strict_fees: bool = False) -> bytes:
+        '''
+        Validates catalog data and serializes it
+        :param data dict: {'articles': [...], 'delivery_fees': [...],
+                           'discounts': [...]}, extra keys are ignored
+        :param strict_fees: reject delivery fee tiers that overlap or leave
+            gaps (FeeCoverageError)
+        :returns compiled catalog bytes
+        :raises BadDataFormat, PriceRangeError
+        '''
+        try:
+            catalog = model.CatalogDesc().deserialize(data)
+        except colander.Invalid as exc:
+            raise level1.BadDataFormat(exc.msg)
+
+        discounts = level3.L3CartProcessor.stack_discounts(
+            catalog['discounts'])
+        base_prices = {
+            article['id']: article['price'] for article in catalog['articles']}
+        article_ids = sorted(base_prices)
+
+        flags, fee_x, fee_y = 0, [], []
+        if 'delivery_fees' in data:
+            flags |= FLAG_DELIVERY_FEES
+            fee_table = FeeTable.from_list(
+                catalog['delivery_fees'], strict=strict_fees)
+            fee_x, fee_y = fee_table.max_prices, fee_table.fees_by_tier
+
+        try:
+            words = array('q', article_ids)
+            words.extend(base_prices[art_id] for art_id in article_ids)
+            words.extend(
+                discounts.get(art_id, lambda _: _)(base_prices[art_id])
+                for art_id in article_ids)
+            words.extend(fee_x)
+            words.extend(fee_y)
+            for key in ('article_id', 'type', 'value'):
+                words.extend(
+                    DISCOUNT_TYPES.get(discount[key], discount[key])
+                    for discount in catalog['discounts'])
+        except OverflowError as exc:
+            raise level1.BadDataFormat(str(exc))
+
+        header = HEADER.pack(
+            MAGIC, VERSION, flags, 0, len(article_ids), len(fee_x),
+            len(catalog['discounts']))
+        return header + words.tobytes()
+
+    @classmethod
+    def from_data(cls, data: dict, strict_fees: bool = False):
+        '''
+        :returns in-memory compiled catalog for data
+        '''
+        return cls(cls.compile(data, strict_fees))
+
+    @classmethod
+    def write(cls, data: dict, path: str, strict_fees: bool = False) -> None:
+        '''
+        Compiles data to file path
+        '''
+        with open(path, 'wb') as fp:
+            fp.write(cls.compile(data, strict_fees))
+
+    @classmethod
+    def open(cls, path: str):
+        '''
+        Maps a compiled catalog file in memory. Pages are shared between the
+        processes mapping the same file.
+        '''
+        with open(path, 'rb') as fp:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(mapped, closer=mapped.close)
+        except BadCatalogFormat:
+            mapped.close()
+            raise
+
+    def close(self) -> None:
+        '''
+        Releases the buffer, the catalog is unusable afterwards
+        '''
+        for name in ('article_ids', 'base_prices', 'prices', 'fee_x',
+                     'fee_y', 'discount_article_ids', 'discount_types',
+                     'discount_values', '_words', '_view'):
+            getattr(self, name).release()
+        if self._closer is not None:
+            self._closer()
+            self._closer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def buffer(self) -> memoryview:
+        '''
+        Compiled catalog bytes
+        '''
+        return self._view
+
+    @property
+    def digest(self) -> str:
+        '''
+        Content hash of the compiled catalog
+        '''
+        if self._digest is None:
+            self._digest = hashlib.sha256(self._view).hexdigest()
+        return self._digest
+
+    @property
+    def has_delivery_fees(self) -> bool:
+        '''
+        True when delivery fees were defined (level2 and level3 inputs)
+        '''
+        return bool(self.flags & FLAG_DELIVERY_FEES)
+
+    def article_index(self, article_id: int) -> int:
+        '''
+        :returns index of article_id in the article sections
+        :raises UndefinedArticleReference
+        '''
+        index = bisect.bisect_left(self.article_ids, article_id)
+        if index == len(self.article_ids) or \
+                self.article_ids[index] != article_id:
+            raise level1.UndefinedArticleReference(
+                'Article(id={}) is not defined'.format(article_id))
+        return index
+
+    def article_price(self, article_id: int) -> int:
+        '''
+        :returns discounted price of article_id
+        '''
+        return self.prices[self.article_index(article_id)]
+
+    def fee(self, total: int) -> int:
+        '''
+        Same semantics as L2CartProcessor.DeliveryFeeFunction
+        '''
+        if not self.has_delivery_fees:
+            return 0
+        return self.fee_table.fee(total)
+
+    def subtotals(self, batch: CartBatch) -> list:
+        '''
+        :returns cart totals before delivery fees in batch order
+        '''
+        known = {}
+        prices = self.prices
+        article_index = self.article_index
+        article_ids, quantities = batch.article_ids, batch.quantities
+        offsets = batch.offsets
+        totals = []
+        for i in range(len(batch.ids)):
+            total = 0
+            for j in range(offsets[i], offsets[i + 1]):
+                article_id = article_ids[j]
+                try:
+                    aprice = known[article_id]
+                except KeyError:
+                    aprice = known[article_id] = prices[
+                        article_index(article_id)]
+                total += aprice * quantities[j]
+            totals.append(total)
+        return totals
+
+    def totals(self, batch: CartBatch) -> list:
+        '''
+        :returns cart totals (delivery fees included) in batch order
+        '''
+        return self.with_fees(batch.ids, self.subtotals(batch))
+
+    def with_fees(self, cart_ids, subtotals: list) -> list:
+        '''
+        :returns subtotals of cart_ids plus their delivery fees
+        '''
+        if not self.has_delivery_fees:
+            return subtotals
+        # as level2/level3.price: fees are evaluated once all the articles
+        # are known to exist and totals before fees passed the output schema
+        if any(total < 0 for total in subtotals):
+            self.response(cart_ids, subtotals)
+        return [total + fee for total, fee in zip(
+            subtotals, self.fee_table.fees(subtotals))]
+
+    @staticmethod
+    def response(cart_ids, totals) -> dict:
+        '''
+        :returns {'carts': [{'id': <id>, 'total': <total>}, ...]}
+        '''
+        response = {'carts': [
+            {'id': cart_id, 'total': total}
+            for cart_id, total in zip(cart_ids, totals)
+        ]}
+        if any(total < 0 for total in totals):
+            # let the output schema raise the same error as level3.price
+            response = model.ResponseDesc().deserialize(response)
+        return response
+
+    def price(self, batch: CartBatch) -> dict:
+        '''
+        :returns {'carts': [{'id': <id>, 'total': <total>}, ...]}
+        '''
+        return self.response(batch.ids, self.totals(batch))
+
+    def price_data(self, data: dict) -> dict:
+        '''
+        Prices data['carts'] against this catalog, any articles, fees or
+        discounts in data are ignored
+        '''
+        return self.price(CartBatch.from_data(data))
+
+
+def price(data: dict) -> dict:
+    '''
+    Compiles the catalog part of data and prices its carts
+    '''
+    return CompiledCatalog.from_data(data).price_data(data)
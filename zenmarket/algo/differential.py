@@ -0,0 +1,221 @@
+'''
+Differential testing of pricing engines against the level processors.
+
+Randomized level1/2/3 payloads are biased towards the corners of the
+reference semantics: cart totals landing exactly on fee breakpoints
+(bisect_right), null max_price tiers or their absence, floor division of
+percentage discounts, amount discounts leading to negative totals,
+undefined article references, duplicate ids and invalid tiers. Some
+payloads are also perturbed with extra keys, numbers sent as strings and
+integers out of the int64 range. Every payload is priced by the level
+module and by every registered engine; the outputs, or the exception
+types, must be identical, but for the divergences documented in
+zenmarket.algo.engines, where the engine must give the documented outcome.
+
+>>> report = run(cases=1000, seed=42)
+>>> report.mismatches
+[]
+'''
+import copy
+import random
+from collections import namedtuple
+
+from zenmarket.algo import engines, level1, level2, level3
+
+# pylint: disable=too-few-public-methods
+
+LEVEL_PRICES = {1: level1.price, 2: level2.price, 3: level3.price}
+
+INT64 = range(-2 ** 63, 2 ** 63)
+
+
+class Mismatch(namedtuple('Mismatch', [
+        'level', 'engine', 'data', 'expected', 'actual'])):
+    '''
+    An engine outcome differing from the reference one
+    '''
+    pass
+
+
+class Report(namedtuple('Report', ['cases', 'mismatches'])):
+    '''
+    Result of a differential run
+    '''
+    pass
+
+
+def outcome(price, level: int, data: dict):
+    '''
+    :returns ('ok', response) or ('error', exception type name)
+    '''
+    try:
+        return 'ok', price(level, copy.deepcopy(data))
+    except Exception as exc:  # pylint: disable=broad-except
+        return 'error', '{}.{}'.format(
+            type(exc).__module__, type(exc).__name__)
+
+
+def generate_fees(rng: random.Random) -> list:
+    '''
+    :returns delivery fee tiers, mostly contiguous and ending with a null
+    max_price
+    '''
+    bounds = sorted(rng.sample(range(100, 3000, 100), rng.randint(0, 4)))
+    lows = [0] + bounds
+    highs = bounds + [None]
+    if rng.random() < 0.1:
+        highs[-1] = lows[-1] + 500  # no null tier: big totals overflow
+    fees = [
+        {'eligible_transaction_volume': {'min_price': low, 'max_price': high},
+         'price': rng.choice([0, 100, 400, 800])}
+        for low, high in zip(lows, highs)
+    ]
+    if rng.random() < 0.05:
+        tier = rng.choice(fees)['eligible_transaction_volume']
+        tier['max_price'] = tier['min_price']  # PriceRangeError
+    rng.shuffle(fees)
+    return fees
+
+
+def generate_discounts(rng: random.Random, article_ids: list) -> list:
+    '''
+    :returns discounts, sometimes on undefined or repeated articles
+    '''
+    discounts = []
+    for _ in range(rng.randint(0, len(article_ids) + 1)):
+        kind = rng.choice(['amount', 'percentage'])
+        if kind == 'amount':
+            value = rng.choice([0, 1, 25, 99, 150, 300])
+        else:
+            value = rng.choice([0, 1, 30, 33, 50, 99, 100])
+            if rng.random() < 0.03:
+                value = 101  # BadDataFormat
+        discounts.append({
+            'article_id': rng.choice(article_ids + [999]),
+            'type': kind,
+            'value': value,
+        })
+    return discounts
+
+
+def generate(rng: random.Random, level: int) -> dict:
+    '''
+    :returns a random level input
+    '''
+    article_ids = rng.sample(range(1, 20), rng.randint(1, 6))
+    articles = [
+        {'id': article_id, 'name': 'article{}'.format(article_id),
+         'price': rng.choice([0, 1, 3, 7, 50, 99, 100, 200, 333, 999, 1000])}
+        for article_id in article_ids
+    ]
+    if rng.random() < 0.05:
+        articles.append(dict(articles[0], price=articles[0]['price'] + 1))
+    carts = []
+    for cart_id in range(rng.randint(0, 5)):
+        items = [
+            {'article_id': rng.choice(article_ids),
+             'quantity': rng.choice([0, 1, 1, 2, 3, 10])}
+            for _ in range(rng.randint(0, 4))
+        ]
+        if items and rng.random() < 0.03:
+            items[0]['article_id'] = 999  # UndefinedArticleReference
+        carts.append({'id': cart_id, 'items': items})
+    data = {'articles': articles, 'carts': carts}
+    if level >= 2:
+        data['delivery_fees'] = generate_fees(rng)
+    if level >= 3:
+        data['discounts'] = generate_discounts(rng, article_ids)
+    if rng.random() < 0.02:
+        data['carts'].append({'id': 'x', 'items': []})  # BadDataFormat
+    return data
+
+
+def perturb(rng: random.Random, data: dict) -> dict:
+    '''
+    :returns data with an extra key, a number sent as a string or an
+    integer out of the int64 range
+    '''
+    data = copy.deepcopy(data)
+    kind = rng.choice(['extra_key', 'string', 'int64'])
+    if kind == 'extra_key':
+        target = rng.choice([data] + data['articles'] + data['carts'] + [
+            item for cart in data['carts'] for item in cart['items']])
+        target['color'] = 'red'
+    elif kind == 'string':
+        target = rng.choice(data['articles'] + [
+            item for cart in data['carts'] for item in cart['items']])
+        key = 'price' if 'price' in target else 'quantity'
+        target[key] = str(target[key])
+    else:
+        target = rng.choice(data['articles'] + data['carts'])
+        target['price' if 'price' in target else 'id'] = rng.choice(
+            [2 ** 63, 2 ** 64 + 1, 2 ** 70])
+    return data
+
+
+def out_of_int64(value) -> bool:
+    '''
+    :returns True when value holds an integer out of the int64 range
+    '''
+    if isinstance(value, dict):
+        return any(out_of_int64(item) for item in value.values())
+    if isinstance(value, list):
+        return any(out_of_int64(item) for item in value)
+    return isinstance(value, int) and value not in INT64
+
+
+def documented(engine: engines.Engine, level: int, data: dict,
+               expected: tuple) -> list:
+    '''
+    :returns outcomes engine may give, the reference one expected but for
+    the divergences documented in zenmarket.algo.engines
+    '''
+    if not isinstance(engine, engines.ValidatingEngine):
+        return [expected]
+    try:
+        valid = engine.validate(level, copy.deepcopy(data))
+    except Exception:  # pylint: disable=broad-except
+        return [expected]
+    if level == 3:
+        # the level3 processor reads its raw input
+        expected = outcome(
+            lambda _, data: LEVEL_PRICES[level](data), level, valid)
+    if isinstance(engine, engines.CompiledEngine) and out_of_int64(valid):
+        bad_data = 'error', '{}.{}'.format(
+            level1.BadDataFormat.__module__, level1.BadDataFormat.__name__)
+        # other errors of the input may be raised first
+        return [bad_data] if expected[0] == 'ok' else [bad_data, expected]
+    return [expected]
+
+
+def compare(level: int, data: dict, names=None) -> list:
+    '''
+    :returns Mismatch list of engines names (all engines supporting level by
+    default) against the level module
+    '''
+    expected = outcome(lambda _, data: LEVEL_PRICES[level](data), level, data)
+    mismatches = []
+    for name in names or engines.names():
+        engine = engines.get(name)
+        if not engine.supports(level):
+            continue
+        allowed = documented(engine, level, data, expected)
+        actual = outcome(engine.price, level, data)
+        if actual not in allowed:
+            mismatches.append(Mismatch(level, name, data, allowed[0], actual))
+    return mismatches
+
+
+def run(cases: int = 1000, seed: int = 0, names=None) -> Report:
+    '''
+    Compares engines on cases random payloads spread over the three levels
+    '''
+    rng = random.Random(seed)
+    mismatches = []
+    for case in range(cases):
+        level = case % 3 + 1
+        data = generate(rng, level)
+        if rng.random() < 0.1:
+            data = perturb(rng, data)
+        mismatches.extend(compare(level, data, names))
+    return Report(cases, mismatches)
@@ -0,0 +1,278 @@
+'''
+Pricing engine registry.
+
+An engine prices level1/2/3 inputs in three stages (validate, build, run) and
+declares the levels it supports. Engines give the same responses and raise
+the same exceptions as the reference engine, which wraps the
+L1/L2/L3CartProcessor classes, but for these inputs:
+
+- level3 inputs missing articles or carts, with extra article keys, or with
+  prices, quantities or discount values given as numeric strings: the
+  level3 processor reads them as they are and raises KeyError or TypeError,
+  the compiled and fused engines price the validated input (missing carts
+  are no carts, extra keys are dropped, numeric strings are numbers);
+- integers out of the int64 range (ids, prices, quantities, fee bounds,
+  totals): the compiled engine raises BadDataFormat, or another error of
+  the input, the reference and fused engines price them.
+
+>>> get('fused').price(3, data) == get('reference').price(3, data)
+True
+'''
+import colander
+
+from zenmarket import model
+from zenmarket.algo import level1, level2, level3
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+from zenmarket.algo.fees import FeeTable
+
+DEFAULT_ENGINE = 'reference'
+
+ENGINES = {}
+
+LEVEL_KEYS = {
+    1: ('articles', 'carts'),
+    2: ('articles', 'carts', 'delivery_fees'),
+    3: ('articles', 'carts', 'delivery_fees', 'discounts'),
+}
+
+
+class UnknownEngine(Exception):
+    '''
+    Exception raised when an engine is not registered or does not support
+    a level
+    '''
+    pass
+
+
+class Engine:
+    '''
+    Base class of pricing engines
+    '''
+    name = None
+    levels = ()
+    description = ''
+    # results match the compiled catalog the streaming path prices with
+    # whenever it succeeds, large requests may then be priced as received
+    streamable = False
+
+    def supports(self, level: int) -> bool:
+        '''
+        :returns True when the engine can price level inputs
+        '''
+        return level in self.levels
+
+    def validate(self, level: int, data: dict):
+        '''
+        :returns validated data
+        :raises BadDataFormat
+        '''
+        raise NotImplementedError
+
+    def build(self, level: int, data):
+        '''
+        :returns object priced by run
+        '''
+        raise NotImplementedError
+
+    def run(self, level: int, built) -> dict:
+        '''
+        :returns {'carts': [{'id': <id>, 'total': <total>}, ...]}
+        '''
+        raise NotImplementedError
+
+    def price(self, level: int, data: dict) -> dict:
+        '''
+        Runs all stages
+        '''
+        return self.run(level, self.build(level, self.validate(level, data)))
+
+
+class Validated:
+    '''
+    Stands for the input schema of a level processor whose input was
+    validated already, deserialize returns the validation result
+    '''
+
+    def __init__(self, valid):
+        self.valid = valid
+
+    def deserialize(self, _):
+        '''
+        :returns validation result
+        '''
+        return self.valid
+
+
+class ReferenceEngine(Engine):
+    '''
+    L1/L2/L3CartProcessor. The input is validated by the validate stage,
+    processors built from it skip their own input validation (the ones
+    they build internally still validate theirs)
+    '''
+    name = 'reference'
+    levels = (1, 2, 3)
+    description = 'level processors (reference semantics)'
+    processors = {
+        1: level1.L1CartProcessor,
+        2: level2.L2CartProcessor,
+        3: level3.L3CartProcessor,
+    }
+
+    def validate(self, level, data):
+        try:
+            valid = self.processors[level].input_validator.deserialize(data)
+        except colander.Invalid as exc:
+            raise level1.BadDataFormat(exc.msg)
+        return data, valid
+
+    def build(self, level, data):
+        data, valid = data
+        processor_class = self.processors[level]
+        processor = processor_class.__new__(processor_class)
+        processor.input_validator = Validated(valid)
+        processor.__init__(data)
+        return processor
+
+    def run(self, level, built):
+        return built.price()
+
+
+class ValidatingEngine(Engine):
+    '''
+    Engine working on the output of the level input schemas
+    '''
+    validators = {
+        1: model.L1InputDataDesc(),
+        2: model.L2InputDataDesc(),
+        3: model.L3InputDataDesc(),
+    }
+
+    def validate(self, level, data):
+        try:
+            valid = self.validators[level].deserialize(data)
+        except colander.Invalid as exc:
+            raise level1.BadDataFormat(exc.msg)
+        return {key: valid[key] for key in LEVEL_KEYS[level] if key in valid}
+
+
+class CompiledEngine(ValidatingEngine):
+    '''
+    Compiles the catalog then prices the columnar carts
+    '''
+    name = 'compiled'
+    levels = (1, 2, 3)
+    description = 'compiled catalog and columnar carts'
+    streamable = True
+
+    def build(self, level, data):
+        batch = CartBatch.from_valid_list(data['carts'])
+        try:
+            compiled = CompiledCatalog.from_data(data)
+        except level2.PriceRangeError:
+            # level processors build carts before fee functions
+            known = {article['id'] for article in data['articles']}
+            for article_id in batch.article_ids:
+                if article_id not in known:
+                    raise level1.UndefinedArticleReference(
+                        'Article(id={}) is not defined'.format(article_id))
+            raise
+        return compiled, batch
+
+    def run(self, level, built):
+        compiled, batch = built
+        return compiled.price(batch)
+
+
+class FusedEngine(ValidatingEngine):
+    '''
+    Single pass over plain dicts: discounted price table, cart totals and
+    delivery fees without intermediate objects
+    '''
+    name = 'fused'
+    levels = (1, 2, 3)
+    description = 'single pass over validated dicts'
+    streamable = True
+
+    def build(self, level, data):
+        discounts = level3.L3CartProcessor.stack_discounts(
+            data.get('discounts', ()))
+        prices = {}
+        for article in data['articles']:
+            discount = discounts.get(article['id'])
+            prices[article['id']] = article['price'] if discount is None \
+                else discount(article['price'])
+        return prices, data.get('delivery_fees'), data['carts']
+
+    def run(self, level, built):
+        prices, fee_data, carts = built
+        totals = []
+        for cart in carts:
+            total = 0
+            for item in cart['items']:
+                try:
+                    total += prices[item['article_id']] * item['quantity']
+                except KeyError:
+                    raise level1.UndefinedArticleReference(
+                        'Article(id={}) is not defined'.format(
+                            item['article_id']))
+            totals.append(total)
+        cart_ids = [cart['id'] for cart in carts]
+        if fee_data is not None:
+            # same order as the level processors: fee function is built once
+            # carts are, totals before fees go through the output schema
+            fee_table = FeeTable.from_list(fee_data)
+            if any(total < 0 for total in totals):
+                CompiledCatalog.response(cart_ids, totals)
+            totals = [total + fee for total, fee in zip(
+                totals, fee_table.fees(totals))]
+        return CompiledCatalog.response(cart_ids, totals)
+
+
+def register(engine: Engine) -> Engine:
+    '''
+    Adds engine to the registry
+    '''
+    ENGINES[engine.name] = engine
+    return engine
+
+
+def get(name: str, level: int = None) -> Engine:
+    '''
+    :returns engine name, checking it supports level when given
+    :raises UnknownEngine
+    '''
+    try:
+        engine = ENGINES[name]
+    except KeyError:
+        raise UnknownEngine('Unknown pricing engine {!r}'.format(name))
+    if level is not None and not engine.supports(level):
+        raise UnknownEngine('Engine {!r} does not support level{}'.format(
+            name, level))
+    return engine
+
+
+def resolve(name: str, level: int) -> Engine:
+    '''
+    :returns engine name, or the reference engine when it does not support
+    level
+    '''
+    engine = get(name)
+    return engine if engine.supports(level) else get(DEFAULT_ENGINE)
+
+
+def names() -> list:
+    '''
+    :returns registered engine names
+    '''
+    return sorted(ENGINES)
+
+
+def price(level: int, data: dict, engine: str = DEFAULT_ENGINE) -> dict:
+    '''
+    Prices level data with engine
+    '''
+    return get(engine, level).price(level, data)
+
+
+for _engine_class in (ReferenceEngine, CompiledEngine, FusedEngine):
+    register(_engine_class())
@@ -0,0 +1,201 @@
+'''
+Compiled delivery-fee functions.
+
+A FeeTable holds the breakpoints of `L2CartProcessor.DeliveryFeeFunction`
+(max_price of each tier, sorted, INT64_MAX standing for a null max_price)
+and evaluates whole arrays of cart totals at once with the same semantics:
+the fee of a total is the one of the first tier whose max_price is above
+it, totals beyond the last tier raise InterpolationError.
+
+When the finite breakpoints span at most DENSE_LIMIT units, totals below
+the last one are looked up in a bucket table (one fee per unit) instead of
+being bisected.
+
+Tier coverage (tiers starting at 0, each one starting where the previous
+one ends, the last one unbounded) is not required by the reference
+semantics; strict tables check it once, when they are built.
+
+>>> table = FeeTable.from_list(data['delivery_fees'], strict=True)
+>>> table.fees([0, 999, 1000, 2500])
+[800, 800, 400, 0]
+>>> zones = FeeTables.from_data({'paris': paris_fees, 'lyon': lyon_fees})
+>>> zones.fees([1200, 1200], ['paris', 'lyon'])
+[400, 600]
+'''
+import bisect
+from typing import List
+
+from zenmarket.algo import level2
+
+INT64_MAX = 2 ** 63 - 1
+DENSE_LIMIT = 1 << 15
+
+
+class FeeCoverageError(level2.PriceRangeError):
+    '''
+    Exception raised by strict fee tables whose tiers overlap, leave gaps or
+    don't cover every total
+    '''
+    pass
+
+
+class UnknownFeeTable(Exception):
+    '''
+    Exception raised when a fee table name is not defined
+    '''
+    pass
+
+
+def check_coverage(fee_data: List[dict]) -> None:
+    '''
+    Checks that fee_data tiers cover [0, +Inf) exactly once
+    :raises FeeCoverageError
+    '''
+    ranges = sorted(
+        ((info['eligible_transaction_volume']['min_price'],
+          info['eligible_transaction_volume']['max_price'])
+         for info in fee_data),
+        key=lambda bounds: (
+            bounds[0], INT64_MAX if bounds[1] is None else bounds[1]))
+    end = 0
+    for min_price, max_price in ranges:
+        if end is None or min_price < end:
+            raise FeeCoverageError(
+                'Overlapping delivery fee tier (min_price, max_price): '
+                '{}'.format((min_price, max_price)))
+        if min_price > end:
+            raise FeeCoverageError(
+                'No delivery fee tier from {} to {}'.format(end, min_price))
+        end = max_price
+    if end is not None:
+        raise FeeCoverageError('No delivery fee tier above {}'.format(end))
+
+
+class FeeTable:
+    '''
+    Delivery-fee function compiled from its breakpoints
+
+    :param max_prices: sorted tier upper bounds, INT64_MAX for +Inf
+    :param fees: fee of each tier
+    '''
+
+    def __init__(self, max_prices, fees):
+        # lists rather than arrays: bisect and indexing don't box items
+        self.max_prices = list(max_prices)
+        self.fees_by_tier = list(fees)
+        self.unbounded = bool(self.max_prices) and \
+            self.max_prices[-1] == INT64_MAX
+        # fee of bisect_right(max_prices, total), None beyond the last tier
+        self.padded = self.fees_by_tier + [
+            self.fees_by_tier[-1] if self.unbounded else None]
+        finite = self.max_prices[:-1] if self.unbounded else self.max_prices
+        # fee of each total in [0, limit), totals above get padded[-1]
+        self.limit = finite[-1] if finite else 0
+        self.buckets = None
+        if 0 < self.limit <= DENSE_LIMIT:
+            self.buckets = []
+            for tier, stop in enumerate(finite):
+                if stop > len(self.buckets):
+                    self.buckets.extend(
+                        [self.fees_by_tier[tier]] * (stop - len(self.buckets)))
+
+    @classmethod
+    def from_list(cls, fee_data: List[dict], strict: bool = False):
+        '''
+        :param fee_data: validated delivery_fees of a level2/level3 input
+        :param strict: check tier coverage
+        :raises PriceRangeError, FeeCoverageError
+        '''
+        function = level2.L2CartProcessor.DeliveryFeeFunction.from_list(
+            fee_data)
+        if strict:
+            check_coverage(fee_data)
+        return cls(
+            [INT64_MAX if x == float('+Inf') else x for x in function.x],
+            function.y)
+
+    def tier(self, total: int) -> int:
+        '''
+        :returns index of the tier of total
+        :raises InterpolationError beyond the last tier
+        '''
+        index = bisect.bisect_right(self.max_prices, total)
+        if index == len(self.max_prices):
+            if not self.unbounded:
+                raise level2.InterpolationError('Unknown error')
+            index -= 1  # INT64_MAX stands for +Inf
+        return index
+
+    def fee(self, total: int) -> int:
+        '''
+        :returns delivery fee of total
+        :raises InterpolationError beyond the last tier
+        '''
+        return self.fees_by_tier[self.tier(total)]
+
+    def fees(self, totals) -> list:
+        '''
+        :returns delivery fees of totals
+        :raises InterpolationError when any total is beyond the last tier
+        '''
+        buckets, limit, padded = self.buckets, self.limit, self.padded
+        if buckets is not None:
+            first, beyond = padded[0], padded[-1]
+            fees = [buckets[total] if 0 <= total < limit
+                    else beyond if total >= limit else first
+                    for total in totals]
+        else:
+            find, max_prices = bisect.bisect_right, self.max_prices
+            fees = [padded[find(max_prices, total)] for total in totals]
+        if not self.unbounded and None in fees:
+            raise level2.InterpolationError('Unknown error')
+        return fees
+
+
+class FeeTables:
+    '''
+    Named fee tables (one per delivery zone for instance) indexed by name
+
+    :param tables: {name: FeeTable}
+    '''
+
+    def __init__(self, tables: dict):
+        self.names = tuple(sorted(tables))
+        self.index = {name: position for position, name in
+                      enumerate(self.names)}
+        self.tables = tuple(tables[name] for name in self.names)
+
+    @classmethod
+    def from_data(cls, fee_data: dict, strict: bool = False):
+        '''
+        :param fee_data: {name: validated delivery_fees}
+        '''
+        return cls({name: FeeTable.from_list(tiers, strict=strict)
+                    for name, tiers in fee_data.items()})
+
+    def table(self, name: str) -> FeeTable:
+        '''
+        :returns fee table name
+        :raises UnknownFeeTable
+        '''
+        try:
+            return self.tables[self.index[name]]
+        except KeyError:
+            raise UnknownFeeTable('Fee table {!r} is not defined'.format(name))
+
+    def fees(self, totals, names) -> list:
+        '''
+        :returns delivery fee of each total with the table of the same rank
+        in names
+        :raises UnknownFeeTable, InterpolationError
+        '''
+        names = list(names)
+        groups = {}
+        for position, name in enumerate(names):
+            groups.setdefault(name, []).append(position)
+        fees = [0] * len(names)
+        for name, positions in groups.items():
+            for position, fee in zip(positions, self.table(name).fees(
+                    [totals[position] for position in positions])):
+                fees[position] = fee
+        return fees
@@ -1,7 +1,6 @@
 '''
 This is simple cart pricing module
 '''
-from operator import itemgetter
 from functools import partial
 from typing import Callable, NewType
 
@@ -38,6 +37,35 @@ class L3CartProcessor(level1.L1CartProcessor):
             '''
             return self.function(aprice)
 
+    class DiscountStack(tuple):
+        '''
+        Discounts of one article, applied in input order: each one applies
+        to the price left by the previous ones (floor division included)
+        '''
+
+        def __call__(self, aprice):
+            '''
+            Applies the discounts to a price
+            '''
+            for discount in self:
+                aprice = discount(aprice)
+            return aprice
+
+    @classmethod
+    def stack_discounts(cls, discounts: list) -> dict:
+        '''
+        :param discounts: [{'article_id': <id>, 'type': <type>,
+                            'value': <value>}, ...]
+        :returns {article_id: DiscountStack}
+        :raises BadDataFormat on percentages above 100
+        '''
+        stacks = {}
+        for discount in discounts:
+            stacks.setdefault(discount['article_id'], []).append(
+                cls.Discount(discount['type'], discount['value']))
+        return {article_id: cls.DiscountStack(stack)
+                for article_id, stack in stacks.items()}
+
     def __init__(self, data: dict):
         '''
         Compute cart object price
@@ -144,17 +172,12 @@ class L3CartProcessor(level1.L1CartProcessor):
         {'carts': [{'id': 1, 'total': 1540}, ]}
 
         '''
-        params = itemgetter('type', 'value')  # discount params
-        article_id = itemgetter('article_id')
         try:
             self.input_validator.deserialize(data)
         except colander.Invalid as exc:
             raise level1.BadDataFormat(exc.msg)
         else:
-            discounts = {
-                article_id(discount): self.Discount(*params(discount))
-                for discount in data.pop('discounts')
-            }
+            discounts = self.stack_discounts(data.pop('discounts'))
             discounted_price = partial(
                 lambda art: discounts.get(art.id, lambda _: _)(art.price))
 
@@ -0,0 +1,152 @@
+'''
+Free-delivery nudges: for each cart, the cheapest articles whose addition
+pushes the cart total across the next delivery fee breakpoint lowering the
+fee ("add 2.50 more to get free delivery").
+
+Discounted article prices are sorted once per catalog; a cart then costs one
+bisect against the gap to the next cheaper tier, whatever the catalog size.
+
+>>> nudger = Nudger(CompiledCatalog.from_data(data))
+>>> nudger.nudges(CartBatch.from_data(data), limit=1)
+{'carts': [{'id': 1, 'total': 2350, 'delivery_fee': 400, 'missing': 50,
+            'suggestions': [{'article_id': 1, 'price': 100,
+                             'delivery_fee': 0, 'total': 2050}]}, ...]}
+'''
+import bisect
+from array import array
+
+from zenmarket.algo.catalog import INT64_MAX, CartBatch, CompiledCatalog
+from zenmarket.algo import level2
+
+# pylint: disable=too-few-public-methods
+
+DEFAULT_LIMIT = 3
+
+
+class PriceIndex:
+    '''
+    Article ids sorted by discounted price (then id)
+    '''
+
+    def __init__(self, prices, article_ids):
+        self.prices = prices
+        self.article_ids = article_ids
+
+    @classmethod
+    def from_catalog(cls, compiled: CompiledCatalog):
+        '''
+        :returns index of the discounted prices of compiled
+        '''
+        prices = compiled.prices
+        # article_ids are sorted, a stable sort keeps ids ascending among
+        # articles of the same price
+        order = sorted(range(len(prices)), key=prices.__getitem__)
+        return cls(
+            array('q', (prices[i] for i in order)),
+            array('q', (compiled.article_ids[i] for i in order)))
+
+    def __len__(self):
+        return len(self.prices)
+
+    def at_least(self, amount: int):
+        '''
+        :returns iterator of (article_id, price) of the articles costing at
+        least amount, cheapest first
+        '''
+        for index in range(bisect.bisect_left(self.prices, amount),
+                           len(self.prices)):
+            yield self.article_ids[index], self.prices[index]
+
+
+class Nudger:
+    '''
+    Finds nudges of carts priced against a compiled catalog
+    '''
+
+    def __init__(self, compiled: CompiledCatalog, index: PriceIndex = None):
+        self.compiled = compiled
+        self.index = PriceIndex.from_catalog(compiled) if index is None \
+            else index
+
+    def target(self, subtotal: int):
+        '''
+        :returns (breakpoint, fee) of the first breakpoint above subtotal
+        after which the delivery fee is lower than the one of subtotal, None
+        when no such breakpoint exists
+        '''
+        compiled = self.compiled
+        if not compiled.has_delivery_fees:
+            return None
+        fee_x, fee_y = compiled.fee_x, compiled.fee_y
+        fee = compiled.fee(subtotal)
+        for tier in range(bisect.bisect_right(fee_x, subtotal),
+                          len(fee_x) - 1):
+            if fee_x[tier] == INT64_MAX:
+                break
+            if fee_y[tier + 1] < fee:
+                return fee_x[tier], fee_y[tier + 1]
+        return None
+
+    def suggestions(self, subtotal: int, limit: int) -> list:
+        '''
+        :returns up to limit cheapest articles lowering the delivery fee of
+        a cart worth subtotal once added
+        '''
+        target = self.target(subtotal)
+        if target is None or limit <= 0:
+            return []
+        fee = self.compiled.fee(subtotal)
+        found = []
+        for article_id, aprice in self.index.at_least(target[0] - subtotal):
+            try:
+                new_fee = self.compiled.fee(subtotal + aprice)
+            except level2.InterpolationError:
+                break  # past the last tier, so are the pricier articles
+            if new_fee < fee:
+                # fee tables are usually decreasing: no article is skipped
+                found.append({
+                    'article_id': article_id,
+                    'price': aprice,
+                    'delivery_fee': new_fee,
+                    'total': subtotal + aprice + new_fee,
+                })
+                if len(found) == limit:
+                    break
+        return found
+
+    def nudges(self, batch: CartBatch, limit: int = DEFAULT_LIMIT) -> dict:
+        '''
+        :returns {'carts': [{'id': <id>, 'total': <total>,
+                             'delivery_fee': <fee>, 'missing': <amount>,
+                             'suggestions': [{'article_id': <id>,
+                                              'price': <price>,
+                                              'delivery_fee': <fee>,
+                                              'total': <total>}, ...]}, ...]}
+        missing is the amount to add to reach the next cheaper tier, 0 when
+        the fee can't be lowered. Errors are the ones of pricing the batch.
+        '''
+        compiled = self.compiled
+        subtotals = compiled.subtotals(batch)
+        if any(total < 0 for total in subtotals):
+            compiled.price(batch)  # same error as pricing the batch
+        carts = []
+        for cart_id, subtotal in zip(batch.ids, subtotals):
+            fee = compiled.fee(subtotal)
+            target = self.target(subtotal)
+            carts.append({
+                'id': cart_id,
+                'total': subtotal + fee,
+                'delivery_fee': fee,
+                'missing': 0 if target is None else target[0] - subtotal,
+                'suggestions': self.suggestions(subtotal, limit),
+            })
+        return {'carts': carts}
+
+
+def nudges(data: dict, limit: int = DEFAULT_LIMIT) -> dict:
+    '''
+    Compiles the catalog part of level2/level3 data and returns the nudges
+    of its carts
+    '''
+    compiled = CompiledCatalog.from_data(data)
+    return Nudger(compiled).nudges(CartBatch.from_data(data), limit)
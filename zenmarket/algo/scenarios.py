@@ -0,0 +1,198 @@
+'''
+Scenario pricing: one set of carts priced against a base catalog and K
+variants of it ("what if" prices, discounts or delivery fees).
+
+Carts are validated and indexed once: each distinct article gets a column
+holding the (cart, quantity) of the lines selling it. The base totals
+before fees are computed in one pass over the lines; the ones of a
+variant start from them and only visit the columns of the articles whose
+discounted price changed, so that a variant touching a few articles costs
+a few postings rather than a full repricing. Delivery fees are evaluated
+per variant by its compiled fee table.
+
+Totals are the ones level3.price returns for the base input with the
+sections of the scenario replaced:
+
+>>> evaluate({'articles': [...], 'delivery_fees': [...], 'discounts': [...],
+...           'carts': [...],
+...           'scenarios': [{'name': 'no discounts', 'discounts': []}]})
+{'carts': [{'id': 1, 'totals': [2000, 2200]}, ...],
+ 'scenarios': [{'name': 'base', 'revenue': 8000, 'delta': 0, ...},
+               {'name': 'no discounts', 'revenue': 8600, 'delta': 600, ...}]}
+'''
+from array import array
+
+import colander
+
+from zenmarket import model
+from zenmarket.algo import level1, level2
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+
+# pylint: disable=too-few-public-methods
+
+CATALOG_SECTIONS = ('articles', 'delivery_fees', 'discounts')
+
+
+class ScenarioError(Exception):
+    '''
+    Exception raised when the carts can't be priced against a scenario
+    catalog, with the error level3.price raises for its input
+    '''
+    pass
+
+
+class CartIndex:
+    '''
+    Carts indexed by article
+
+    :param batch: CartBatch of the carts
+    '''
+
+    def __init__(self, batch: CartBatch):
+        self.batch = batch
+        # column of each distinct article, in order of appearance
+        self.article_ids = []
+        columns = {}
+        self.line_columns = array('q')
+        for article_id in batch.article_ids:
+            column = columns.get(article_id)
+            if column is None:
+                column = columns[article_id] = len(self.article_ids)
+                self.article_ids.append(article_id)
+            self.line_columns.append(column)
+        # (cart, quantity) postings of each column
+        self.carts = [array('q') for _ in self.article_ids]
+        self.quantities = [array('q') for _ in self.article_ids]
+        offsets = batch.offsets
+        line_columns, quantities = self.line_columns, batch.quantities
+        for cart in range(len(batch.ids)):
+            for line in range(offsets[cart], offsets[cart + 1]):
+                column = line_columns[line]
+                self.carts[column].append(cart)
+                self.quantities[column].append(quantities[line])
+
+    def prices(self, compiled: CompiledCatalog) -> list:
+        '''
+        :returns discounted price of each column in compiled
+        :raises UndefinedArticleReference
+        '''
+        return [compiled.article_price(article_id)
+                for article_id in self.article_ids]
+
+    def subtotals(self, prices: list) -> list:
+        '''
+        :returns cart totals before fees with prices per column
+        '''
+        offsets, line_columns = self.batch.offsets, self.line_columns
+        quantities = self.batch.quantities
+        return [sum(prices[line_columns[line]] * quantities[line]
+                    for line in range(offsets[cart], offsets[cart + 1]))
+                for cart in range(len(self.batch.ids))]
+
+    def repriced(self, subtotals: list, prices: list,
+                 new_prices: list) -> list:
+        '''
+        :returns subtotals priced with prices, updated to new_prices
+        '''
+        changed = [column for column, (old, new) in enumerate(
+            zip(prices, new_prices)) if old != new]
+        if not changed:
+            return subtotals
+        subtotals = list(subtotals)
+        for column in changed:
+            delta = new_prices[column] - prices[column]
+            for cart, quantity in zip(
+                    self.carts[column], self.quantities[column]):
+                subtotals[cart] += delta * quantity
+        return subtotals
+
+
+def compile_variant(catalog: dict, index: CartIndex) -> CompiledCatalog:
+    '''
+    :returns compiled catalog, raising the errors of level3.price in the
+    same order (undefined articles before fee ranges)
+    '''
+    try:
+        return CompiledCatalog.from_data(catalog)
+    except level2.PriceRangeError:
+        known = {article['id'] for article in catalog['articles']}
+        for article_id in index.article_ids:
+            if article_id not in known:
+                raise level1.UndefinedArticleReference(
+                    'Article(id={}) is not defined'.format(article_id))
+        raise
+
+
+def summary(name: str, totals: list, subtotals: list,
+            base_totals: list) -> dict:
+    '''
+    :returns revenue of totals and its changes from base_totals
+    '''
+    revenue, base_revenue = sum(totals), sum(base_totals)
+    deltas = [total - base for total, base in zip(totals, base_totals)]
+    return {
+        'name': name,
+        'revenue': revenue,
+        'fee_revenue': revenue - sum(subtotals),
+        'delta': revenue - base_revenue,
+        'delta_percent': None if not base_revenue else round(
+            100 * (revenue - base_revenue) / base_revenue, 2),
+        'carts_up': sum(delta > 0 for delta in deltas),
+        'carts_down': sum(delta < 0 for delta in deltas),
+    }
+
+
+def evaluate(data: dict, carts: bool = True) -> dict:
+    '''
+    Prices the carts of data against its catalog and each of its scenarios
+    :param carts: include the totals of each cart, summaries only otherwise
+    :returns {'carts': [{'id': <id>, 'totals': [<base>, <scenario 1>, ...]},
+                        ...],
+              'scenarios': [{'name': 'base', 'revenue': <sum of totals>,
+                             'fee_revenue': <sum of fees>,
+                             'delta': <revenue - base revenue>,
+                             'delta_percent': <delta / base revenue %>,
+                             'carts_up': <count>, 'carts_down': <count>},
+                            ...]}
+    :raises BadDataFormat, ScenarioError
+    '''
+    try:
+        valid = model.ScenarioInputDataDesc().deserialize(data)
+    except colander.Invalid as exc:
+        raise level1.BadDataFormat(exc.msg)
+    index = CartIndex(CartBatch.from_valid_list(valid['carts']))
+    base = {key: valid[key] for key in CATALOG_SECTIONS}
+    variants = [('base', base)] + [
+        (scenario['name'], dict(base, **{
+            key: scenario[key] for key in CATALOG_SECTIONS
+            if key in scenario}))
+        for scenario in valid['scenarios']]
+
+    cart_ids = index.batch.ids
+    base_prices = base_subtotals = None
+    matrix, summaries = [], []
+    for name, catalog in variants:
+        try:
+            compiled = compile_variant(catalog, index)
+            prices = index.prices(compiled)
+            if base_prices is None:
+                base_prices = prices
+                base_subtotals = subtotals = index.subtotals(prices)
+            else:
+                subtotals = index.repriced(base_subtotals, base_prices, prices)
+            if any(total < 0 for total in subtotals):
+                compiled.response(cart_ids, subtotals)
+            totals = compiled.with_fees(cart_ids, subtotals)
+        except (colander.Invalid, level1.BadDataFormat,
+                level1.UndefinedArticleReference, level2.PriceRangeError,
+                level2.InterpolationError) as exc:
+            raise ScenarioError('Scenario {!r}: {}: {}'.format(
+                name, type(exc).__name__, exc))
+        matrix.append(totals)
+        summaries.append(summary(name, totals, subtotals, matrix[0]))
+    response = {'scenarios': summaries}
+    if carts:
+        response['carts'] = [
+            {'id': cart_id, 'totals': list(totals)}
+            for cart_id, totals in zip(cart_ids, zip(*matrix))]
+    return response
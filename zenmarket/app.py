@@ -1,67 +1,908 @@
 '''
 Web Application
 '''
+import asyncio
+import contextlib
+import logging
 import sys
+import time
 import traceback
 import json
+from collections import namedtuple
 
-import asyncio
+import colander
+from aiohttp import BodyPartReader, web
+
+from zenmarket.algo import engines, level1, scenarios
+from zenmarket import model, wire
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+from zenmarket.algo.nudge import DEFAULT_LIMIT, Nudger
+from zenmarket.server.batching import MicroBatcher
+from zenmarket.server.cache import (
+    CachedResponse, ResponseCache, make_etag, payload_key)
+from zenmarket.server.compression import (
+    ENCODINGS, accepted_encoding, compress, encoded_etag, request_encoding)
+from zenmarket.server.limits import AdmissionControl, Limits, RequestRejected
+from zenmarket.server.parallel import ParallelPricer
+from zenmarket.server.reload import CatalogStore, ReloadError
+from zenmarket.server.slowlog import SlowLog, logging_sink
+from zenmarket.server.stats import Stats
+from zenmarket.server.streaming import StreamingPricer
+from zenmarket.server.tracing import (
+    CURRENT, RequestTrace, flag, payload_shape, server_timing, stage)
+
+# pylint: disable=too-few-public-methods
+
+
+class ServerConfig(namedtuple('ServerConfig', [
+        'catalog', 'batch_delay', 'batch_carts', 'cache_size', 'cache_ttl',
+        'limits', 'slow_log_threshold', 'slow_log_sample', 'slow_log_sink',
+        'parallel_workers', 'parallel_min_carts', 'engine', 'catalog_watch',
+        'compress_min_size', 'server_timing', 'warmup_rounds',
+        'stream_min_size'],
+        defaults=[None, None, 1000, 0, 60, Limits(), None, 0, logging_sink,
+                  None, 100000, engines.DEFAULT_ENGINE, None, 1024, False,
+                  0, 2 ** 20])):
+    '''
+    Server settings
+    catalog: path to a compiled (or JSON) catalog served on
+        /api/catalog/price and /api/catalog/nudge, reloaded by
+        POST /api/admin/catalog/reload
+    batch_delay: micro-batching window of /api/level3/price in seconds,
+        micro-batching is disabled when None
+    batch_carts: flush a micro-batch as soon as it holds that many carts
+    cache_size: number of cached responses, 0 disables the cache (identical
+        requests in flight are still computed once)
+    cache_ttl: cached responses lifetime in seconds
+    limits: admission control Limits
+    slow_log_threshold: seconds, slower requests are logged, None disables
+        the slow log
+    slow_log_sample: probability to log any other request
+    slow_log_sink: callable receiving slow log entries
+    parallel_workers: size of the process pool pricing huge requests, None
+        disables parallel pricing
+    parallel_min_carts: requests with that many carts are priced in parallel
+    engine: default pricing engine of /api/levelN/price, the reference engine
+        is used for levels it does not support
+    catalog_watch: seconds between checks of the catalog file, which is
+        reloaded when it changes, None disables watching
+    compress_min_size: bytes, pricing responses that large are compressed
+        when the client accepts gzip or deflate, None disables compression
+    server_timing: add a Server-Timing header to pricing responses, a
+        X-Server-Timing: 1 (or 0) request header overrides it
+    warmup_rounds: times the pricing path of each route runs on synthetic
+        payloads at startup, /ready answers 503 until it is done
+    stream_min_size: bytes, JSON payloads that large (or of unknown size)
+        are priced while their body is received, None disables streaming
+    '''
+    pass
+
+
+CATALOG = web.AppKey('catalog', CatalogStore)
+BATCHER = web.AppKey('batcher', MicroBatcher)
+STATS = web.AppKey('stats', Stats)
+CACHE = web.AppKey('cache', ResponseCache)
+ADMISSION = web.AppKey('admission', AdmissionControl)
+SLOW_LOG = web.AppKey('slow_log', SlowLog)
+PARALLEL = web.AppKey('parallel', ParallelPricer)
+ENGINE = web.AppKey('engine', str)
+COMPRESS_MIN_SIZE = web.AppKey('compress_min_size', int)
+SERVER_TIMING = web.AppKey('server_timing', bool)
+READY = web.AppKey('ready', asyncio.Event)
+STREAM_MIN_SIZE = web.AppKey('stream_min_size', int)
+
+MAX_NUDGE_LIMIT = 100
+
+LOGGER = logging.getLogger('zenmarket.warmup')
+
+# small level3 input going through every pricing step: discounts of both
+# types, every fee tier, an empty cart
+WARMUP_INPUT = {
+    'articles': [
+        {'id': 1, 'name': 'water', 'price': 100},
+        {'id': 2, 'name': 'honey', 'price': 200},
+        {'id': 3, 'name': 'tea', 'price': 1000},
+    ],
+    'carts': [
+        {'id': 1, 'items': [{'article_id': 1, 'quantity': 6}]},
+        {'id': 2, 'items': [{'article_id': 2, 'quantity': 2},
+                            {'article_id': 3, 'quantity': 1}]},
+        {'id': 3, 'items': [{'article_id': 3, 'quantity': 3}]},
+        {'id': 4, 'items': []},
+    ],
+    'delivery_fees': [
+        {'eligible_transaction_volume': {'min_price': 0, 'max_price': 1000},
+         'price': 800},
+        {'eligible_transaction_volume': {'min_price': 1000,
+                                         'max_price': 2000},
+         'price': 400},
+        {'eligible_transaction_volume': {'min_price': 2000,
+                                         'max_price': None},
+         'price': 0},
+    ],
+    'discounts': [
+        {'article_id': 2, 'type': 'amount', 'value': 25},
+        {'article_id': 3, 'type': 'percentage', 'value': 30},
+    ],
+}
+
+
+class PricingError(Exception):
+    '''
+    Exception raised when a payload can't be priced, mapped to 400
+    '''
+    pass
+
+
+def encode_json(response: dict):
+    '''
+    :returns (body, content_type) of a JSON response
+    '''
+    return json.dumps(response).encode(), 'application/json'
+
+
+def encode_totals(response: dict):
+    '''
+    :returns (body, content_type) of a binary totals response
+    '''
+    return wire.encode_totals(response), wire.TOTALS_CONTENT_TYPE
+
+
+def decode_json(raw: bytes) -> dict:
+    '''
+    Default payload decoder
+    '''
+    return json.loads(raw.decode())
+
+
+def not_modified(request, etag: str) -> bool:
+    '''
+    :returns True when If-None-Match matches etag
+    '''
+    header = request.headers.get('If-None-Match')
+    if header is None:
+        return False
+    tags = {tag.strip() for tag in header.split(',')}
+    tags.update(tag[2:] for tag in list(tags) if tag.startswith('W/'))
+    return '*' in tags or any(
+        candidate in tags for candidate in [etag] + [
+            encoded_etag(etag, encoding) for encoding in ENCODINGS])
+
+
+async def compressed(request, key: str, cached: CachedResponse):
+    '''
+    :returns cached compressed with the encoding accepted by the client, or
+    cached when it is too small or the client accepts no compression
+    '''
+    min_size = request.app.get(COMPRESS_MIN_SIZE)
+    if min_size is None or len(cached.body) < min_size:
+        return cached, None
+    encoding = accepted_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return cached, None
+    stats = request.app[STATS]
+
+    async def compute():
+        body = await asyncio.get_running_loop().run_in_executor(
+            None, compress, cached.body, encoding)
+        stats.incr('compression.responses')
+        stats.observe('compression.ratio', len(body) / len(cached.body))
+        return CachedResponse(
+            body, cached.content_type, encoded_etag(cached.etag, encoding))
+
+    return await request.app[CACHE].get_or_compute(
+        key + ':' + encoding, compute, 'compressed_cache'), encoding
+
+
+async def respond(request, raw: bytes, price_func, decode=decode_json,
+                  encode=encode_json, variant: bytes = b'',
+                  admitted: bool = False):
+    '''
+    Decodes raw, prices it and encodes the response. Responses are cached by
+    (route, variant, raw) hash, which is also their ETag.
 
-from aiohttp import web
+    :param variant: anything else the response depends on (format, catalog)
+    :param admitted: the caller already holds a pricing slot
+    '''
+    key = payload_key(request.path.encode(), variant, raw)
+    etag = make_etag(key)
+    if not_modified(request, etag):
+        request.app[STATS].incr('cache.not_modified')
+        raise web.HTTPNotModified(headers={'ETag': etag})
+
+    admission = request.app[ADMISSION]
+
+    async def compute():
+        try:
+            with stage('decode'):
+                payload = decode(raw)
+        except:
+            raise PricingError(
+                traceback.format_exception(*sys.exc_info())[-1].strip())
+        shape = payload_shape(payload)
+        trace = CURRENT.get()
+        if trace is not None:
+            trace.shape = shape
+        admission.check_shape(shape)
+        async with contextlib.nullcontext() if admitted else \
+                admission.slot():
+            try:
+                response = price_func(payload)
+                if asyncio.iscoroutine(response):
+                    response = await response
+            except:
+                raise PricingError(
+                    traceback.format_exception(*sys.exc_info())[-1].strip())
+        try:
+            with stage('serialize'):
+                body, content_type = encode(response)
+        except level1.BadDataFormat:
+            # totals the binary format can't hold
+            raise PricingError(
+                traceback.format_exception(*sys.exc_info())[-1].strip())
+        return CachedResponse(body, content_type, etag)
 
-from zenmarket.algo import level1, level2, level3
+    try:
+        cached = await request.app[CACHE].get_or_compute(key, compute)
+    except PricingError as exc:
+        raise web.HTTPBadRequest(reason=str(exc))
+    cached, encoding = await compressed(request, key, cached)
+    headers = {'ETag': cached.etag}
+    if COMPRESS_MIN_SIZE in request.app:
+        headers['Vary'] = 'Accept-Encoding'
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return web.Response(
+        body=cached.body, content_type=cached.content_type, headers=headers)
 
 
-@asyncio.coroutine
-def handle_request(request, price_func):
+def wants_server_timing(request) -> bool:
+    '''
+    :returns True when the response should carry Server-Timing
+    '''
+    header = request.headers.get('X-Server-Timing')
+    if header is None:
+        return request.app[SERVER_TIMING]
+    return header.strip().lower() not in ('0', 'false', 'off', 'no')
+
+
+@web.middleware
+async def trace_middleware(request, handler):
+    '''
+    Traces POST requests, feeds the slow log and adds the Server-Timing
+    header
+    '''
+    if request.method != 'POST':
+        return await handler(request)
+    trace = RequestTrace()
+    token = CURRENT.set(trace)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        if wants_server_timing(request):
+            response.headers['Server-Timing'] = server_timing(trace)
+        return response
+    except web.HTTPException as exc:
+        status = exc.status
+        if wants_server_timing(request):
+            exc.headers['Server-Timing'] = server_timing(trace)
+        raise
+    finally:
+        CURRENT.reset(token)
+        if SLOW_LOG in request.app:
+            request.app[SLOW_LOG].record(request, trace, status)
+
+
+@web.middleware
+async def admission_middleware(request, handler):
+    '''
+    Rejects bodies over max_body_size or with an unsupported coding before
+    reading them and turns RequestRejected into HTTP errors
+    '''
+    try:
+        if request.method == 'POST':
+            if request_encoding(request) is not None:
+                request.app[STATS].incr('compression.requests')
+            request.app[ADMISSION].check_body_size(request)
+        return await handler(request)
+    except RequestRejected as exc:
+        raise exc.http_error()
+    except web.HTTPRequestEntityTooLarge:
+        # chunked body over client_max_size
+        request.app[STATS].incr('limits.body_size')
+        raise
+
+
+def check_in_flight(request) -> None:
+    '''
+    Rejects a pricing request before reading it when no pricing slot is
+    free, unless its response may be cached: cache hits need no slot
+    '''
+    admission, cache = request.app.get(ADMISSION), request.app.get(CACHE)
+    if admission is not None and (cache is None or cache.max_size <= 0):
+        admission.check_in_flight()
+
+
+async def read_payload(request) -> bytes:
+    '''
+    :returns JSON payload of a multipart form (data field) or of a JSON
+    body, which spares the multipart parsing
+    '''
+    check_in_flight(request)
+    with stage('read'):
+        if request.content_type == 'application/json':
+            return await request.read()
+        body = await request.post()
+        return body['data'].file.read()
+
+
+def streams(request) -> bool:
+    '''
+    :returns True when the payload of request should be priced as it is
+    received, which is never when its response may be cached: that is only
+    known once the payload is read, when streaming has priced it already
+    '''
+    min_size = request.app.get(STREAM_MIN_SIZE)
+    if min_size is None or request.content_type not in (
+            'application/json', 'multipart/form-data'):
+        return False
+    if request.app[CACHE].max_size > 0 or 'If-None-Match' in request.headers:
+        return False
+    return request.content_length is None or \
+        request.content_length >= min_size
+
+
+async def payload_chunks(request):
+    '''
+    :returns async iterator of the chunks of the payload read_payload
+    returns, as they are received
+    '''
+    if request.content_type == 'application/json':
+        async for chunk in request.content.iter_any():
+            yield chunk
+        return
+    reader = await request.multipart()
+    while True:
+        part = await reader.next()
+        if part is None:
+            raise web.HTTPBadRequest(reason='No data file in the form')
+        if isinstance(part, BodyPartReader) and part.name == 'data' and \
+                part.filename:
+            break
+        await part.release()
+    while True:
+        chunk = await part.read_chunk()
+        if not chunk:
+            return
+        async for decoded in part.decode_iter(chunk):
+            yield decoded
+
+
+async def stream_request(request, streamed: StreamingPricer, price_func,
+                         encode=encode_json, variant: bytes = b''):
+    '''
+    Prices the payload of request with streamed while it is received, then
+    responds as handle_request does. When streamed gives up, the payload is
+    priced by price_func, which raises the usual errors.
+    '''
+    max_size = request.client_max_size
+    chunks, size = [], 0
+    # the pricing slot is held while reading, where the pricing work is done
+    async with request.app[ADMISSION].slot():
+        with stage('read'):
+            async for chunk in payload_chunks(request):
+                size += len(chunk)
+                if 0 < max_size < size:
+                    raise web.HTTPRequestEntityTooLarge(
+                        max_size=max_size, actual_size=size)
+                chunks.append(chunk)
+                streamed.feed(chunk)
+            response = streamed.finish()
+        raw = b''.join(chunks)
+        if response is not None:
+            flag('streaming', 'hit')
+            request.app[STATS].incr('streaming.requests')
+            return await respond(
+                request, raw, lambda payload: response,
+                decode=lambda raw: streamed.payload(), encode=encode,
+                variant=variant, admitted=True)
+    flag('streaming', 'fallback')
+    request.app[STATS].incr('streaming.fallbacks')
+    return await respond(
+        request, raw, price_func, encode=encode, variant=variant)
+
+
+async def handle_request(request, price_func, variant: bytes = b''):
     '''
     General request handler
     '''
-    body = yield from request.post()
-    data = json.loads(body['data'].file.read().decode())
+    raw = await read_payload(request)
+    return await respond(request, raw, price_func, variant=variant)
+
+
+def staged(engine: engines.Engine, level: int):
+    '''
+    :returns price function of engine for level, recording its validate,
+    build and price stages
+    '''
+    def price(data: dict) -> dict:
+        with stage('validate'):
+            valid = engine.validate(level, data)
+        with stage('build'):
+            built = engine.build(level, valid)
+        with stage('price'):
+            return engine.run(level, built)
+    return price
+
+
+def request_engine(request, level: int) -> engines.Engine:
+    '''
+    :returns engine selected by the engine query parameter, or the server
+    default engine (reference engine for levels it does not support)
+    '''
+    name = request.query.get('engine')
     try:
-        response = price_func(data)
-    except:
-        message = traceback.format_exception(*sys.exc_info())[-1]
-        raise web.HTTPBadRequest(reason=message)
-    else:
-        return web.json_response(response)
+        if name is None:
+            return engines.resolve(request.app[ENGINE], level)
+        return engines.get(name, level)
+    except engines.UnknownEngine as exc:
+        raise web.HTTPBadRequest(reason=str(exc))
+
+
+async def handle_level(request, level: int, wrap=None):
+    '''
+    Prices a levelN request with the selected engine, while it is received
+    when it is large, the engine is streamable and wrap leaves the engine
+    price function as it is
+    :param wrap: optional callable returning (price function replacing the
+        engine one, name of that pricing path) or None to keep the engine
+    '''
+    engine = request_engine(request, level)
+    price = staged(engine, level)
+    wrapped = None if wrap is None else wrap(price)
+    if wrapped is not None:
+        # responses are cached per pricing path
+        price, name = wrapped
+        return await handle_request(request, price, variant='{}+{}'.format(
+            engine.name, name).encode())
+    variant = engine.name.encode()
+    if engine.streamable and streams(request):
+        return await stream_request(
+            request, StreamingPricer(
+                level=level, limits=request.app[ADMISSION].limits),
+            price, variant=variant)
+    return await handle_request(request, price, variant=variant)
+
+
+def staged_catalog(compiled: CompiledCatalog, parallel: ParallelPricer = None):
+    '''
+    :returns compiled.price_data recording its stages
+    '''
+    async def price(data: dict) -> dict:
+        with stage('validate'):
+            carts = CartBatch.validate(data)
+        with stage('build'):
+            batch = CartBatch.from_valid_list(carts)
+        return await staged_batch(compiled, parallel)(batch)
+    return price
+
+
+def staged_batch(compiled: CompiledCatalog, parallel: ParallelPricer = None):
+    '''
+    :returns compiled.price recording its stage, huge batches are priced by
+    parallel when given
+    '''
+    async def price(batch: CartBatch) -> dict:
+        with stage('price'):
+            if parallel is not None and parallel.wants(batch.cart_count):
+                return await parallel.price(compiled, batch)
+            return compiled.price(batch)
+    return price
+
+
+def parallel_level3(parallel: ParallelPricer, price_func):
+    '''
+    :returns price_func, except that level3 inputs of at least
+    parallel.min_carts carts are priced by parallel
+    '''
+    input_validator = model.L3InputDataDesc()
+
+    async def price(data: dict) -> dict:
+        carts = data.get('carts') if isinstance(data, dict) else None
+        if not isinstance(carts, list) or not parallel.wants(len(carts)):
+            response = price_func(data)
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+        with stage('validate'):
+            try:
+                valid = input_validator.deserialize(data)
+            except colander.Invalid as exc:
+                raise level1.BadDataFormat(exc.msg)
+        with stage('build'):
+            compiled = CompiledCatalog.from_data(data)
+            batch = CartBatch.from_valid_list(valid['carts'])
+        return await staged_batch(compiled, parallel)(batch)
+    return price
+
 
+class ValidatingBatcher(MicroBatcher):
+    '''
+    MicroBatcher rejecting invalid level3 inputs before they join a batch
+    '''
+
+    input_validator = model.L3InputDataDesc()
 
-def level1_handler(request):
+    async def price(self, data: dict) -> dict:
+        '''
+        :raises BadDataFormat before queuing invalid data
+        '''
+        with stage('validate'):
+            try:
+                self.input_validator.deserialize(data)
+            except colander.Invalid as exc:
+                raise level1.BadDataFormat(exc.msg)
+        with stage('price'):
+            return await super().price(data)
+
+
+async def level1_handler(request):
     '''
     Request handler for /api/level1/price
     Handles level1 request pricing
     curl -F data=@level1/data.json http://<host>/api/level1/price
+    curl -F data=@level1/data.json 'http://<host>/api/level1/price?engine=fused'
     '''
-    return handle_request(request, level1.price)
+    return await handle_level(request, 1)
 
 
-def level2_handler(request):
+async def level2_handler(request):
     '''
     Request handler for /api/level2/price
     Handles level2 request pricing
     curl -F data=@level2/data.json http://<host>/api/level2/price
+    curl -F data=@level2/data.json 'http://<host>/api/level2/price?engine=fused'
     '''
-    return handle_request(request, level2.price)
+    return await handle_level(request, 2)
 
 
-def level3_handler(request):
+async def level3_handler(request):
     '''
     Request handler for /api/level3/price
     Handles level3 request pricing
     curl -F data=@level3/data.json http://<host>/api/level3/price
+    curl -F data=@level3/data.json 'http://<host>/api/level3/price?engine=fused'
+    '''
+    def wrap(price):
+        # micro-batches and parallel pricing use compiled catalogs, they
+        # leave engines picked by ?engine= or serve --engine alone
+        if request.query.get('engine') is not None or \
+                request.app[ENGINE] != engines.DEFAULT_ENGINE:
+            return None
+        names = []
+        if BATCHER in request.app:
+            price = request.app[BATCHER].price
+            names.append('batched')
+        if PARALLEL in request.app:
+            price = parallel_level3(request.app[PARALLEL], price)
+            names.append('parallel')
+        return (price, '+'.join(names)) if names else None
+    return await handle_level(request, 3, wrap)
+
+
+async def catalog_handler(request):
+    '''
+    Request handler for /api/catalog/price
+    Prices carts against the current catalog
+    curl -F data=@carts.json http://<host>/api/catalog/price
+    curl --data-binary @carts.zmb \\
+        -H 'Content-Type: application/vnd.zenmarket.carts' \\
+        -H 'Accept: application/vnd.zenmarket.totals' \\
+        http://<host>/api/catalog/price
+    '''
+    with request.app[CATALOG].acquire() as version:
+        return await price_catalog(request, version.compiled)
+
+
+async def price_catalog(request, compiled: CompiledCatalog):
+    '''
+    Prices a /api/catalog/price request against compiled
+    '''
+    parallel = request.app.get(PARALLEL)
+    binary = wire.TOTALS_CONTENT_TYPE in request.headers.get('Accept', '')
+    encode = encode_totals if binary else encode_json
+    variant = '{}:{}'.format(compiled.digest, binary).encode()
+    if parallel is None and streams(request):
+        return await stream_request(
+            request, StreamingPricer(
+                compiled=compiled, limits=request.app[ADMISSION].limits),
+            staged_catalog(compiled), encode=encode, variant=variant)
+    if request.content_type != wire.CARTS_CONTENT_TYPE:
+        raw = await read_payload(request)
+        return await respond(
+            request, raw, staged_catalog(compiled, parallel), encode=encode,
+            variant=variant)
+    check_in_flight(request)
+    with stage('read'):
+        raw = await request.read()
+    return await respond(
+        request, raw, staged_batch(compiled, parallel),
+        decode=wire.decode_carts, encode=encode, variant=variant + b':binary')
+
+
+def nudge_limit(request) -> int:
+    '''
+    :returns limit query parameter, number of suggestions per cart
+    '''
+    try:
+        limit = int(request.query.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        limit = -1
+    if not 0 <= limit <= MAX_NUDGE_LIMIT:
+        raise web.HTTPBadRequest(
+            reason='limit must be an integer in [0, {}]'.format(
+                MAX_NUDGE_LIMIT))
+    return limit
+
+
+def staged_nudges(nudger: Nudger, limit: int):
+    '''
+    :returns nudger.nudges of data carts recording its stages
+    '''
+    def nudges(data: dict) -> dict:
+        with stage('validate'):
+            carts = CartBatch.validate(data)
+        with stage('build'):
+            batch = CartBatch.from_valid_list(carts)
+        with stage('price'):
+            return nudger.nudges(batch, limit)
+    return nudges
+
+
+async def nudge_handler(request):
+    '''
+    Request handler for /api/nudge
+    Cheapest articles lowering the delivery fee of each cart of a level2 or
+    level3 input
+    curl -F data=@level3/data.json 'http://<host>/api/nudge?limit=3'
+    '''
+    limit = nudge_limit(request)
+
+    def nudges(data: dict) -> dict:
+        with stage('build'):
+            nudger = Nudger(CompiledCatalog.from_data(data))
+        return staged_nudges(nudger, limit)(data)
+    return await handle_request(
+        request, nudges, variant=str(limit).encode())
+
+
+async def scenarios_handler(request):
+    '''
+    Request handler for /api/scenarios
+    Prices the carts of a level3 input against its catalog and each of its
+    scenarios, ?summary_only=1 leaves the totals of each cart out
+    curl -F data=@what-if.json 'http://<host>/api/scenarios?summary_only=1'
+    '''
+    summary_only = request.query.get('summary_only', '0') not in (
+        '0', 'false', 'no', '')
+
+    def evaluate(data: dict) -> dict:
+        with stage('price'):
+            return scenarios.evaluate(data, carts=not summary_only)
+    return await handle_request(
+        request, evaluate, variant=str(summary_only).encode())
+
+
+async def catalog_nudge_handler(request):
+    '''
+    Request handler for /api/catalog/nudge
+    Same as /api/nudge against the current catalog, its price index is
+    built when the catalog is loaded
+    curl -F data=@carts.json 'http://<host>/api/catalog/nudge?limit=3'
     '''
-    return handle_request(request, level3.price)
+    limit = nudge_limit(request)
+    with request.app[CATALOG].acquire() as version:
+        variant = '{}:{}'.format(version.compiled.digest, limit)
+        return await handle_request(
+            request, staged_nudges(version.nudger, limit),
+            variant=variant.encode())
 
 
-def run_app(host='127.0.0.1', port=8888):
+async def reload_handler(request):
+    '''
+    Request handler for /api/admin/catalog/reload
+    Loads the catalog file again and swaps it in, requests in flight finish
+    with the previous version
+    curl -X POST http://<host>/api/admin/catalog/reload
+    '''
+    try:
+        version = await request.app[CATALOG].reload()
+    except ReloadError as exc:
+        raise web.HTTPInternalServerError(reason=str(exc).splitlines()[0])
+    return web.json_response({
+        'version': version.number,
+        'digest': version.compiled.digest,
+        'loaded_at': version.loaded_at,
+    })
+
+
+async def stats_handler(request):
+    '''
+    Request handler for /api/stats
+    '''
+    return web.json_response(request.app[STATS].as_dict())
+
+
+async def ready_handler(request):
+    '''
+    Request handler for /ready
+    200 once the warm-up is done, 503 before
+    '''
+    if not request.app[READY].is_set():
+        return web.json_response({'ready': False}, status=503)
+    return web.json_response({
+        'ready': True,
+        'warmup_ms': request.app[STATS].gauges.get('warmup.ms', 0)})
+
+
+def warmup_payload(level: int) -> bytes:
+    '''
+    :returns JSON of the levelN part of WARMUP_INPUT
+    '''
+    return json.dumps({
+        key: WARMUP_INPUT[key] for key in engines.LEVEL_KEYS[level]}).encode()
+
+
+def warmup_carts(compiled: CompiledCatalog) -> bytes:
+    '''
+    :returns JSON carts of the articles of compiled
+    '''
+    article_ids = list(compiled.article_ids[:3])
+    return json.dumps({'carts': [
+        {'id': index, 'items': [{'article_id': article_id, 'quantity': 1}]}
+        for index, article_id in enumerate(article_ids)] + [
+            {'id': len(article_ids), 'items': []}]}).encode()
+
+
+async def warm_up(app, rounds: int) -> None:
+    '''
+    Runs the decode, price, serialize and compress steps of every route on
+    synthetic payloads, so that lazy imports, schemas and caches are warm
+    when the first request comes. Cache, statistics and admission control
+    are left untouched.
+    '''
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for level in (1, 2, 3):
+            price = staged(engines.resolve(app[ENGINE], level), level)
+            body, _ = encode_json(price(decode_json(warmup_payload(level))))
+            compress(body, accepted_encoding('gzip, deflate'))
+            await asyncio.sleep(0)
+        data = decode_json(warmup_payload(3))
+        nudger = Nudger(CompiledCatalog.from_data(data))
+        encode_json(staged_nudges(nudger, DEFAULT_LIMIT)(data))
+        await asyncio.sleep(0)
+        if CATALOG in app:
+            with app[CATALOG].acquire() as version:
+                carts = decode_json(warmup_carts(version.compiled))
+                response = await staged_catalog(version.compiled)(carts)
+                encode_json(response)
+                encode_totals(response)
+                staged_nudges(version.nudger, DEFAULT_LIMIT)(carts)
+            await asyncio.sleep(0)
+    elapsed = (time.perf_counter() - started) * 1000
+    app[STATS].set('warmup.ms', elapsed)
+    LOGGER.info('Warm-up done in %.1f ms (%d rounds)', elapsed, rounds)
+
+
+def warming_up(rounds: int):
+    '''
+    :returns cleanup context running the warm-up in the background, then
+    setting READY
+    '''
+    async def warming(app):
+        async def run():
+            try:
+                await warm_up(app, rounds)
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('Warm-up failed, serving anyway')
+            app[READY].set()
+        task = asyncio.create_task(run())
+        yield
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    return warming
+
+
+async def close_parallel(app):
+    '''
+    Stops parallel pricing workers on shutdown
+    '''
+    app[PARALLEL].close()
+
+
+async def close_catalog(app):
+    '''
+    Unmaps the compiled catalogs on shutdown
+    '''
+    app[CATALOG].close()
+
+
+def watch_catalog(interval: float):
+    '''
+    :returns cleanup context running the catalog watching task
+    '''
+    async def watching(app):
+        task = asyncio.create_task(app[CATALOG].watch(interval))
+        yield
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    return watching
+
+
+def make_app(config: ServerConfig = None, **options) -> web.Application:
     '''
     aiohttp Application maker
+
+    >>> make_app(ServerConfig(catalog='catalog.zmc'))
+    >>> make_app(catalog='catalog.zmc', batch_delay=0.002)
     '''
-    loop = asyncio.get_event_loop()
-    app = web.Application(loop=loop)
+    config = (config or ServerConfig())._replace(**options)
+    max_body_size = config.limits.max_body_size
+    app = web.Application(
+        middlewares=[trace_middleware, admission_middleware],
+        client_max_size=sys.maxsize if max_body_size is None else max_body_size)
+    app[STATS] = Stats()
+    app[SERVER_TIMING] = config.server_timing
+    if config.compress_min_size is not None:
+        app[COMPRESS_MIN_SIZE] = config.compress_min_size
+    if config.stream_min_size is not None:
+        app[STREAM_MIN_SIZE] = config.stream_min_size
+    app[ENGINE] = engines.get(config.engine).name
+    app[ADMISSION] = AdmissionControl(config.limits, app[STATS])
+    app[CACHE] = ResponseCache(
+        config.cache_size, config.cache_ttl, app[STATS])
     app.router.add_post('/api/level1/price', level1_handler)
     app.router.add_post('/api/level2/price', level2_handler)
     app.router.add_post('/api/level3/price', level3_handler)
-    web.run_app(app, host=host, port=port)
+    app.router.add_post('/api/nudge', nudge_handler)
+    app.router.add_post('/api/scenarios', scenarios_handler)
+    app.router.add_get('/api/stats', stats_handler)
+    app.router.add_get('/ready', ready_handler)
+    app[READY] = asyncio.Event()
+    if config.catalog is not None:
+        app[CATALOG] = CatalogStore(config.catalog, app[STATS])
+        app.on_cleanup.append(close_catalog)
+        app.router.add_post('/api/catalog/price', catalog_handler)
+        app.router.add_post('/api/catalog/nudge', catalog_nudge_handler)
+        app.router.add_post('/api/admin/catalog/reload', reload_handler)
+        if config.catalog_watch is not None:
+            app.cleanup_ctx.append(watch_catalog(config.catalog_watch))
+    if config.slow_log_threshold is not None:
+        app[SLOW_LOG] = SlowLog(
+            config.slow_log_threshold, config.slow_log_sample,
+            config.slow_log_sink)
+    if config.parallel_workers is not None:
+        app[PARALLEL] = ParallelPricer(
+            config.parallel_workers, config.parallel_min_carts, app[STATS])
+        app.on_cleanup.append(close_parallel)
+    if config.batch_delay is not None:
+        app[BATCHER] = ValidatingBatcher(
+            config.batch_delay, config.batch_carts, app[STATS])
+    if config.warmup_rounds:
+        app.cleanup_ctx.append(warming_up(config.warmup_rounds))
+    else:
+        app[READY].set()
+    return app
+
+
+def run_app(host='127.0.0.1', port=8888, config: ServerConfig = None,
+            path: str = None):
+    '''
+    Runs zenmarket server
+    :param path: Unix socket to listen on as well as host:port
+    '''
+    web.run_app(make_app(config), host=host, port=port, path=path)
@@ -0,0 +1,187 @@
+'''
+Multi-file batch pricing: every level3 file of a directory is priced into
+an output directory by a pool of worker processes.
+
+Files are priced with the compiled engine. Files sharing a catalog
+(articles, delivery fees, discounts) share its compiled form: the first
+worker meeting a catalog content hash compiles it into a catalog file of a
+temporary directory, under a file lock, and every worker maps that file,
+whose pages are shared between the workers. Each catalog is thus compiled
+once per run. Outputs are the bytes of zm-cli level3 (but for the inputs
+where the compiled engine differs from the reference one), written to a
+temporary file then renamed, so an output either is complete or does not
+exist.
+
+>>> summary = price_directory('incoming', 'priced', jobs=8)
+>>> summary.carts / summary.seconds
+'''
+import concurrent.futures
+import fcntl
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import traceback
+from collections import namedtuple
+
+from zenmarket import GZIP_MAGIC, encode_json
+from zenmarket.algo import engines
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+from zenmarket.server.batching import catalog_key
+
+# pylint: disable=too-few-public-methods,W0702
+
+SUFFIXES = ('.json', '.json.gz')
+
+# catalog file path -> mapped CompiledCatalog, per worker process
+_CATALOGS = {}
+
+
+class FileResult(namedtuple('FileResult', [
+        'name', 'carts', 'size', 'catalog', 'compiled', 'error'])):
+    '''
+    Pricing of one input file
+    size: input bytes
+    catalog: content hash of its catalog
+    compiled: True when its catalog was compiled for it
+    error: last traceback line when it could not be priced
+    '''
+    pass
+
+
+class Summary(namedtuple('Summary', [
+        'files', 'failed', 'carts', 'size', 'catalogs', 'compiled',
+        'seconds'])):
+    '''
+    Batch totals
+    catalogs: distinct catalogs met
+    compiled: catalog compilations, one per catalog
+    '''
+
+    def format(self) -> str:
+        '''
+        :returns human readable throughput summary
+        '''
+        seconds = max(self.seconds, 1e-9)
+        return (
+            '{s.files} files ({s.failed} failed), {s.carts} carts, '
+            '{mib:.1f} MiB in {s.seconds:.2f}s: {files:.1f} files/s, '
+            '{carts:.0f} carts/s, {rate:.1f} MiB/s; {s.catalogs} catalogs, '
+            '{s.compiled} compilations').format(
+                s=self, mib=self.size / 2 ** 20, files=self.files / seconds,
+                carts=self.carts / seconds,
+                rate=self.size / 2 ** 20 / seconds)
+
+
+def input_names(directory: str) -> list:
+    '''
+    :returns names of the level3 inputs of directory
+    '''
+    return sorted(
+        name for name in os.listdir(directory)
+        if name.endswith(SUFFIXES) and
+        os.path.isfile(os.path.join(directory, name)))
+
+
+def write_atomically(path: str, body: bytes) -> None:
+    '''
+    Writes body to path through a temporary file renamed over it
+    '''
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temporary, 'wb') as fp:
+            fp.write(body)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temporary, path)
+    except:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def price_file(inpath: str, outpath: str, catalog_dir: str) -> FileResult:
+    '''
+    Worker: prices the level3 file inpath into outpath, with the engine
+    'compiled' and the catalogs compiled in catalog_dir by the workers
+    '''
+    engine = engines.get('compiled')
+    name = os.path.basename(inpath)
+    size, key, compiled_now = 0, None, False
+    try:
+        with open(inpath, 'rb') as fp:
+            raw = fp.read()
+        size = len(raw)
+        if raw[:2] == GZIP_MAGIC:
+            raw = gzip.decompress(raw)
+        valid = engine.validate(3, json.loads(raw.decode()))
+        key = catalog_key(valid)
+        path = os.path.join(catalog_dir, key + '.zmc')
+        compiled, batch = _CATALOGS.get(path), None
+        if compiled is None:
+            with open(path + '.lock', 'wb') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not os.path.exists(path):
+                    built, batch = engine.build(3, valid)
+                    write_atomically(path, built.buffer)
+                    compiled_now = True
+            compiled = _CATALOGS[path] = CompiledCatalog.open(path)
+        if batch is None:
+            batch = CartBatch.from_valid_list(valid['carts'])
+        body = encode_json(compiled.price(batch))
+        if outpath.endswith('.gz'):
+            body = gzip.compress(body, mtime=0)
+        write_atomically(outpath, body)
+    except:
+        return FileResult(
+            name, 0, size, key, compiled_now,
+            traceback.format_exception(*sys.exc_info())[-1].strip())
+    return FileResult(name, len(batch.ids), size, key, compiled_now, None)
+
+
+def price_directory(indir: str, outdir: str, jobs: int = 1,
+                    on_result=None) -> Summary:
+    '''
+    Prices every level3 file of indir into outdir under the same name
+    :param jobs: worker processes, 1 prices in this process
+    :param on_result: called with the FileResult of each file as it is done
+    '''
+    os.makedirs(outdir, exist_ok=True)
+    names = input_names(indir)
+    started = time.perf_counter()
+    results = []
+    with tempfile.TemporaryDirectory(prefix='zm-catalogs-') as catalog_dir:
+        jobs_args = [(os.path.join(indir, name), os.path.join(outdir, name),
+                      catalog_dir) for name in names]
+        if jobs <= 1:
+            try:
+                for args in jobs_args:
+                    results.append(price_file(*args))
+                    if on_result is not None:
+                        on_result(results[-1])
+            finally:
+                for path in [path for path in _CATALOGS
+                             if path.startswith(catalog_dir)]:
+                    _CATALOGS.pop(path).close()
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    jobs, mp_context=multiprocessing.get_context('spawn')
+            ) as executor:
+                futures = [executor.submit(price_file, *args)
+                           for args in jobs_args]
+                for future in concurrent.futures.as_completed(futures):
+                    results.append(future.result())
+                    if on_result is not None:
+                        on_result(results[-1])
+    return Summary(
+        files=len(results),
+        failed=sum(result.error is not None for result in results),
+        carts=sum(result.carts for result in results),
+        size=sum(result.size for result in results),
+        catalogs=len({result.catalog for result in results
+                      if result.catalog is not None}),
+        compiled=sum(result.compiled for result in results),
+        seconds=time.perf_counter() - started)
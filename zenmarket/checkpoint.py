@@ -0,0 +1,143 @@
+'''
+Checkpointed batch pricing: carts are priced chunk by chunk against a
+compiled catalog and appended to the output file; after each chunk the
+output is synced and a checkpoint (input offset, output offset, catalog
+and input hashes) written. An interrupted run resumed from its checkpoint
+writes the same bytes as an uninterrupted one, which are also the bytes
+written by zm-cli level3.
+
+>>> price_chunks(data, 'output.json', chunk_carts=10000)
+>>> price_chunks(data, 'output.json', chunk_carts=10000, resume=True)
+'''
+import json
+import os
+from collections import namedtuple
+
+from zenmarket.algo import engines
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+
+# pylint: disable=too-few-public-methods
+
+HEAD = b'{\n  "carts": ['
+VERSION = 2
+
+
+class CheckpointError(Exception):
+    '''
+    Exception raised when a checkpoint does not match the job it resumes
+    '''
+    pass
+
+
+class Checkpoint(namedtuple('Checkpoint', [
+        'input_offset', 'output_offset', 'catalog', 'carts', 'input'])):
+    '''
+    input_offset: carts priced so far
+    output_offset: output bytes holding them
+    catalog: digest of the compiled catalog they were priced with
+    carts: number of carts of the input
+    input: digest of the input, None when unknown
+    '''
+
+    @classmethod
+    def load(cls, path: str):
+        '''
+        :returns checkpoint saved at path
+        '''
+        with open(path) as fp:
+            content = json.load(fp)
+        if content.pop('version', None) != VERSION:
+            raise CheckpointError('Unknown checkpoint version in ' + path)
+        return cls(**content)
+
+    def save(self, path: str) -> None:
+        '''
+        Writes the checkpoint atomically
+        '''
+        with open(path + '.tmp', 'w') as fp:
+            json.dump(dict(self._asdict(), version=VERSION), fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(path + '.tmp', path)
+
+
+def encode_cart(cart: dict, first: bool) -> bytes:
+    '''
+    :returns cart as laid out by json.dumps(response, indent=2,
+    sort_keys=True), preceded by its separator
+    '''
+    lines = json.dumps(cart, indent=2, sort_keys=True).split('\n')
+    return ((',\n', '\n')[first] + '\n'.join(
+        '    ' + line for line in lines)).encode()
+
+
+def tail(carts: int) -> bytes:
+    '''
+    :returns end of the output of carts carts
+    '''
+    return b'\n  ]\n}\n' if carts else b']\n}\n'
+
+
+def price_chunks(data: dict, outpath: str, chunk_carts: int = 10000,
+                 checkpoint: str = None, resume: bool = False,
+                 compiled: CompiledCatalog = None,
+                 input_digest: str = None) -> None:
+    '''
+    Prices data['carts'] chunk by chunk into outpath. data is validated
+    once, as a level3 input unless compiled is given.
+
+    :param compiled: catalog to price carts against, compiled from data
+        when None
+    :param checkpoint: checkpoint path, outpath + '.ckpt' by default. It is
+        removed once the output is complete.
+    :param resume: continue from the checkpoint, if any
+    :param input_digest: digest of the input data was decoded from, a
+        checkpoint written for another input is not resumed
+    :raises CheckpointError when the checkpoint was written for another
+        catalog or input
+    '''
+    checkpoint = checkpoint or outpath + '.ckpt'
+    if compiled is None:
+        data = engines.get('compiled').validate(3, data)
+        carts = data['carts']
+        compiled = CompiledCatalog.from_data(data)
+    else:
+        carts = CartBatch.validate(data)
+    state = Checkpoint(
+        0, len(HEAD), compiled.digest, len(carts), input_digest)
+    if resume and os.path.exists(checkpoint):
+        saved = Checkpoint.load(checkpoint)
+        if saved.catalog != state.catalog:
+            raise CheckpointError(
+                'Checkpoint {} was written with catalog {}, not {}'.format(
+                    checkpoint, saved.catalog, state.catalog))
+        if saved.carts != state.carts:
+            raise CheckpointError(
+                'Checkpoint {} was written for {} carts, not {}'.format(
+                    checkpoint, saved.carts, state.carts))
+        if saved.input != state.input:
+            raise CheckpointError(
+                'Checkpoint {} was written for input {}, not {}'.format(
+                    checkpoint, saved.input, state.input))
+        state = saved
+        outfile = open(outpath, 'r+b')
+        outfile.truncate(state.output_offset)  # drop an unfinished chunk
+        outfile.seek(state.output_offset)
+    else:
+        outfile = open(outpath, 'wb')
+        outfile.write(HEAD)
+    with outfile:
+        for start in range(state.input_offset, len(carts), chunk_carts):
+            chunk = carts[start:start + chunk_carts]
+            response = compiled.price(CartBatch.from_valid_list(chunk))
+            for index, cart in enumerate(response['carts'], start):
+                outfile.write(encode_cart(cart, not index))
+            outfile.flush()
+            os.fsync(outfile.fileno())
+            state = state._replace(
+                input_offset=start + len(chunk),
+                output_offset=outfile.tell())
+            state.save(checkpoint)
+        outfile.write(tail(len(carts)))
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
@@ -0,0 +1,328 @@
+'''
+Async client of zm-cli serve: keep-alive connection pool, bounded
+concurrency, retries with backoff and coalescing of small pricing calls.
+
+Concurrent calls on the same route sharing the same catalog (articles,
+delivery fees, discounts) are collected for up to batch_delay seconds or
+batch_carts carts and sent as one request, whose response is split back
+between them. Should the merged request be rejected (400, 413), its calls
+are sent one by one, so that each gets the response or error it would have
+got on its own.
+
+Pricing is idempotent: requests failing on connection errors, timeouts or
+429/502/503/504 are retried up to retries times, after a random delay up
+to backoff * 2 ** attempt seconds (or Retry-After when longer).
+
+>>> async with Client('http://127.0.0.1:8888') as client:
+...     responses = await asyncio.gather(*(
+...         client.price(3, data) for data in inputs))
+'''
+import asyncio
+import json
+import random
+import time
+from collections import namedtuple
+
+import aiohttp
+
+from zenmarket.server.batching import CATALOG_KEYS, catalog_key
+from zenmarket.server.stats import Stats
+
+# pylint: disable=too-few-public-methods
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# statuses of a merged request telling that some call is to blame
+SPLIT_STATUSES = (400, 413)
+
+
+class ClientConfig(namedtuple('ClientConfig', [
+        'pool_size', 'concurrency', 'batch_delay', 'batch_carts', 'retries',
+        'backoff', 'max_backoff', 'timeout', 'engine'],
+        defaults=[100, 32, 0.002, 5000, 3, 0.05, 2, 60, None])):
+    '''
+    Client settings
+    pool_size: keep-alive connections to the server
+    concurrency: requests in flight, the others wait
+    batch_delay: seconds calls wait for others to be coalesced with, None
+        disables coalescing
+    batch_carts: send coalesced calls as soon as they hold that many carts
+    retries: attempts after the first one on retryable failures
+    backoff: seconds, retry delays are drawn up to backoff * 2 ** attempt
+    max_backoff: seconds, upper bound of the retry delays
+    timeout: seconds allowed to each request
+    engine: pricing engine of /api/levelN/price, the server default when
+        None
+    '''
+    pass
+
+
+class PricingFailed(Exception):
+    '''
+    Exception raised when the server rejects a pricing call
+    '''
+
+    def __init__(self, status: int, reason: str):
+        super().__init__('{} {}'.format(status, reason))
+        self.status = status
+        self.reason = reason
+
+
+class Pending(namedtuple('Pending', ['path', 'data', 'jobs', 'started'])):
+    '''
+    Calls waiting to be sent together
+    data: first call input, its catalog is the one of every call
+    jobs: list of (input, asyncio.Future)
+    '''
+
+    @property
+    def cart_count(self):
+        '''
+        :returns number of carts waiting
+        '''
+        return sum(len(data['carts']) for data, _ in self.jobs)
+
+
+class Client:
+    '''
+    Pricing client of the server at base_url, to be used as an async
+    context manager (or started and closed explicitly)
+    '''
+
+    def __init__(self, base_url: str, config: ClientConfig = None,
+                 **options):
+        self.base_url = base_url.rstrip('/')
+        self.config = (config or ClientConfig())._replace(**options)
+        self.stats = Stats()
+        self.session = None
+        self.semaphore = None
+        self.pending = {}
+        self.flushes = set()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def start(self) -> None:
+        '''
+        Opens the connection pool
+        '''
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.config.pool_size),
+            timeout=aiohttp.ClientTimeout(total=self.config.timeout))
+        self.semaphore = asyncio.Semaphore(self.config.concurrency)
+
+    async def close(self) -> None:
+        '''
+        Sends the calls waiting to be coalesced, then closes the pool
+        '''
+        for key, pending in list(self.pending.items()):
+            self.flush(key, pending)
+        while self.flushes:
+            await asyncio.gather(*self.flushes, return_exceptions=True)
+        await self.session.close()
+
+    def retry_delay(self, attempt: int, retry_after: str = None) -> float:
+        '''
+        :returns seconds to wait before retry attempt (from 0)
+        '''
+        delay = random.uniform(0, min(
+            self.config.max_backoff, self.config.backoff * 2 ** attempt))
+        try:
+            return max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            return delay
+
+    async def post(self, path: str, payload: dict) -> dict:
+        '''
+        Posts payload as a JSON body to path, with retries
+        :returns decoded JSON response
+        :raises PricingFailed, aiohttp.ClientError, asyncio.TimeoutError
+        '''
+        body = json.dumps(payload).encode()
+        headers = {'Content-Type': 'application/json'}
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with self.semaphore:
+                    self.stats.incr('client.requests')
+                    async with self.session.post(
+                            self.base_url + path, data=body,
+                            headers=headers) as resp:
+                        if resp.status == 200:
+                            return await resp.json()
+                        await resp.read()
+                        failure = PricingFailed(resp.status, resp.reason)
+                        retry_after = resp.headers.get('Retry-After')
+                if failure.status not in RETRY_STATUSES:
+                    raise failure
+            except (aiohttp.ClientConnectionError,
+                    asyncio.TimeoutError) as exc:
+                failure = exc
+            if attempt >= self.config.retries:
+                raise failure
+            self.stats.incr('client.retries')
+            await asyncio.sleep(self.retry_delay(attempt, retry_after))
+            attempt += 1
+
+    async def price(self, level: int, data: dict) -> dict:
+        '''
+        :returns /api/levelN/price response for data
+        :raises PricingFailed
+        '''
+        path = '/api/level{}/price'.format(level)
+        if self.config.engine is not None:
+            path += '?engine=' + self.config.engine
+        return await self.call(path, data, catalog_key(data)
+                               if isinstance(data, dict) else None)
+
+    async def price_catalog(self, data: dict) -> dict:
+        '''
+        :returns /api/catalog/price response for data['carts'], priced
+        against the catalog of the server
+        :raises PricingFailed
+        '''
+        return await self.call('/api/catalog/price', data, '')
+
+    async def call(self, path: str, data: dict, key: str) -> dict:
+        '''
+        Posts data to path, coalesced with the other calls of the same key
+        '''
+        self.stats.incr('client.calls')
+        if self.config.batch_delay is None or key is None or \
+                not isinstance(data, dict) or \
+                not isinstance(data.get('carts'), list):
+            return await self.post(path, data)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (path, key)
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = self.pending[key] = Pending(
+                path, data, [], time.monotonic())
+            loop.call_later(self.config.batch_delay, self.flush, key, pending)
+        pending.jobs.append((data, future))
+        if pending.cart_count >= self.config.batch_carts:
+            self.flush(key, pending)
+        return await future
+
+    def flush(self, key: tuple, pending: Pending) -> None:
+        '''
+        Sends the pending calls of key
+        '''
+        if self.pending.get(key) is not pending:
+            return  # already sent because batch_carts was reached
+        del self.pending[key]
+        task = asyncio.ensure_future(self.send(pending))
+        self.flushes.add(task)
+        task.add_done_callback(self.flushes.discard)
+
+    async def send(self, pending: Pending) -> None:
+        '''
+        Posts the calls of pending as one request and resolves their
+        futures
+        '''
+        jobs = [(data, future) for data, future in pending.jobs
+                if not future.cancelled()]
+        if len(jobs) == 1:
+            await self.resolve(pending.path, *jobs[0])
+            return
+        self.stats.incr('client.coalesced', len(jobs))
+        self.stats.observe('client.batch.calls', len(jobs))
+        merged = {key: pending.data[key] for key in CATALOG_KEYS
+                  if key in pending.data}
+        merged['carts'] = [cart for data, _ in jobs for cart in data['carts']]
+        try:
+            response = await self.post(pending.path, merged)
+            carts = response['carts']
+            if len(carts) != len(merged['carts']):
+                raise PricingFailed(400, 'Unexpected response')
+        except PricingFailed as exc:
+            if exc.status not in SPLIT_STATUSES:
+                self.fail(jobs, exc)
+                return
+            # some call is wrong, send them one by one to tell which
+            self.stats.incr('client.split')
+            await asyncio.gather(*(
+                self.resolve(pending.path, data, future)
+                for data, future in jobs))
+            return
+        except Exception as exc:  # pylint: disable=broad-except
+            self.fail(jobs, exc)
+            return
+        start = 0
+        for data, future in jobs:
+            stop = start + len(data['carts'])
+            if not future.done():
+                future.set_result(dict(response, carts=carts[start:stop]))
+            start = stop
+
+    async def resolve(self, path: str, data: dict, future) -> None:
+        '''
+        Posts data alone and resolves future with the outcome
+        '''
+        try:
+            response = await self.post(path, data)
+        except Exception as exc:  # pylint: disable=broad-except
+            if not future.done():
+                future.set_exception(exc)
+            return
+        if not future.done():
+            future.set_result(response)
+
+    @staticmethod
+    def fail(jobs: list, exc: Exception) -> None:
+        '''
+        Resolves the futures of jobs with exc
+        '''
+        for _, future in jobs:
+            if not future.done():
+                future.set_exception(exc)
+
+
+class BenchResult(namedtuple('BenchResult', [
+        'mode', 'calls', 'carts', 'requests', 'seconds'])):
+    '''
+    Throughput of benchmark calls
+    requests: HTTP requests sent
+    '''
+
+    def format(self) -> str:
+        '''
+        :returns human readable throughput
+        '''
+        seconds = max(self.seconds, 1e-9)
+        return ('{r.mode}: {r.calls} calls ({r.carts} carts) in {r.requests} '
+                'requests, {r.seconds:.2f}s: {calls:.0f} calls/s, '
+                '{carts:.0f} carts/s').format(
+                    r=self, calls=self.calls / seconds,
+                    carts=self.carts / seconds)
+
+
+async def benchmark(base_url: str, level: int, inputs: list,
+                    mode: str = 'coalesced', **options) -> BenchResult:
+    '''
+    Prices inputs concurrently
+    :param mode: 'coalesced', 'pooled' (no coalescing) or 'naive' (one
+        connection and one request at a time, as ad-hoc scripts do)
+    '''
+    if mode != 'coalesced':
+        options['batch_delay'] = None
+    started = time.perf_counter()
+    if mode == 'naive':
+        for data in inputs:
+            async with Client(base_url, **options) as client:
+                await client.price(level, data)
+        requests = len(inputs)
+    else:
+        async with Client(base_url, **options) as client:
+            await asyncio.gather(*(client.price(level, data)
+                                   for data in inputs))
+        requests = client.stats.counters['client.requests']
+    return BenchResult(
+        mode, len(inputs), sum(len(data['carts']) for data in inputs),
+        requests, time.perf_counter() - started)
@@ -0,0 +1,82 @@
+'''
+Client of a warm zm-cli serve process listening on a Unix domain socket.
+
+Only the standard library is used, and only socket is imported, so
+zm-cli levelN --daemon SOCKET pays neither aiohttp imports nor server
+startup: the input is posted to /api/levelN/price of the daemon and the
+response handed back as the dict the local pricing would have returned.
+
+>>> price('/run/zenmarket.sock', 3, raw)
+{'carts': [...]}
+'''
+import json
+import socket
+
+
+class DaemonError(Exception):
+    '''
+    Exception raised when the daemon can't be reached or answers with an
+    unexpected status
+    '''
+    pass
+
+
+class PricingFailed(Exception):
+    '''
+    Exception raised when the daemon rejected the input (400), its message
+    is the error line of the local pricing
+    '''
+    pass
+
+
+def post(path: str, target: str, body, content_type: str = 'application/json'):
+    '''
+    Sends one HTTP/1.1 POST over the Unix socket path
+    :returns (status, reason, body)
+    '''
+    head = (
+        'POST {} HTTP/1.1\r\n'
+        'Host: localhost\r\n'
+        'Content-Type: {}\r\n'
+        'Content-Length: {}\r\n'
+        'Connection: close\r\n\r\n'
+    ).format(target, content_type, len(body)).encode()
+    chunks = []
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            sock.sendall(head)
+            sock.sendall(body)
+            while True:
+                chunk = sock.recv(1 << 16)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    except OSError as exc:
+        raise DaemonError('Daemon {} unreachable: {}'.format(path, exc))
+    response = b''.join(chunks)
+    head, _, body = response.partition(b'\r\n\r\n')
+    try:
+        _, status, reason = head.split(b'\r\n', 1)[0].decode(
+            'latin-1').split(' ', 2)
+        return int(status), reason, body
+    except ValueError:
+        raise DaemonError('Daemon {} sent a malformed response'.format(path))
+
+
+def price(path: str, level: int, raw, engine: str = None) -> dict:
+    '''
+    Prices raw, a levelN JSON input, on the daemon listening on path
+    :param engine: pricing engine, the daemon default when None
+    :raises PricingFailed, DaemonError
+    '''
+    target = '/api/level{}/price'.format(level)
+    if engine is not None:
+        target += '?engine=' + engine
+    status, reason, body = post(path, target, raw)
+    if status == 400:
+        raise PricingFailed(reason)
+    if status != 200:
+        raise DaemonError('Daemon {} answered {} {}'.format(
+            path, status, reason))
+    return json.loads(body.decode())
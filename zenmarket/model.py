@@ -104,6 +104,14 @@ class L1InputDataDesc(MappingSchema):
     carts = Carts(missing=[])
 
 
+class CartsDesc(MappingSchema):
+    '''
+    Carts part of a pricing input:
+    {"carts": [{"id": 1, "items": [{"article_id": 1, "quantity": 6}]}]}
+    '''
+    carts = Carts(missing=[])
+
+
 class CartTotal(MappingSchema):
     '''
     {'id': <cart_id>, 'total': <cart_total>}
@@ -232,7 +240,8 @@ class Discount(MappingSchema):
 
 class Discounts(SequenceSchema):
     '''
-    Sequence of discounts
+    Sequence of discounts. Discounts of the same article stack in order:
+    each one applies to the price left by the previous ones.
     [
         {"article_id": 20, "type": "amount", "value": 20},
         {"article_id": 30, "type": "percentage", "value": 10},
@@ -249,3 +258,45 @@ class L3InputDataDesc(L2InputDataDesc):
     ]}
     '''
     discounts = Discounts()
+
+
+class Scenario(MappingSchema):
+    '''
+    Catalog variant, its sections replace the ones of the base input:
+    {"name": "no discounts", "discounts": []}
+    '''
+    name = SchemaNode(String())
+    articles = Articles(missing=colander.drop)
+    delivery_fees = DeliveryFees(missing=colander.drop)
+    discounts = Discounts(missing=colander.drop)
+
+
+class Scenarios(SequenceSchema):
+    '''
+    [
+        {"name": "prices +5%", "articles": [...]},
+        {"name": "free delivery from 10", "delivery_fees": [...]},
+    ]
+    '''
+    scenario = Scenario()
+
+
+class ScenarioInputDataDesc(L3InputDataDesc):
+    '''
+    L3InputDataDesc (the base catalog and the carts) + {"scenarios": [...]}
+    '''
+    scenarios = Scenarios()
+
+
+class CatalogDesc(MappingSchema):
+    '''
+    Catalog part of a pricing input, i.e. everything but the carts:
+    {
+        "articles": [...],
+        "delivery_fees": [...],  # optional, no delivery fee when missing
+        "discounts": [...],  # optional
+    }
+    '''
+    articles = Articles(missing=[])
+    delivery_fees = DeliveryFees(missing=[])
+    discounts = Discounts(missing=[])
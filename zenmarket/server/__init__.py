@@ -0,0 +1,3 @@
+'''
+Building blocks of the zenmarket web server, wired together in zenmarket.app
+'''
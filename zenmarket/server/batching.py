@@ -0,0 +1,117 @@
+'''
+Request micro-batching: concurrent requests sharing the same catalog
+(articles, delivery fees, discounts) are priced together in a single pass.
+'''
+import asyncio
+import hashlib
+import json
+import time
+from collections import namedtuple
+
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+
+# pylint: disable=too-few-public-methods
+
+CATALOG_KEYS = ('articles', 'delivery_fees', 'discounts')
+
+
+def catalog_key(data: dict) -> str:
+    '''
+    :returns content hash of the catalog part of data
+    '''
+    catalog = {key: data.get(key) for key in CATALOG_KEYS}
+    return hashlib.sha256(json.dumps(
+        catalog, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+class Pending(namedtuple('Pending', ['data', 'jobs', 'started'])):
+    '''
+    Requests waiting to be priced for one catalog
+    jobs: list of (CartBatch, asyncio.Future)
+    '''
+
+    @property
+    def cart_count(self):
+        '''
+        :returns number of carts waiting
+        '''
+        return sum(batch.cart_count for batch, _ in self.jobs)
+
+
+class MicroBatcher:
+    '''
+    Collects requests for up to max_delay seconds or max_carts carts, then
+    prices them together
+
+    >>> batcher = MicroBatcher(max_delay=0.002, max_carts=1000)
+    >>> response = await batcher.price(data)
+    '''
+
+    def __init__(self, max_delay: float, max_carts: int, stats=None):
+        self.max_delay = max_delay
+        self.max_carts = max_carts
+        self.stats = stats
+        self.pending = {}
+
+    async def price(self, data: dict) -> dict:
+        '''
+        :param data: level3 input, already validated
+        :returns level3 response for data carts
+        '''
+        batch = CartBatch.from_data(data)
+        key = catalog_key(data)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = self.pending[key] = Pending(data, [], time.monotonic())
+            loop.call_later(self.max_delay, self.flush, key, pending)
+        pending.jobs.append((batch, future))
+        if pending.cart_count >= self.max_carts:
+            self.flush(key, pending)
+        return await future
+
+    def flush(self, key: str, pending: Pending) -> None:
+        '''
+        Prices pending jobs and resolves their futures
+        '''
+        if self.pending.get(key) is not pending:
+            return  # already flushed because max_carts was reached
+        del self.pending[key]
+        window = time.monotonic() - pending.started
+        jobs = [(batch, future) for batch, future in pending.jobs
+                if not future.cancelled()]
+        if self.stats is not None:
+            self.stats.incr('batch.flushes')
+            self.stats.observe('batch.window_ms', window * 1000)
+            self.stats.observe('batch.requests', len(jobs))
+            self.stats.observe('batch.carts', pending.cart_count)
+        try:
+            compiled = CompiledCatalog.from_data(pending.data)
+        except Exception as exc:  # pylint: disable=broad-except
+            for _, future in jobs:
+                future.set_exception(exc)
+            return
+
+        merged = CartBatch.concat(batch for batch, _ in jobs)
+        try:
+            totals = compiled.totals(merged)
+        except Exception:  # pylint: disable=broad-except
+            # some request is wrong, price them one by one to tell which
+            for batch, future in jobs:
+                self._resolve(future, compiled.price, batch)
+            return
+
+        start = 0
+        for batch, future in jobs:
+            stop = start + batch.cart_count
+            self._resolve(
+                future, compiled.response, batch.ids, totals[start:stop])
+            start = stop
+
+    @staticmethod
+    def _resolve(future, func, *args):
+        try:
+            future.set_result(func(*args))
+        except Exception as exc:  # pylint: disable=broad-except
+            future.set_exception(exc)
@@ -0,0 +1,122 @@
+'''
+Response cache for byte-identical pricing payloads: bounded LRU with a TTL,
+and single-flight so identical requests in flight are computed once.
+'''
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict, namedtuple
+
+from zenmarket.server.tracing import flag
+
+# pylint: disable=too-few-public-methods
+
+
+class CachedResponse(namedtuple('CachedResponse', [
+        'body', 'content_type', 'etag'])):
+    '''
+    Encoded response, ready to be sent
+    '''
+    pass
+
+
+def payload_key(*parts: bytes) -> str:
+    '''
+    :returns hash identifying a payload (route, format, body...)
+    '''
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+def make_etag(key: str) -> str:
+    '''
+    :returns strong ETag for payload key
+    '''
+    return '"{}"'.format(key[:32])
+
+
+class ResponseCache:
+    '''
+    LRU of CachedResponse keyed by payload_key
+
+    >>> cache = ResponseCache(max_size=1024, ttl=60)
+    >>> response = await cache.get_or_compute(key, compute)
+    '''
+
+    def __init__(self, max_size: int, ttl: float, stats=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = stats
+        self.entries = OrderedDict()
+        self.in_flight = {}
+
+    def _incr(self, name):
+        if self.stats is not None:
+            self.stats.incr(name)
+
+    def get(self, key: str):
+        '''
+        :returns cached response or None
+        '''
+        try:
+            expires, response = self.entries[key]
+        except KeyError:
+            return None
+        if expires < time.monotonic():
+            del self.entries[key]
+            self._incr('cache.expired')
+            return None
+        self.entries.move_to_end(key)
+        return response
+
+    def put(self, key: str, response: CachedResponse) -> None:
+        '''
+        Stores response, evicting the least recently used entries
+        '''
+        if self.max_size <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self._incr('cache.evictions')
+
+    async def get_or_compute(self, key: str, compute,
+                             name: str = 'cache') -> CachedResponse:
+        '''
+        :param compute: coroutine function returning a CachedResponse
+        :param name: trace flag set to hit, collapsed or miss
+        Errors are not cached, they are raised to every waiting caller.
+        compute goes on when the caller that started it is cancelled.
+        '''
+        response = self.get(key)
+        if response is not None:
+            self._incr('cache.hits')
+            flag(name, 'hit')
+            return response
+        in_flight = self.in_flight.get(key)
+        if in_flight is not None:
+            self._incr('cache.collapsed')
+            flag(name, 'collapsed')
+            return await asyncio.shield(in_flight)
+
+        self._incr('cache.misses')
+        flag(name, 'miss')
+        # a task of its own, so that callers going away don't cancel it for
+        # the others
+        task = self.in_flight[key] = asyncio.ensure_future(
+            self._compute(key, compute))
+        # do not warn when nobody was left to get the error
+        task.add_done_callback(lambda done: done.cancelled() or
+                               done.exception())
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: str, compute) -> CachedResponse:
+        try:
+            response = await compute()
+        finally:
+            del self.in_flight[key]
+        self.put(key, response)
+        return response
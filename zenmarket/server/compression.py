@@ -0,0 +1,76 @@
+'''
+Compressed bodies.
+
+Requests: aiohttp decompresses gzip and deflate bodies as they are read,
+before multipart parsing and under the client_max_size limit, so pricing
+code only sees plain payloads. Other content codings are rejected.
+
+Responses: bodies of at least min_size bytes are compressed with the
+encoding preferred by Accept-Encoding. Compressed bodies get their own ETag
+and are cached next to the plain ones.
+'''
+import gzip
+import zlib
+
+from aiohttp import web
+
+ENCODINGS = ('gzip', 'deflate')
+LEVEL = 6
+
+
+def request_encoding(request) -> str:
+    '''
+    :returns Content-Encoding of request, None for identity
+    :raises HTTPUnsupportedMediaType for codings other than ENCODINGS
+    '''
+    encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if encoding in ('', 'identity'):
+        return None
+    if encoding not in ENCODINGS:
+        raise web.HTTPUnsupportedMediaType(
+            reason='Unsupported Content-Encoding {!r}'.format(encoding))
+    return encoding
+
+
+def accepted_encoding(header: str) -> str:
+    '''
+    :returns preferred encoding of ENCODINGS in an Accept-Encoding header,
+    gzip first on ties, None when none is acceptable
+
+    >>> accepted_encoding('deflate, gzip;q=0.5')
+    'deflate'
+    '''
+    weights = {}
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    '''
+    :returns body compressed with encoding, gzip output does not depend on
+    the time so that it can be cached and tagged
+    '''
+    if encoding == 'gzip':
+        return gzip.compress(body, LEVEL, mtime=0)
+    return zlib.compress(body, LEVEL)
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    '''
+    :returns ETag of the encoding representation of a response tagged etag
+    '''
+    return '{}-{}"'.format(etag[:-1], encoding)
@@ -0,0 +1,118 @@
+'''
+Admission control: reject requests over the configured limits before they
+are read, decoded or priced.
+'''
+import asyncio
+import contextlib
+from collections import namedtuple
+
+from aiohttp import web
+
+# pylint: disable=too-few-public-methods
+
+
+class Limits(namedtuple('Limits', [
+        'max_body_size', 'max_carts', 'max_items', 'max_in_flight',
+        'retry_after'], defaults=[64 * 2 ** 20, None, None, None, 1])):
+    '''
+    max_body_size: bytes, requests above it get 413
+    max_carts, max_items: per request, requests above them get 413
+    max_in_flight: concurrent pricing jobs, requests above it get 503
+    retry_after: seconds advertised in Retry-After with 503
+    None means unlimited.
+    '''
+    pass
+
+
+class RequestRejected(Exception):
+    '''
+    Exception raised when a request is over a limit
+    '''
+
+    def __init__(self, status: int, reason: str, headers=None):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+    def http_error(self) -> web.HTTPException:
+        '''
+        :returns matching aiohttp error, a new one on every call
+        '''
+        error_class = {
+            413: web.HTTPRequestEntityTooLarge,
+            503: web.HTTPServiceUnavailable,
+        }[self.status]
+        if error_class is web.HTTPRequestEntityTooLarge:
+            return error_class(
+                max_size=0, actual_size=0, reason=self.reason,
+                text=self.reason, headers=self.headers)
+        return error_class(reason=self.reason, headers=self.headers)
+
+
+class AdmissionControl:
+    '''
+    Checks requests against Limits and counts rejections in stats
+    '''
+
+    def __init__(self, limits: Limits, stats):
+        self.limits = limits
+        self.stats = stats
+        self.semaphore = None
+        self.in_flight = 0
+        if limits.max_in_flight is not None:
+            self.semaphore = asyncio.Semaphore(limits.max_in_flight)
+
+    def reject(self, counter: str, status: int, reason: str, headers=None):
+        '''
+        Counts and raises RequestRejected
+        '''
+        self.stats.incr('limits.' + counter)
+        raise RequestRejected(status, reason, headers)
+
+    def check_body_size(self, request) -> None:
+        '''
+        Checks Content-Length, chunked bodies are bounded by the
+        application client_max_size
+        '''
+        max_size = self.limits.max_body_size
+        if max_size is not None and (request.content_length or 0) > max_size:
+            self.reject(
+                'body_size', 413,
+                'Request body larger than {} bytes'.format(max_size))
+
+    def check_shape(self, shape: dict) -> None:
+        '''
+        Checks carts and items counts of a payload_shape
+        '''
+        carts, items = shape.get('carts', 0), shape.get('items', 0)
+        if self.limits.max_carts is not None and carts > self.limits.max_carts:
+            self.reject('carts', 413, 'More than {} carts'.format(
+                self.limits.max_carts))
+        if self.limits.max_items is not None and items > self.limits.max_items:
+            self.reject('items', 413, 'More than {} cart items'.format(
+                self.limits.max_items))
+
+    def check_in_flight(self) -> None:
+        '''
+        Checks that a pricing slot is free
+        '''
+        if self.semaphore is not None and self.semaphore.locked():
+            self.reject(
+                'in_flight', 503, 'Too many pricing jobs in flight',
+                {'Retry-After': str(self.limits.retry_after)})
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        '''
+        Holds one pricing slot, fails immediately when none is free
+        '''
+        self.check_in_flight()
+        async with self.semaphore or contextlib.nullcontext():
+            self.in_flight += 1
+            self.stats.set('in_flight', self.in_flight)
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+                self.stats.set('in_flight', self.in_flight)
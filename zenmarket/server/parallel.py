@@ -0,0 +1,188 @@
+'''
+Parallel pricing of huge requests: the compiled catalog and the columnar
+cart arrays are copied once into shared memory, worker processes price
+slices of carts zero-copy and write totals into a shared result array.
+'''
+import asyncio
+import concurrent.futures
+import multiprocessing
+import sys
+from array import array
+from multiprocessing import shared_memory
+
+import colander
+
+from zenmarket.algo import level1
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+from zenmarket.server.tracing import flag
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    '''
+    Attaches an existing segment, the parent process owns and unlinks it.
+    Before 3.13 workers register it again with the resource tracker they
+    share with the parent, which is harmless.
+    '''
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def _share(buffer) -> shared_memory.SharedMemory:
+    '''
+    :returns new segment holding a copy of buffer
+    '''
+    view = memoryview(buffer).cast('B')
+    segment = shared_memory.SharedMemory(create=True, size=max(len(view), 1))
+    segment.buf[:len(view)] = view
+    return segment
+
+
+def price_slice(catalog_name: str, batch_name: str, result_name: str,
+                n_carts: int, n_items: int, start: int, stop: int) -> None:
+    '''
+    Worker: prices carts [start, stop) and writes their totals in the result
+    segment
+    '''
+    segments = [_attach(name) for name in (
+        catalog_name, batch_name, result_name)]
+    catalog_segment, batch_segment, result_segment = segments
+    words = batch_segment.buf.cast('q')
+    results = result_segment.buf.cast('q')
+    compiled = CompiledCatalog(catalog_segment.buf)
+    columns = (
+        words[start:stop + 1],
+        words[n_carts + 1:n_carts + 1 + n_items],
+        words[n_carts + 1 + n_items:n_carts + 1 + 2 * n_items])
+    try:
+        batch = CartBatch(range(stop - start), *columns)
+        results[start:stop] = array('q', compiled.totals(batch))
+    finally:
+        for view in columns + (words, results):
+            view.release()
+        compiled.close()
+        for segment in segments:
+            segment.close()
+
+
+class ParallelPricer:
+    '''
+    Prices batches of at least min_carts carts on a pool of workers processes
+
+    >>> pricer = ParallelPricer(workers=4, min_carts=100000)
+    >>> response = await pricer.price(compiled, batch)
+    '''
+
+    def __init__(self, workers: int, min_carts: int, stats=None):
+        self.workers = workers
+        self.min_carts = min_carts
+        self.stats = stats
+        self.executor = None
+        # digest: [segment, price() calls using it] of the shared catalogs
+        self.catalogs = {}
+        self.current = None  # digest of the last catalog, kept once unused
+
+    def wants(self, cart_count: int) -> bool:
+        '''
+        :returns True when a batch that large should be priced in parallel
+        '''
+        return cart_count >= self.min_carts
+
+    def _acquire_catalog(self, compiled: CompiledCatalog):
+        '''
+        :returns segment holding compiled, reused while the catalog is
+        unchanged, to be released once its slices are priced
+        '''
+        shared = self.catalogs.get(compiled.digest)
+        if shared is None:
+            flag('shared_catalog', 'miss')
+            shared = self.catalogs[compiled.digest] = [
+                _share(compiled.buffer), 0]
+        else:
+            flag('shared_catalog', 'hit')
+        shared[1] += 1
+        previous, self.current = self.current, compiled.digest
+        if previous is not None and previous != self.current:
+            self._release_catalog(previous, 0)
+        return shared[0]
+
+    def _release_catalog(self, digest: str, calls: int = 1):
+        '''
+        Unlinks the segment of digest once no price() call uses it, but the
+        one of the last catalog
+        '''
+        shared = self.catalogs.get(digest)
+        if shared is None:
+            return
+        shared[1] -= calls
+        if shared[1] <= 0 and digest != self.current:
+            del self.catalogs[digest]
+            shared[0].close()
+            shared[0].unlink()
+
+    async def price(self, compiled: CompiledCatalog, batch: CartBatch) -> dict:
+        '''
+        :returns compiled.price(batch), computed by the workers
+        '''
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('spawn'))
+        n_carts, n_items = batch.cart_count, len(batch.article_ids)
+        catalog_segment = self._acquire_catalog(compiled)
+        columns = array('q', batch.offsets)
+        columns.extend(batch.article_ids)
+        columns.extend(batch.quantities)
+        try:
+            totals = await self._price_slices(
+                catalog_segment, columns, n_carts, n_items)
+        finally:
+            self._release_catalog(compiled.digest)
+        if self.stats is not None:
+            self.stats.incr('parallel.requests')
+            self.stats.observe('parallel.carts', n_carts)
+        return compiled.response(batch.ids, totals)
+
+    async def _price_slices(self, catalog_segment, columns: array,
+                            n_carts: int, n_items: int) -> list:
+        '''
+        :returns totals of the carts of columns, priced by the workers
+        '''
+        batch_segment = _share(columns)
+        result_segment = shared_memory.SharedMemory(
+            create=True, size=max(8 * n_carts, 1))
+        try:
+            step = -(-n_carts // self.workers) if n_carts else 1
+            loop = asyncio.get_running_loop()
+            outcomes = await asyncio.gather(*(
+                loop.run_in_executor(
+                    self.executor, price_slice, catalog_segment.name,
+                    batch_segment.name, result_segment.name, n_carts,
+                    n_items, start, min(start + step, n_carts))
+                for start in range(0, n_carts, step)
+            ), return_exceptions=True)
+            errors = [exc for exc in outcomes if exc is not None]
+            if errors:
+                # level3 reports undefined articles, then negative totals,
+                # then fee errors
+                raise min(errors, key=lambda exc: (
+                    not isinstance(exc, level1.UndefinedArticleReference),
+                    not isinstance(exc, colander.Invalid)))
+            results = result_segment.buf.cast('q')
+            totals = results.tolist()[:n_carts]
+            results.release()
+        finally:
+            for segment in (batch_segment, result_segment):
+                segment.close()
+                segment.unlink()
+        return totals
+
+    def close(self) -> None:
+        '''
+        Stops workers and frees the shared catalogs
+        '''
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.current = None
+        for digest in list(self.catalogs):
+            self._release_catalog(digest, 0)
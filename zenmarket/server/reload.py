@@ -0,0 +1,178 @@
+'''
+Hot catalog reload: a new catalog is built and validated off the event loop,
+then swapped in atomically. Requests hold the version they started with
+until they finish; a replaced version is unmapped once its last request is
+done.
+
+Catalog files are either compiled catalogs (zm-cli compile-catalog) or JSON
+catalogs compiled on load. Compiled catalogs are mmap-ed: replace them with
+a rename (write to a temporary file, then mv) rather than in place.
+
+>>> store = CatalogStore('catalog.zmc', stats)
+>>> with store.acquire() as version:
+...     version.compiled.price(batch)
+>>> await store.reload()
+'''
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+
+from zenmarket.algo.catalog import MAGIC, CompiledCatalog
+from zenmarket.algo.nudge import Nudger
+
+# pylint: disable=too-few-public-methods
+
+LOGGER = logging.getLogger('zenmarket.reload')
+
+
+class ReloadError(Exception):
+    '''
+    Exception raised when a new catalog can't be loaded, the current one is
+    kept
+    '''
+    pass
+
+
+class CatalogVersion(namedtuple('CatalogVersion', [
+        'number', 'compiled', 'nudger', 'loaded_at'])):
+    '''
+    A loaded catalog, number increases with each reload
+    '''
+    pass
+
+
+def load(path: str):
+    '''
+    :returns (compiled catalog, nudger) of the catalog file path, built and
+    validated
+    '''
+    with open(path, 'rb') as fp:
+        compiled_file = fp.read(len(MAGIC)) == MAGIC
+        if not compiled_file:
+            fp.seek(0)
+            data = json.loads(fp.read().decode())
+    compiled = CompiledCatalog.open(path) if compiled_file else \
+        CompiledCatalog.from_data(data)
+    try:
+        return compiled, Nudger(compiled)
+    except:
+        compiled.close()
+        raise
+
+
+def file_state(path: str):
+    '''
+    :returns what changes when path is modified or replaced
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class CatalogStore:
+    '''
+    Current catalog version and the versions still used by requests
+
+    :param path: catalog file, reloaded from the same path
+    :param stats: Stats receiving catalog.version, catalog.digest,
+        catalog.reloads, catalog.reload_errors and catalog.reload_ms
+    '''
+
+    def __init__(self, path: str, stats=None):
+        self.path = path
+        self.stats = stats
+        self.users = {}  # version number -> requests using it
+        self.retired = {}  # version number -> replaced version in use
+        self.lock = asyncio.Lock()
+        self.watched = file_state(path)
+        compiled, nudger = load(path)
+        self.current = None
+        self._swap(compiled, nudger)
+
+    def _swap(self, compiled: CompiledCatalog, nudger: Nudger) -> None:
+        old = self.current
+        number = 1 if old is None else old.number + 1
+        self.current = CatalogVersion(number, compiled, nudger, time.time())
+        if old is not None:
+            if self.users.get(old.number):
+                self.retired[old.number] = old
+            else:
+                old.compiled.close()
+        if self.stats is not None:
+            self.stats.set('catalog.version', number)
+            self.stats.set('catalog.digest', compiled.digest)
+            self.stats.set('catalog.loaded_at', self.current.loaded_at)
+
+    @contextlib.contextmanager
+    def acquire(self):
+        '''
+        Context manager giving the current CatalogVersion, which stays
+        usable until the block exits even if a reload happens meanwhile
+        '''
+        version = self.current
+        self.users[version.number] = self.users.get(version.number, 0) + 1
+        try:
+            yield version
+        finally:
+            self.users[version.number] -= 1
+            if not self.users[version.number]:
+                del self.users[version.number]
+                retired = self.retired.pop(version.number, None)
+                if retired is not None:
+                    retired.compiled.close()
+
+    async def reload(self) -> CatalogVersion:
+        '''
+        Loads path in a worker thread and swaps it in
+        :raises ReloadError, the current version is kept
+        '''
+        async with self.lock:
+            started = time.perf_counter()
+            state = file_state(self.path)
+            try:
+                compiled, nudger = await asyncio.get_running_loop(
+                ).run_in_executor(None, load, self.path)
+            except Exception as exc:
+                if self.stats is not None:
+                    self.stats.incr('catalog.reload_errors')
+                raise ReloadError('Catalog {} not reloaded: {}: {}'.format(
+                    self.path, type(exc).__name__, exc))
+            self.watched = state
+            self._swap(compiled, nudger)
+            if self.stats is not None:
+                self.stats.incr('catalog.reloads')
+                self.stats.observe(
+                    'catalog.reload_ms', (time.perf_counter() - started) * 1000)
+            return self.current
+
+    async def watch(self, interval: float) -> None:
+        '''
+        Reloads the catalog whenever its file changes, polling every
+        interval seconds. Runs until cancelled.
+        '''
+        while True:
+            await asyncio.sleep(interval)
+            if file_state(self.path) in (None, self.watched):
+                continue
+            try:
+                version = await self.reload()
+            except ReloadError as exc:
+                LOGGER.error(str(exc))
+                self.watched = file_state(self.path)  # until it changes again
+            else:
+                LOGGER.info('Catalog %s reloaded, version %d',
+                            self.path, version.number)
+
+    def close(self) -> None:
+        '''
+        Unmaps every version
+        '''
+        for version in [self.current] + list(self.retired.values()):
+            version.compiled.close()
+        self.retired.clear()
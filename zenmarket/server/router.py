@@ -0,0 +1,332 @@
+'''
+Catalog-affinity router: a front process spreading pricing requests over
+zm-cli serve backends by consistent hashing of their catalog content hash,
+so that each catalog is compiled and kept hot on a few backends only.
+
+Requests go to the first healthy backend of the ring from their key and
+fail over to the next ones on connection errors and 502/503/504. Backends
+are health-checked in the background on /ready, so that they get requests
+once warm, and reached through a pool of keep-alive connections. Admin
+requests (/api/admin/...) are sent to every backend.
+
+>>> app = make_router(RouterConfig(backends=['http://10.0.0.1:8888',
+...                                          'http://10.0.0.2:8888']))
+'''
+import asyncio
+import bisect
+import contextlib
+import hashlib
+import json
+from collections import namedtuple
+
+import aiohttp
+from aiohttp import web
+
+from zenmarket import app as pricing_app
+from zenmarket.server.batching import CATALOG_KEYS, catalog_key
+from zenmarket.server.stats import Stats
+
+# pylint: disable=too-few-public-methods
+
+CATALOG_HEADER = 'X-Catalog-Key'
+
+FORWARDED_REQUEST_HEADERS = (
+    'Accept', 'Accept-Encoding', 'If-None-Match', 'X-Server-Timing')
+
+FORWARDED_RESPONSE_HEADERS = (
+    'Content-Encoding', 'ETag', 'Retry-After', 'Server-Timing', 'Vary')
+
+FAILOVER_STATUSES = (502, 503, 504)
+
+ADMIN_PREFIX = '/api/admin/'
+
+
+class RouterConfig(namedtuple('RouterConfig', [
+        'backends', 'replicas', 'health_interval', 'timeout', 'pool_size'],
+        defaults=[(), 100, 2, 60, 100])):
+    '''
+    Router settings
+    backends: base URLs of the zm-cli serve processes
+    replicas: points of each backend on the hash ring
+    health_interval: seconds between health checks, None disables them
+    timeout: seconds allowed to a backend to answer
+    pool_size: keep-alive connections per backend
+    '''
+    pass
+
+
+class HashRing:
+    '''
+    Consistent hash ring of nodes, each placed replicas times
+
+    >>> ring = HashRing(['a', 'b', 'c'])
+    >>> list(ring.nodes_for('catalog key'))
+    ['a', 'c', 'b']
+    '''
+
+    def __init__(self, nodes, replicas: int = 100):
+        points = sorted(
+            (self.position('{}#{}'.format(node, index)), node)
+            for node in nodes for index in range(replicas))
+        self.positions = [position for position, _ in points]
+        self.nodes = [node for _, node in points]
+        self.distinct = len(set(nodes))
+
+    @staticmethod
+    def position(key: str) -> int:
+        '''
+        :returns ring position of key
+        '''
+        return int.from_bytes(
+            hashlib.sha256(key.encode()).digest()[:8], 'big')
+
+    def nodes_for(self, key: str):
+        '''
+        :returns iterator of the distinct nodes met clockwise from key
+        '''
+        if not self.nodes:
+            return
+        start = bisect.bisect(self.positions, self.position(key))
+        seen = set()
+        for index in range(start, start + len(self.nodes)):
+            node = self.nodes[index % len(self.nodes)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == self.distinct:
+                    return
+
+
+class Backends:
+    '''
+    Backend ring, health and connection pool
+    '''
+
+    def __init__(self, config: RouterConfig, stats: Stats):
+        self.config = config
+        self.stats = stats
+        self.ring = HashRing(config.backends, config.replicas)
+        self.healthy = {backend: True for backend in config.backends}
+        self.session = None
+        stats.set('router.healthy', len(self.healthy))
+
+    def start(self) -> None:
+        '''
+        Opens the connection pool
+        '''
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=0, limit_per_host=self.config.pool_size),
+            timeout=aiohttp.ClientTimeout(total=self.config.timeout),
+            auto_decompress=False)
+
+    async def close(self) -> None:
+        '''
+        Closes the connection pool
+        '''
+        await self.session.close()
+
+    def mark(self, backend: str, healthy: bool) -> None:
+        '''
+        Records backend health
+        '''
+        if self.healthy[backend] != healthy:
+            self.stats.incr(
+                'router.recovered' if healthy else 'router.marked_down')
+        self.healthy[backend] = healthy
+        self.stats.set('router.healthy', sum(self.healthy.values()))
+
+    def candidates(self, key: str) -> list:
+        '''
+        :returns backends to try for key: the healthy ones in ring order,
+        then the others in case the health checks are behind
+        '''
+        ordered = list(self.ring.nodes_for(key))
+        return [backend for backend in ordered if self.healthy[backend]] + [
+            backend for backend in ordered if not self.healthy[backend]]
+
+    async def check(self, backend: str) -> None:
+        '''
+        Health check of backend: healthy once ready
+        '''
+        try:
+            async with self.session.get(
+                    backend + '/ready',
+                    timeout=aiohttp.ClientTimeout(total=self.config.timeout)
+            ) as resp:
+                await resp.read()
+                self.mark(backend, resp.status == 200)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.mark(backend, False)
+
+    async def check_forever(self, interval: float) -> None:
+        '''
+        Checks every backend every interval seconds until cancelled
+        '''
+        while True:
+            await asyncio.gather(*(
+                self.check(backend) for backend in self.config.backends))
+            await asyncio.sleep(interval)
+
+    async def forward(self, key: str, path: str, body: bytes, headers: dict):
+        '''
+        Posts body to the backends of key until one answers
+        :returns (status, headers, body) of the backend response
+        :raises HTTPBadGateway when no backend answered
+        '''
+        last = None
+        for attempt, backend in enumerate(self.candidates(key)):
+            if attempt:
+                self.stats.incr('router.failovers')
+            try:
+                async with self.session.post(
+                        backend + path, data=body, headers=headers) as resp:
+                    payload = await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                self.mark(backend, False)
+                last = '{}: {}'.format(backend, type(exc).__name__)
+                continue
+            if resp.status in FAILOVER_STATUSES:
+                last = '{}: {}'.format(backend, resp.status)
+                continue
+            self.stats.incr('router.backend.' + backend)
+            return resp.status, {
+                name: resp.headers[name]
+                for name in FORWARDED_RESPONSE_HEADERS + ('Content-Type',)
+                if name in resp.headers}, payload
+        raise web.HTTPBadGateway(
+            reason='No backend available (last: {})'.format(last))
+
+    async def broadcast(self, path: str, body: bytes, headers: dict) -> dict:
+        '''
+        Posts body to every backend, healthy or not
+        :returns {backend: {'status': <status>, 'body': <response text>}},
+        status None with the exception name as body when it did not answer
+        '''
+        async def post(backend):
+            try:
+                async with self.session.post(
+                        backend + path, data=body, headers=headers) as resp:
+                    return {'status': resp.status, 'body': await resp.text()}
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                self.mark(backend, False)
+                return {'status': None, 'body': type(exc).__name__}
+        backends = self.config.backends
+        self.stats.incr('router.broadcasts')
+        return dict(zip(backends, await asyncio.gather(*(
+            post(backend) for backend in backends))))
+
+
+BACKENDS = web.AppKey('backends', Backends)
+STATS = web.AppKey('stats', Stats)
+
+
+def payload_key(raw: bytes) -> str:
+    '''
+    :returns content hash of the catalog of the JSON payload raw (payloads
+    without catalog hash as a whole)
+    '''
+    try:
+        data = json.loads(raw.decode())
+    except ValueError:
+        data = None
+    if isinstance(data, dict) and any(key in data for key in CATALOG_KEYS):
+        return catalog_key(data)
+    return hashlib.sha256(raw).hexdigest()
+
+
+async def request_key(request, raw: bytes) -> str:
+    '''
+    :returns X-Catalog-Key header, or the payload_key of raw computed in a
+    worker thread: decoding a large payload would block the event loop
+    '''
+    key = request.headers.get(CATALOG_HEADER)
+    if key:
+        return key
+    return await asyncio.get_running_loop().run_in_executor(
+        None, payload_key, raw)
+
+
+async def route_handler(request):
+    '''
+    Forwards POST /api/... to the backends of the request catalog. JSON
+    payloads (multipart data field or JSON body) are forwarded as JSON
+    bodies, other bodies as they are.
+    '''
+    request.app[STATS].incr('router.requests')
+    if request.content_type in ('multipart/form-data', 'application/json'):
+        raw = await pricing_app.read_payload(request)
+        content_type = 'application/json'
+    else:
+        raw = await request.read()
+        content_type = request.content_type
+    headers = {name: request.headers[name]
+               for name in FORWARDED_REQUEST_HEADERS if name in request.headers}
+    headers['Content-Type'] = content_type
+    path = request.path_qs
+    if request.path.startswith(ADMIN_PREFIX):
+        return await broadcast(request, path, raw, headers)
+    status, headers, body = await request.app[BACKENDS].forward(
+        await request_key(request, raw), path, raw, headers)
+    return web.Response(status=status, body=body, headers=headers)
+
+
+async def broadcast(request, path: str, raw: bytes, headers: dict):
+    '''
+    Sends an admin request to every backend
+    :returns {'backends': {backend: {'status': ..., 'body': ...}}}, with
+    status 200 when every backend answered 200, 502 otherwise
+    '''
+    results = await request.app[BACKENDS].broadcast(path, raw, headers)
+    return web.json_response({'backends': results}, status=200 if all(
+        result['status'] == 200 for result in results.values()) else 502)
+
+
+async def stats_handler(request):
+    '''
+    Router statistics and backend health
+    '''
+    return web.json_response(dict(
+        request.app[STATS].as_dict(),
+        backends=request.app[BACKENDS].healthy))
+
+
+def backends_context(config: RouterConfig):
+    '''
+    :returns cleanup context opening the pool and running health checks
+    '''
+    async def context(app):
+        backends = app[BACKENDS]
+        backends.start()
+        task = None
+        if config.health_interval is not None:
+            task = asyncio.create_task(
+                backends.check_forever(config.health_interval))
+        yield
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        await backends.close()
+    return context
+
+
+def make_router(config: RouterConfig = None, **options) -> web.Application:
+    '''
+    aiohttp Application maker of the router
+    '''
+    config = (config or RouterConfig())._replace(**options)
+    app = web.Application(client_max_size=pricing_app.Limits().max_body_size)
+    app[STATS] = Stats()
+    app[BACKENDS] = Backends(config, app[STATS])
+    app.cleanup_ctx.append(backends_context(config))
+    app.router.add_get('/api/stats', stats_handler)
+    app.router.add_post('/api/{tail:.*}', route_handler)
+    return app
+
+
+def run_router(host='127.0.0.1', port=8080, config: RouterConfig = None):
+    '''
+    Runs the router
+    '''
+    web.run_app(make_router(config), host=host, port=port)
@@ -0,0 +1,74 @@
+'''
+Slow-request log: one JSON line per request slower than a threshold, plus an
+optional sample of the other requests. Lines go to a pluggable sink, any
+callable taking the entry dict.
+'''
+import json
+import logging
+import random
+import time
+
+LOGGER = logging.getLogger('zenmarket.slowlog')
+
+
+def logging_sink(entry: dict) -> None:
+    '''
+    Default sink, logs entries on the zenmarket.slowlog logger
+    '''
+    LOGGER.warning(json.dumps(entry, sort_keys=True))
+
+
+class StreamSink:
+    '''
+    Sink writing JSON lines to a text stream
+    '''
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __call__(self, entry: dict) -> None:
+        self.stream.write(json.dumps(entry, sort_keys=True) + '\n')
+        self.stream.flush()
+
+
+class SlowLog:
+    '''
+    Decides which requests are logged and builds their entries
+
+    :param threshold: seconds, requests at least that slow are logged
+    :param sample_rate: probability to log any other request
+    :param sink: callable(entry)
+    '''
+
+    def __init__(self, threshold: float, sample_rate: float = 0,
+                 sink=logging_sink):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.sink = sink
+
+    def record(self, request, trace, status: int) -> None:
+        '''
+        Sends the entry of a finished request to the sink when it is slow or
+        sampled
+        '''
+        elapsed = trace.elapsed
+        if elapsed >= self.threshold:
+            reason = 'slow'
+        elif self.sample_rate and random.random() < self.sample_rate:
+            reason = 'sampled'
+        else:
+            return
+        parts = request.path.strip('/').split('/')
+        self.sink({
+            'time': time.time(),
+            'reason': reason,
+            'path': request.path,
+            'level': parts[1] if len(parts) > 1 else None,
+            'status': status,
+            'body_size': request.content_length,
+            'duration_ms': elapsed * 1000,
+            'shape': trace.shape,
+            'stages_ms': {
+                name: duration * 1000
+                for name, duration in trace.stages.items()},
+        })
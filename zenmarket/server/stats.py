@@ -0,0 +1,57 @@
+'''
+In-process server statistics exposed on /api/stats
+'''
+from collections import Counter
+
+
+class Stats:
+    '''
+    Counters and observed values
+
+    >>> stats = Stats()
+    >>> stats.incr('requests')
+    >>> stats.observe('batch.window_ms', 1.5)
+    >>> stats.as_dict()['counters']
+    {'requests': 1}
+    '''
+
+    def __init__(self):
+        self.counters = Counter()
+        self.gauges = {}
+        self.observations = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        '''
+        Increments counter name
+        '''
+        self.counters[name] += value
+
+    def set(self, name: str, value) -> None:
+        '''
+        Sets gauge name to value
+        '''
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        '''
+        Records a sample of name (count, total, max and last value are kept)
+        '''
+        summary = self.observations.setdefault(
+            name, {'count': 0, 'total': 0, 'max': value, 'last': value})
+        summary['count'] += 1
+        summary['total'] += value
+        summary['max'] = max(summary['max'], value)
+        summary['last'] = value
+
+    def as_dict(self) -> dict:
+        '''
+        :returns JSON serializable statistics
+        '''
+        return {
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'observations': {
+                name: dict(summary, mean=summary['total'] / summary['count'])
+                for name, summary in self.observations.items()
+            },
+        }
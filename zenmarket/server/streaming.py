@@ -0,0 +1,329 @@
+'''
+Streaming request path: pricing inputs are parsed while their body is still
+being received. Members of the top-level JSON object are decoded as soon as
+they are complete and each element of its carts array as soon as its
+closing brace arrives, so that validating and pricing carts overlaps the
+upload instead of following it.
+
+Carts are priced once the catalog members they need (articles, delivery
+fees, discounts of the level) have all been received, which is as they come
+when the catalog is sent before the carts; carts received earlier are
+validated right away and priced at the end.
+
+Streamed pricing only produces successful responses. Whenever it can't
+(invalid JSON or data, missing member, undefined article, negative total,
+...) it gives up and the body is priced again the usual way, which raises
+the usual error.
+
+>>> streamed = StreamingPricer(level=3)
+>>> async for chunk in request.content.iter_any():
+...     streamed.feed(chunk)
+>>> streamed.finish()
+{'carts': [...]}
+'''
+import codecs
+import json
+import re
+
+import colander
+
+from zenmarket import model
+from zenmarket.algo import engines
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+
+# pylint: disable=too-few-public-methods
+
+DECODER = json.JSONDecoder()
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# a number ending the buffer may go on in the next chunk
+NUMBER_CHARS = '0123456789.eE+-'
+
+
+class StreamError(Exception):
+    '''
+    Exception raised when a stream is not a JSON object the streaming path
+    can handle, the body is priced the usual way
+    '''
+    pass
+
+
+class ObjectStream:
+    '''
+    Incremental parser of a JSON object: feed() returns the ('member', key,
+    value) of each complete member, except the array member array_key whose
+    elements are returned as ('element', key, element) as they complete,
+    followed by ('end', key, None).
+
+    Values are parsed by the json module decoder. A value it can't parse
+    yet is retried once the data after it has at least doubled, so that
+    the parsing time stays linear in the size of the stream. Invalid data
+    is only reported by close().
+
+    :raises StreamError on structural errors and duplicate keys
+    '''
+
+    def __init__(self, array_key: str = 'carts'):
+        self.array_key = array_key
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.retry_at = 0  # buffer size worth a new parsing attempt
+        self.final = False
+        self.state = 'start'
+        self.key = None
+        self.keys = set()
+
+    def feed(self, chunk: bytes) -> list:
+        '''
+        :returns events completed by chunk
+        '''
+        try:
+            self.buffer += self.decoder.decode(chunk)
+        except UnicodeDecodeError as exc:
+            raise StreamError(str(exc))
+        events = []
+        if len(self.buffer) >= self.retry_at:
+            position = self._parse(events)
+            self.buffer = self.buffer[position:]
+            self.retry_at = max(0, self.retry_at - position)
+        return events
+
+    def close(self) -> list:
+        '''
+        :returns events completed by the end of the stream
+        :raises StreamError unless the object is complete
+        '''
+        try:
+            self.buffer += self.decoder.decode(b'', final=True)
+        except UnicodeDecodeError as exc:
+            raise StreamError(str(exc))
+        self.retry_at, self.final = 0, True
+        events = []
+        self._parse(events)
+        if self.state != 'done':
+            raise StreamError('Incomplete or invalid object')
+        return events
+
+    def _value(self, position: int):
+        '''
+        :returns (value, end) of the JSON value at position, None when it
+        could not be parsed (yet)
+        '''
+        buffer = self.buffer
+        try:
+            value, end = DECODER.raw_decode(buffer, position)
+        except ValueError:
+            value = end = None
+        if end is None or (
+                not self.final and isinstance(value, (int, float)) and
+                not buffer[end:].strip(NUMBER_CHARS)):
+            self.retry_at = position + 2 * (len(buffer) - position) + 1
+            return None
+        self.retry_at = 0
+        return value, end
+
+    def _parse(self, events: list) -> int:  # pylint: disable=R0912
+        '''
+        Advances the state machine over the buffer
+        :returns position of the first unconsumed character
+        '''
+        buffer, position = self.buffer, 0
+        while True:
+            position = WHITESPACE.match(buffer, position).end()
+            if position >= len(buffer):
+                return position
+            char = buffer[position]
+            state = self.state
+            if state == 'start':
+                if char != '{':
+                    raise StreamError('Not a JSON object')
+                self.state, position = 'first_key', position + 1
+            elif state in ('key', 'first_key'):
+                if char == '}' and state == 'first_key':
+                    self.state, position = 'done', position + 1
+                    continue
+                if char != '"':
+                    raise StreamError('Expected a key')
+                parsed = self._value(position)
+                if parsed is None:
+                    return position
+                self.key, position = parsed
+                if self.key in self.keys:
+                    raise StreamError('Duplicate key {!r}'.format(self.key))
+                self.keys.add(self.key)
+                self.state = 'colon'
+            elif state == 'colon':
+                if char != ':':
+                    raise StreamError('Expected a colon')
+                self.state = 'array' if self.key == self.array_key \
+                    else 'value'
+                position += 1
+            elif state == 'array' and char == '[':
+                self.state, position = 'first_element', position + 1
+            elif state == 'first_element' and char == ']':
+                events.append(('end', self.key, None))
+                self.state, position = 'comma', position + 1
+            elif state in ('value', 'array', 'element', 'first_element'):
+                # array_key holding anything but an array: plain member
+                parsed = self._value(position)
+                if parsed is None:
+                    return position
+                value, position = parsed
+                if state in ('value', 'array'):
+                    events.append(('member', self.key, value))
+                    self.state = 'comma'
+                else:
+                    events.append(('element', self.key, value))
+                    self.state = 'element_comma'
+            elif state == 'element_comma':
+                if char == ',':
+                    self.state = 'element'
+                elif char == ']':
+                    events.append(('end', self.key, None))
+                    self.state = 'comma'
+                else:
+                    raise StreamError('Expected , or ]')
+                position += 1
+            elif state == 'comma':
+                if char == ',':
+                    self.state = 'key'
+                elif char == '}':
+                    self.state = 'done'
+                else:
+                    raise StreamError('Expected , or }')
+                position += 1
+            else:
+                raise StreamError('Trailing data')
+
+
+class StreamingPricer:
+    '''
+    Validates and prices the carts of a pricing input as it streams in
+
+    :param level: level of the input, its catalog is read from the stream
+    :param compiled: catalog to price carts against (/api/catalog/price),
+        catalog members of the stream are then ignored
+    :param limits: Limits, streaming stops beyond max_carts / max_items so
+        that admission control rejects the request as usual
+    '''
+
+    def __init__(self, level: int = None, compiled: CompiledCatalog = None,
+                 limits=None):
+        if compiled is None:
+            self.schema = engines.ValidatingEngine.validators[level]
+            self.required_keys = engines.LEVEL_KEYS[level]
+        else:
+            self.schema = model.CartsDesc()
+            self.required_keys = ('carts',)
+        self.catalog_keys = [
+            key for key in self.required_keys if key != 'carts']
+        self.cart_schema = self.schema['carts'].children[0]
+        self.compiled = compiled
+        self.limits = limits
+        self.stream = ObjectStream()
+        self.members = {}
+        self.carts = []
+        self.pending = []  # validated carts waiting for the catalog
+        self.cart_ids = []
+        self.subtotals = []
+        self.items = 0
+        self.failed = None
+        self.response = None
+
+    def feed(self, chunk: bytes) -> None:
+        '''
+        Processes the carts completed by chunk
+        '''
+        if self.failed is not None:
+            return
+        try:
+            self._process(self.stream.feed(chunk))
+            self._price_pending()
+        except Exception as exc:  # pylint: disable=broad-except
+            self.fail(exc)
+
+    def _process(self, events: list) -> None:
+        for event, key, value in events:
+            if event == 'element':
+                self._add_cart(value)
+            elif event == 'end':
+                self.members[key] = self.carts
+            elif key == 'carts':
+                raise StreamError('carts is not an array')
+            else:
+                self.members[key] = value
+
+    def fail(self, exc: Exception) -> None:
+        '''
+        Gives up streaming, the body will be priced the usual way
+        '''
+        self.failed = '{}: {}'.format(type(exc).__name__, exc)
+        self.pending = self.carts = self.members = None
+
+    def _add_cart(self, cart) -> None:
+        self.carts.append(cart)
+        try:
+            valid = self.cart_schema.deserialize(cart)
+        except colander.Invalid as exc:
+            raise StreamError(exc.msg)
+        self.items += len(valid['items'])
+        limits = self.limits
+        if limits is not None and (
+                (limits.max_carts is not None and
+                 len(self.carts) > limits.max_carts) or
+                (limits.max_items is not None and
+                 self.items > limits.max_items)):
+            raise StreamError('Over admission limits')
+        self.pending.append(valid)
+
+    def _catalog(self) -> CompiledCatalog:
+        '''
+        :returns compiled catalog once every catalog member of the level
+        was received, None before
+        '''
+        if self.compiled is None and all(
+                key in self.members for key in self.catalog_keys):
+            try:
+                catalog = {key: self.schema[key].deserialize(self.members[key])
+                           for key in self.catalog_keys}
+            except colander.Invalid as exc:
+                raise StreamError(exc.msg)
+            self.compiled = CompiledCatalog.from_data(catalog)
+        return self.compiled
+
+    def _price_pending(self) -> None:
+        if not self.pending or self._catalog() is None:
+            return
+        batch = CartBatch.from_valid_list(self.pending)
+        self.subtotals.extend(self.compiled.subtotals(batch))
+        self.cart_ids.extend(batch.ids)
+        self.pending = []
+
+    def finish(self) -> dict:
+        '''
+        :returns response of the streamed input, None when streaming gave
+        up
+        '''
+        if self.failed is not None:
+            return None
+        try:
+            self._process(self.stream.close())
+            # level processors read these members without defaults
+            missing = [key for key in self.required_keys
+                       if key not in self.members]
+            if missing:
+                raise StreamError('Missing {}'.format(', '.join(missing)))
+            self._catalog()
+            self._price_pending()
+            self.response = self.compiled.response(
+                self.cart_ids,
+                self.compiled.with_fees(self.cart_ids, self.subtotals))
+        except Exception as exc:  # pylint: disable=broad-except
+            self.fail(exc)
+            return None
+        return self.response
+
+    def payload(self) -> dict:
+        '''
+        :returns decoded input of a successful stream
+        '''
+        return self.members
@@ -0,0 +1,119 @@
+'''
+Per-request trace: time spent in each pricing stage, payload shape and
+flags such as cache hits.
+
+The current trace lives in a context variable so that pricing adapters can
+record stages and flags without being handed the request:
+
+>>> with stage('validate'):
+...     validator.deserialize(data)
+>>> flag('cache', 'hit')
+'''
+import contextlib
+import contextvars
+import time
+
+from zenmarket.algo.catalog import CartBatch
+
+STAGES = ('read', 'decode', 'validate', 'build', 'price', 'serialize')
+
+CURRENT = contextvars.ContextVar('zenmarket_trace', default=None)
+
+
+class RequestTrace:
+    '''
+    Stage durations (seconds) and facts about one request
+    '''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.shape = {}
+        self.flags = {}
+
+    @property
+    def elapsed(self) -> float:
+        '''
+        :returns seconds since the trace started
+        '''
+        return time.perf_counter() - self.started
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        '''
+        Adds the time spent in the block to stage name
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + (
+                time.perf_counter() - start)
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    '''
+    Times the block in the current trace, if any
+    '''
+    trace = CURRENT.get()
+    if trace is None:
+        yield
+    else:
+        with trace.stage(name):
+            yield
+
+
+def flag(name: str, value: str) -> None:
+    '''
+    Sets flag name of the current trace, if any
+    '''
+    trace = CURRENT.get()
+    if trace is not None:
+        trace.flags[name] = value
+
+
+def server_timing(trace: RequestTrace) -> str:
+    '''
+    :returns Server-Timing header value of trace: stage durations in
+    milliseconds, in STAGES order, the total and the flags
+
+    >>> server_timing(trace)
+    'read;dur=0.210, decode;dur=0.051, total;dur=1.320, cache;desc=miss'
+    '''
+    names = [name for name in STAGES if name in trace.stages] + sorted(
+        name for name in trace.stages if name not in STAGES)
+    metrics = ['{};dur={:.3f}'.format(name, trace.stages[name] * 1000)
+               for name in names]
+    metrics.append('total;dur={:.3f}'.format(trace.elapsed * 1000))
+    metrics.extend('{};desc={}'.format(name, value)
+                   for name, value in sorted(trace.flags.items()))
+    return ', '.join(metrics)
+
+
+def payload_shape(payload) -> dict:
+    '''
+    :returns counts of articles, carts, items, fee tiers and discounts of a
+    decoded payload, without validating it
+    '''
+    if isinstance(payload, CartBatch):
+        return {'carts': payload.cart_count,
+                'items': len(payload.article_ids)}
+    if not isinstance(payload, dict):
+        return {}
+
+    def count(key):
+        value = payload.get(key)
+        return len(value) if isinstance(value, list) else 0
+
+    carts = payload.get('carts')
+    items = sum(
+        len(cart.get('items') or ()) for cart in carts
+        if isinstance(cart, dict)) if isinstance(carts, list) else 0
+    return {
+        'articles': count('articles'),
+        'carts': count('carts'),
+        'items': items,
+        'fee_tiers': count('delivery_fees'),
+        'discounts': count('discounts'),
+    }
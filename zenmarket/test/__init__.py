@@ -0,0 +1,3 @@
+'''
+zenmarket tests
+'''
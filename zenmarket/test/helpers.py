@@ -0,0 +1,23 @@
+'''
+Helpers shared by the tests: sample inputs and outputs of each level
+'''
+import json
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LEVEL_DIR = os.path.join(HERE, '..', '..', 'level{}')
+
+
+def level_path(level: int, name: str = 'data') -> str:
+    '''
+    :returns level<level>/<name>.json path
+    '''
+    return os.path.join(LEVEL_DIR.format(level), name + '.json')
+
+
+def load_level(level: int, name: str = 'data') -> dict:
+    '''
+    :returns level<level>/<name>.json content
+    '''
+    with open(level_path(level, name)) as fp:
+        return json.load(fp)
@@ -0,0 +1,109 @@
+'''
+Aggregate analytics tests
+'''
+import copy
+
+import colander
+import pytest
+
+from zenmarket.algo import analytics, level1, level2, level3
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+from zenmarket.test.helpers import load_level
+
+
+@pytest.mark.parametrize('level', [1, 2, 3])
+def test_revenue_matches_pricing(level):
+    '''
+    Revenue is the sum of the priced totals, fee revenue the sum of fees
+    '''
+    data = load_level(level, 'data')
+    report = analytics.analyze(data)
+    totals = [cart['total'] for cart in load_level(level, 'output')['carts']]
+    assert report['carts'] == len(totals)
+    assert report['revenue'] == sum(totals)
+    assert report['revenue'] == report['merchandise'] + report['fee_revenue']
+    assert sum(tier['carts'] for tier in report['fee_tiers']) == (
+        len(totals) if level > 1 else 0)
+
+
+def test_level3_aggregates():
+    '''
+    Units and discount costs per article, carts per fee tier
+    '''
+    data = load_level(3, 'data')
+    report = analytics.analyze(data)
+    prices = {article['id']: article['price'] for article in data['articles']}
+    units = {}
+    for cart in data['carts']:
+        for item in cart['items']:
+            units[item['article_id']] = units.get(
+                item['article_id'], 0) + item['quantity']
+    assert {art['id']: art['units'] for art in report['articles']} == units
+    discounted = {
+        art_id: level3.L3CartProcessor.Discount(
+            *{disc['article_id']: (disc['type'], disc['value'])
+              for disc in data['discounts']}.get(art_id, (None, 0)))(aprice)
+        for art_id, aprice in prices.items()}
+    assert report['discount_cost'] == sum(
+        count * (prices[art_id] - discounted[art_id])
+        for art_id, count in units.items())
+    assert [(tier['max_price'], tier['carts'], tier['revenue'])
+            for tier in report['fee_tiers']] == [
+                (1000, 2, 1600), (2000, 3, 1200), (None, 0, 0)]
+
+
+def test_chunks():
+    '''
+    Adding carts chunk by chunk gives the same report
+    '''
+    data = load_level(3, 'data')
+    analyzer = analytics.Analyzer(CompiledCatalog.from_data(data))
+    for cart in data['carts']:
+        analyzer.add(CartBatch.from_list([cart]))
+    assert analyzer.report() == analytics.analyze(data)
+
+
+def test_errors_match_pricing():
+    '''
+    Undefined articles, negative totals and totals beyond the fee tiers
+    raise as level3.price does
+    '''
+    data = load_level(3, 'data')
+    data['carts'][-1]['items'].append({'article_id': 999, 'quantity': 1})
+    with pytest.raises(level1.UndefinedArticleReference):
+        analytics.analyze(data)
+    data = load_level(3, 'data')
+    data['discounts'].append(
+        {'article_id': 1, 'type': 'amount', 'value': 10000})
+    with pytest.raises(colander.Invalid):
+        analytics.analyze(data)
+    data = load_level(3, 'data')
+    data['delivery_fees'].pop()
+    data['delivery_fees'][-1]['eligible_transaction_volume'][
+        'max_price'] = 1500
+    with pytest.raises(level2.InterpolationError):
+        level3.price(copy.deepcopy(data))
+    with pytest.raises(level2.InterpolationError):
+        analytics.analyze(data)
+
+
+def test_failed_batch_and_huge_units():
+    '''
+    A batch with an undefined article leaves the aggregates as they were,
+    units sold beyond the int64 range are counted
+    '''
+    data = load_level(3, 'data')
+    analyzer = analytics.Analyzer(CompiledCatalog.from_data(data))
+    analyzer.add(CartBatch.from_list(data['carts']))
+    before = analyzer.report()
+    with pytest.raises(level1.UndefinedArticleReference):
+        analyzer.add(CartBatch.from_list(data['carts'] + [
+            {'id': 9, 'items': [{'article_id': 999, 'quantity': 1}]}]))
+    assert analyzer.report() == before
+
+    huge = {'id': 1, 'items': [{'article_id': 1, 'quantity': 2 ** 62}]}
+    for _ in range(4):
+        analyzer.add(CartBatch.from_list([huge]))
+    units = {art['id']: art['units'] for art in analyzer.report()['articles']}
+    assert units[1] == 2 ** 64 + {
+        art['id']: art['units'] for art in before['articles']}[1]
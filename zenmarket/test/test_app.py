@@ -0,0 +1,695 @@
+'''
+Web application tests
+'''
+import asyncio
+import copy
+import gzip
+import json
+import os
+import zlib
+
+import aiohttp
+from aiohttp.test_utils import TestClient, TestServer
+import pytest
+
+from zenmarket import app, wire
+from zenmarket.algo import level3, scenarios
+from zenmarket.algo.catalog import CompiledCatalog
+from zenmarket.test.helpers import load_level
+
+
+def form(data):
+    '''
+    :returns multipart form as sent by curl -F data=@data.json
+    '''
+    payload = aiohttp.FormData()
+    payload.add_field('data', json.dumps(data).encode(),
+                      filename='data.json', content_type='application/json')
+    return payload
+
+
+def run(application, scenario):
+    '''
+    Runs coroutine scenario(client) against application
+    '''
+    async def runner():
+        async with TestClient(TestServer(application)) as client:
+            return await scenario(client)
+    return asyncio.run(runner())
+
+
+@pytest.mark.parametrize('level', [1, 2, 3])
+def test_level_routes(level):
+    '''
+    /api/levelN/price returns levelN/output.json
+    '''
+    async def scenario(client):
+        resp = await client.post(
+            '/api/level{}/price'.format(level), data=form(load_level(
+                level, 'data')))
+        assert resp.status == 200
+        assert await resp.json() == load_level(level, 'output')
+    run(app.make_app(), scenario)
+
+
+def test_catalog_route(tmpdir):
+    '''
+    /api/catalog/price prices carts against the mmap-ed catalog
+    '''
+    data = load_level(3, 'data')
+    path = str(tmpdir.join('catalog.zmc'))
+    CompiledCatalog.write(data, path)
+
+    async def scenario(client):
+        resp = await client.post(
+            '/api/catalog/price', data=form({'carts': data['carts']}))
+        assert resp.status == 200
+        assert await resp.json() == load_level(3, 'output')
+    run(app.make_app(catalog=path), scenario)
+
+
+def test_nudge_routes(tmpdir):
+    '''
+    /api/nudge and /api/catalog/nudge suggest articles lowering delivery fees
+    '''
+    data = load_level(3, 'data')
+    path = str(tmpdir.join('catalog.zmc'))
+    CompiledCatalog.write(data, path)
+
+    async def scenario(client):
+        resp = await client.post('/api/nudge?limit=1', data=form(data))
+        assert resp.status == 200
+        body = await resp.json()
+        assert body['carts'][0]['suggestions'] == [
+            {'article_id': 1, 'price': 100, 'delivery_fee': 0, 'total': 2050}]
+        resp = await client.post(
+            '/api/catalog/nudge?limit=1', data=form({'carts': data['carts']}))
+        assert resp.status == 200
+        assert await resp.json() == body
+        resp = await client.post('/api/nudge?limit=x', data=form(data))
+        assert resp.status == 400
+    run(app.make_app(catalog=path), scenario)
+
+
+def test_scenarios_route():
+    '''
+    /api/scenarios returns the scenario matrix and summaries
+    '''
+    data = load_level(3, 'data')
+    data['scenarios'] = [{'name': 'no discounts', 'discounts': []}]
+
+    async def scenario(client):
+        resp = await client.post('/api/scenarios', data=form(data))
+        assert resp.status == 200
+        assert await resp.json() == scenarios.evaluate(copy.deepcopy(data))
+        resp = await client.post(
+            '/api/scenarios?summary_only=1', data=form(data))
+        assert 'carts' not in await resp.json()
+        resp = await client.post('/api/scenarios', data=form(
+            dict(data, scenarios=[{'name': 'empty', 'articles': []}])))
+        assert resp.status == 400
+        assert "ScenarioError: Scenario 'empty'" in resp.reason
+    run(app.make_app(), scenario)
+
+
+def test_catalog_reload_route(tmpdir):
+    '''
+    /api/admin/catalog/reload swaps the catalog of /api/catalog/price
+    '''
+    data = load_level(3, 'data')
+    path = str(tmpdir.join('catalog.zmc'))
+    CompiledCatalog.write(data, path)
+
+    async def scenario(client):
+        carts = form({'carts': data['carts']})
+        resp = await client.post('/api/catalog/price', data=carts)
+        assert await resp.json() == load_level(3, 'output')
+        changed = copy.deepcopy(data)
+        changed['delivery_fees'][0]['price'] = 0
+        CompiledCatalog.write(changed, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        resp = await client.post('/api/admin/catalog/reload')
+        assert resp.status == 200
+        assert (await resp.json())['version'] == 2
+        resp = await client.post(
+            '/api/catalog/price', data=form({'carts': data['carts']}))
+        assert await resp.json() == level3.price(changed)
+        with open(path + '.tmp', 'wb') as fp:
+            fp.write(b'garbage')
+        os.replace(path + '.tmp', path)
+        resp = await client.post('/api/admin/catalog/reload')
+        assert resp.status == 500
+        resp = await client.get('/api/stats')
+        stats = await resp.json()
+        assert stats['gauges']['catalog.version'] == 2
+        assert stats['counters']['catalog.reload_errors'] == 1
+    run(app.make_app(catalog=path), scenario)
+
+
+def test_warmup_and_ready(tmpdir):
+    '''
+    /ready answers 503 until the warm-up ran, which leaves the cache and the
+    counters untouched
+    '''
+    data = load_level(3, 'data')
+    path = str(tmpdir.join('catalog.zmc'))
+    CompiledCatalog.write(data, path)
+
+    async def scenario(client):
+        ready = client.server.app[app.READY]
+        await asyncio.wait_for(ready.wait(), 10)
+        resp = await client.get('/ready')
+        assert resp.status == 200
+        body = await resp.json()
+        assert body['ready'] and body['warmup_ms'] > 0
+        stats = await (await client.get('/api/stats')).json()
+        assert stats['counters'] == {}
+        assert stats['gauges']['warmup.ms'] == body['warmup_ms']
+        ready.clear()
+        resp = await client.get('/ready')
+        assert resp.status == 503
+        assert await resp.json() == {'ready': False}
+    run(app.make_app(catalog=path, warmup_rounds=2), scenario)
+
+    async def no_warmup(client):
+        resp = await client.get('/ready')
+        assert resp.status == 200
+    run(app.make_app(), no_warmup)
+
+
+def test_compression():
+    '''
+    gzip/deflate request bodies are accepted, responses over
+    compress_min_size are compressed when the client accepts it
+    '''
+    data = load_level(3, 'data')
+    data['carts'] = data['carts'] * 50
+    expected = level3.price(copy.deepcopy(data))
+    raw = json.dumps(data).encode()
+
+    async def scenario(client):
+        for encoding, body in (('gzip', gzip.compress(raw)),
+                               ('deflate', zlib.compress(raw))):
+            resp = await client.post(
+                '/api/level3/price', data=body,
+                headers={'Content-Type': 'application/json',
+                         'Content-Encoding': encoding,
+                         'Accept-Encoding': encoding})
+            assert resp.status == 200
+            assert resp.headers['Content-Encoding'] == encoding
+            assert resp.headers['ETag'].endswith('-{}"'.format(encoding))
+            assert await resp.json() == expected
+        resp = await client.post(
+            '/api/level3/price', data=raw,
+            headers={'Content-Type': 'application/json',
+                     'Accept-Encoding': 'identity'})
+        assert 'Content-Encoding' not in resp.headers
+        assert await resp.json() == expected
+        resp = await client.post(
+            '/api/level3/price', data=form(load_level(3, 'data')),
+            headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in resp.headers  # below threshold
+        resp = await client.post(
+            '/api/level3/price', data=raw,
+            headers={'Content-Type': 'application/json',
+                     'Content-Encoding': 'compress'})
+        assert resp.status == 415
+        resp = await client.get('/api/stats')
+        counters = (await resp.json())['counters']
+        assert counters['compression.requests'] == 2
+        assert counters['compression.responses'] == 2
+    run(app.make_app(compress_min_size=1024), scenario)
+
+
+def chunked(raw: bytes):
+    '''
+    :returns raw as a chunked body
+    '''
+    async def chunks():
+        for position in range(0, len(raw), 7):
+            await asyncio.sleep(0)
+            yield raw[position:position + 7]
+    return chunks()
+
+
+def test_streaming(tmpdir):
+    '''
+    Payloads priced while they are received get the responses and errors
+    of the other ones, JSON bodies (chunked or not) and multipart forms
+    '''
+    data = load_level(3, 'data')
+    catalog = str(tmpdir.join('catalog.zmc'))
+    CompiledCatalog.write(data, catalog)
+    invalid = [
+        b'', b'[]', b'{"carts": [}', json.dumps(dict(data, carts=None)),
+        json.dumps({key: value for key, value in data.items()
+                    if key != 'articles'}),
+        json.dumps(dict(data, delivery_fees=data['delivery_fees'][:1])),
+        json.dumps(dict(data, carts=data['carts'] + [
+            {'id': 9, 'items': [{'article_id': 404, 'quantity': 1}]}])),
+    ]
+
+    async def scenario(client):
+        json_headers = {'Content-Type': 'application/json',
+                        'X-Server-Timing': '1'}
+        raw = json.dumps(data).encode()
+        results = []
+        for path in ('/api/level3/price', '/api/level1/price',
+                     '/api/catalog/price'):
+            for body in (raw, chunked(raw), form(data)):
+                resp = await client.post(
+                    path, data=body, headers=None if isinstance(
+                        body, aiohttp.FormData) else json_headers)
+                results.append((resp.status, await resp.json()))
+        for body in invalid:
+            body = body.encode() if isinstance(body, str) else body
+            resp = await client.post(
+                '/api/level3/price', data=chunked(body), headers=json_headers)
+            results.append((resp.status, resp.reason))
+        counters = (await (await client.get('/api/stats')).json())['counters']
+        return results, {name: value for name, value in counters.items()
+                         if name.startswith('streaming.')}
+
+    streamed, counters = run(
+        app.make_app(catalog=catalog, stream_min_size=0, engine='compiled'),
+        scenario)
+    assert counters == {'streaming.requests': 9,
+                        'streaming.fallbacks': len(invalid)}
+    assert run(app.make_app(catalog=catalog, stream_min_size=None,
+                            engine='compiled'), scenario) == (streamed, {})
+    assert [status for status, _ in streamed] == [200] * 9 + [400] * len(
+        invalid)
+
+    async def too_large(client):
+        resp = await client.post(
+            '/api/level3/price', data=chunked(json.dumps(data).encode()),
+            headers={'Content-Type': 'application/json'})
+        return resp.status
+    assert run(app.make_app(limits=app.Limits(max_body_size=100),
+                            stream_min_size=0), too_large) == 413
+
+
+def test_streaming_engines():
+    '''
+    Only engines whose results match the streaming path are streamed
+    '''
+    data = load_level(3, 'data')
+    # an article key the reference engine rejects, the others ignore
+    raw = json.dumps(dict(data, articles=[
+        dict(article, color='red') for article in data['articles']])).encode()
+
+    async def scenario(client):
+        results = []
+        for query in ('?engine=reference', '?engine=compiled'):
+            resp = await client.post(
+                '/api/level3/price' + query, data=chunked(raw),
+                headers={'Content-Type': 'application/json'})
+            results.append(resp.status)
+        counters = (await (await client.get('/api/stats')).json())['counters']
+        results.append({name: value for name, value in counters.items()
+                        if name.startswith('streaming.')})
+        return results
+
+    assert run(app.make_app(stream_min_size=0, engine='compiled'),
+               scenario) == [400, 200, {'streaming.requests': 1}]
+
+
+def test_server_timing():
+    '''
+    X-Server-Timing: 1 adds stage durations and cache flags
+    '''
+    data = load_level(3, 'data')
+
+    def metrics(resp):
+        return dict(
+            metric.split(';', 1)
+            for metric in resp.headers['Server-Timing'].split(', '))
+
+    async def scenario(client):
+        resp = await client.post('/api/level3/price', data=form(data))
+        assert 'Server-Timing' not in resp.headers
+        headers = {'X-Server-Timing': '1'}
+        resp = await client.post(
+            '/api/level3/price', data=form(data), headers=headers)
+        first = metrics(resp)
+        assert first['cache'] == 'desc=hit'
+        for name in ('read', 'total'):
+            assert first[name].startswith('dur=')
+        resp = await client.post(
+            '/api/level3/price', data=form(dict(data, carts=[])),
+            headers=headers)
+        second = metrics(resp)
+        assert second['cache'] == 'desc=miss'
+        assert list(second)[:6] == [
+            'read', 'decode', 'validate', 'build', 'price', 'serialize']
+        resp = await client.post(
+            '/api/level3/price', data=form({'articles': 1}), headers=headers)
+        assert resp.status == 400
+        assert 'decode' in metrics(resp)
+    run(app.make_app(cache_size=8), scenario)
+
+
+def test_catalog_binary_route(tmpdir):
+    '''
+    Binary carts in, binary totals out
+    '''
+    data = load_level(3, 'data')
+    path = str(tmpdir.join('catalog.zmc'))
+    CompiledCatalog.write(data, path)
+
+    async def scenario(client):
+        resp = await client.post(
+            '/api/catalog/price', data=wire.encode_carts(data['carts']),
+            headers={'Content-Type': wire.CARTS_CONTENT_TYPE,
+                     'Accept': wire.TOTALS_CONTENT_TYPE})
+        assert resp.status == 200
+        assert resp.content_type == wire.TOTALS_CONTENT_TYPE
+        assert wire.decode_totals(await resp.read()) == load_level(
+            3, 'output')
+
+        resp = await client.post(
+            '/api/catalog/price', data=b'garbage',
+            headers={'Content-Type': wire.CARTS_CONTENT_TYPE})
+        assert resp.status == 400
+
+        huge = {'carts': [{'id': 1, 'items': [
+            {'article_id': 1, 'quantity': 2 ** 62}]}]}
+        resp = await client.post(
+            '/api/catalog/price', data=form(huge),
+            headers={'Accept': wire.TOTALS_CONTENT_TYPE})
+        assert resp.status == 400
+        assert 'BadDataFormat' in resp.reason
+    run(app.make_app(catalog=path), scenario)
+
+
+def test_micro_batching():
+    '''
+    Concurrent level3 requests are priced in one batch, each getting its
+    own carts back, while a wrong request only fails itself
+    '''
+    data = load_level(3, 'data')
+    expected = load_level(3, 'output')['carts']
+    wrong = dict(data, carts=[
+        {'id': 9, 'items': [{'article_id': 99, 'quantity': 1}]}])
+    payloads = [dict(data, carts=[cart]) for cart in data['carts']] + [wrong]
+
+    async def scenario(client):
+        responses = await asyncio.gather(*(
+            client.post('/api/level3/price', data=form(payload))
+            for payload in payloads))
+        assert [resp.status for resp in responses] == [200] * 5 + [400]
+        for cart, resp in zip(expected, responses):
+            assert await resp.json() == {'carts': [cart]}
+        stats = await (await client.get('/api/stats')).json()
+        assert stats['counters']['batch.flushes'] >= 1
+        assert stats['observations']['batch.requests']['max'] > 1
+        assert 'batch.window_ms' in stats['observations']
+    run(app.make_app(batch_delay=0.05), scenario)
+
+
+def test_response_cache():
+    '''
+    Identical payloads are served from cache with an ETag, If-None-Match
+    gives 304
+    '''
+    data = load_level(3, 'data')
+
+    async def scenario(client):
+        first = await client.post('/api/level3/price', data=form(data))
+        second = await client.post('/api/level3/price', data=form(data))
+        assert first.status == second.status == 200
+        assert await first.read() == await second.read()
+        etag = first.headers['ETag']
+        assert second.headers['ETag'] == etag
+
+        resp = await client.post(
+            '/api/level3/price', data=form(data),
+            headers={'If-None-Match': etag})
+        assert resp.status == 304
+        resp = await client.post(
+            '/api/level2/price', data=form(load_level(2, 'data')),
+            headers={'If-None-Match': etag})
+        assert resp.status == 200
+
+        counters = (await (await client.get('/api/stats')).json())['counters']
+        assert counters['cache.hits'] == 1
+        assert counters['cache.not_modified'] == 1
+    run(app.make_app(cache_size=16), scenario)
+
+
+def test_admission_control():
+    '''
+    Requests over limits are rejected with 413/503 and counted
+    '''
+    data = load_level(3, 'data')
+    limits = app.Limits(
+        max_body_size=4096, max_carts=3, max_items=100, max_in_flight=1,
+        retry_after=2)
+    small = dict(data, carts=data['carts'][:1])
+
+    async def scenario(client):
+        resp = await client.post(
+            '/api/level3/price', data=form(dict(data, padding='x' * 5000)))
+        assert resp.status == 413
+        resp = await client.post('/api/level3/price', data=form(data))
+        assert resp.status == 413
+
+        responses = await asyncio.gather(
+            client.post('/api/level3/price', data=form(small)),
+            client.post('/api/level3/price', data=form(
+                dict(small, carts=data['carts'][1:2]))))
+        assert sorted(resp.status for resp in responses) == [200, 503]
+        rejected = [resp for resp in responses if resp.status == 503][0]
+        assert rejected.headers['Retry-After'] == '2'
+
+        counters = (await (await client.get('/api/stats')).json())['counters']
+        assert counters['limits.body_size'] == 1
+        assert counters['limits.carts'] == 1
+        assert counters['limits.in_flight'] == 1
+    run(app.make_app(limits=limits, batch_delay=0.05), scenario)
+
+
+def test_admission_responses(tmpdir):
+    '''
+    Rejections tell the limit in their body, busy servers reject requests
+    before reading them
+    '''
+    data = load_level(3, 'data')
+    catalog = str(tmpdir.join('catalog.zmc'))
+    CompiledCatalog.write(data, catalog)
+    raw = json.dumps(data).encode()
+    headers = {'Content-Type': 'application/json'}
+    uploading, resume = asyncio.Event(), asyncio.Event()
+
+    async def slow_upload():
+        yield raw[:10]
+        uploading.set()
+        await resume.wait()
+        yield raw[10:]
+
+    async def never_sent():
+        yield wire.encode_carts(data['carts'])[:10]
+        await asyncio.Event().wait()
+
+    async def scenario(client):
+        resp = await client.post(
+            '/api/level3/price', data=form(dict(data, padding='x' * 5000)))
+        assert resp.status == 413
+        assert await resp.text() == 'Request body larger than 4096 bytes'
+        resp = await client.post('/api/level3/price', data=form(data))
+        assert resp.status == 413
+        assert await resp.text() == 'More than 3 carts'
+
+        # streamed requests hold their slot while they are received
+        upload = asyncio.ensure_future(client.post(
+            '/api/level3/price', data=slow_upload(), headers=headers))
+        await uploading.wait()
+        resp = await asyncio.wait_for(client.post(
+            '/api/catalog/price', data=never_sent(),
+            headers={'Content-Type': wire.CARTS_CONTENT_TYPE}), 5)
+        assert resp.status == 503
+        resume.set()
+        assert (await upload).status == 413
+    run(app.make_app(
+        catalog=catalog, stream_min_size=0, engine='compiled',
+        limits=app.Limits(max_body_size=4096, max_carts=3, max_in_flight=1)),
+        scenario)
+
+
+def test_slow_log():
+    '''
+    Slow requests are sent to the sink with their shape and stages
+    '''
+    entries = []
+    data = load_level(3, 'data')
+
+    async def scenario(client):
+        resp = await client.post('/api/level3/price', data=form(data))
+        assert resp.status == 200
+        resp = await client.post('/api/level1/price', data=form(
+            {'articles': [], 'carts': [{'id': 1}]}))
+        assert resp.status == 400
+    run(app.make_app(slow_log_threshold=0, slow_log_sink=entries.append),
+        scenario)
+
+    assert [entry['status'] for entry in entries] == [200, 400]
+    entry = entries[0]
+    assert entry['level'] == 'level3'
+    assert entry['reason'] == 'slow'
+    assert entry['shape'] == {
+        'articles': 8, 'carts': 5, 'items': 9, 'fee_tiers': 3,
+        'discounts': 5}
+    assert set(entry['stages_ms']) == {
+        'read', 'decode', 'validate', 'build', 'price', 'serialize'}
+    assert entry['body_size'] > 0
+
+
+def test_streaming_cache_and_admission():
+    '''
+    Requests whose response may be cached are not streamed, streamed ones
+    hold a pricing slot while they are received
+    '''
+    data = load_level(3, 'data')
+    raw = json.dumps(data).encode()
+    headers = {'Content-Type': 'application/json'}
+    uploading = asyncio.Event()
+    resume = asyncio.Event()
+
+    async def slow_upload():
+        yield raw[:10]
+        uploading.set()
+        await resume.wait()
+        yield raw[10:]
+
+    async def streamed_counters(client):
+        counters = (await (await client.get('/api/stats')).json())['counters']
+        return {name: value for name, value in counters.items()
+                if name.startswith(('streaming.', 'cache.', 'limits.'))}
+
+    async def admission(client):
+        upload = asyncio.ensure_future(client.post(
+            '/api/level3/price', data=slow_upload(), headers=headers))
+        await uploading.wait()
+        resp = await client.post(
+            '/api/level3/price', data=raw, headers=headers)
+        assert resp.status == 503
+        resume.set()
+        resp = await upload
+        assert resp.status == 200
+        etag = resp.headers['ETag']
+        resp = await client.post('/api/level3/price', data=raw, headers=dict(
+            headers, **{'If-None-Match': etag}))
+        assert resp.status == 304
+        return await streamed_counters(client)
+
+    assert run(app.make_app(
+        stream_min_size=0, engine='compiled',
+        limits=app.Limits(max_in_flight=1)), admission) == {
+            'streaming.requests': 1, 'limits.in_flight': 1,
+            'cache.misses': 1, 'cache.not_modified': 1}
+
+    async def cached(client):
+        for _ in range(2):
+            resp = await client.post(
+                '/api/level3/price', data=raw, headers=headers)
+            assert resp.status == 200
+        return await streamed_counters(client)
+
+    assert run(app.make_app(stream_min_size=0, engine='compiled',
+                            cache_size=16), cached) == {
+        'cache.misses': 1, 'cache.hits': 1}
+
+
+def test_micro_batching_engines():
+    '''
+    Requests picking an engine, or served with another default engine, are
+    not micro-batched and are cached under the pricing path that ran
+    '''
+    data = load_level(3, 'data')
+    expected = load_level(3, 'output')
+
+    async def scenario(client):
+        etags = []
+        for query in ('', '?engine=reference', '?engine=fused'):
+            resp = await client.post(
+                '/api/level3/price' + query, data=form(data))
+            assert resp.status == 200
+            assert await resp.json() == expected
+            etags.append(resp.headers['ETag'])
+        stats = await (await client.get('/api/stats')).json()
+        return len(set(etags)), stats['counters'].get('batch.flushes')
+
+    assert run(app.make_app(batch_delay=0.01), scenario) == (3, 1)
+    # the default engine is fused there
+    assert run(app.make_app(batch_delay=0.01, engine='fused'),
+               scenario) == (2, None)
+
+
+def test_parallel_pricing():
+    '''
+    Requests over parallel_min_carts are priced by worker processes, in
+    cart order, with the same totals and errors as level3.price
+    '''
+    data = load_level(3, 'data')
+    data['carts'] = [
+        dict(cart, id=100 * round_ + cart['id'])
+        for round_ in range(20) for cart in data['carts']]
+    expected = level3.price(copy.deepcopy(data))
+    wrong = dict(data, carts=data['carts'] + [
+        {'id': 1, 'items': [{'article_id': 99, 'quantity': 1}]}])
+
+    async def scenario(client):
+        resp = await client.post('/api/level3/price', data=form(data))
+        assert resp.status == 200
+        assert await resp.json() == expected
+        resp = await client.post('/api/level3/price', data=form(wrong))
+        assert resp.status == 400
+        assert 'UndefinedArticleReference' in resp.reason
+        stats = await (await client.get('/api/stats')).json()
+        assert stats['counters']['parallel.requests'] == 1
+    run(app.make_app(parallel_workers=2, parallel_min_carts=50), scenario)
+
+
+def test_parallel_catalog_changes():
+    '''
+    Concurrent parallel requests with different catalogs keep their shared
+    catalog until their slices are priced
+    '''
+    inputs = []
+    for price in (1, 2, 3):
+        data = load_level(3, 'data')
+        data['articles'] = [dict(article, price=article['price'] * price)
+                            for article in data['articles']]
+        data['carts'] = [
+            dict(cart, id=100 * round_ + cart['id'])
+            for round_ in range(20) for cart in data['carts']]
+        inputs.append(data)
+    expected = [level3.price(copy.deepcopy(data)) for data in inputs]
+
+    async def scenario(client):
+        for _ in range(3):
+            responses = await asyncio.gather(*(
+                client.post('/api/level3/price', data=form(data))
+                for data in inputs))
+            assert [resp.status for resp in responses] == [200] * 3
+            assert [await resp.json() for resp in responses] == expected
+        pricer = client.app[app.PARALLEL]
+        assert list(pricer.catalogs) == [pricer.current]
+    run(app.make_app(parallel_workers=2, parallel_min_carts=50), scenario)
+
+
+def test_engine_selection():
+    '''
+    ?engine=NAME selects an engine, unknown engines get 400
+    '''
+    async def scenario(client):
+        for level in (1, 2, 3):
+            resp = await client.post(
+                '/api/level{}/price?engine=compiled'.format(level),
+                data=form(load_level(level, 'data')))
+            assert resp.status == 200
+            assert await resp.json() == load_level(level, 'output')
+        resp = await client.post(
+            '/api/level1/price?engine=nope', data=form(load_level(1, 'data')))
+        assert resp.status == 400
+    run(app.make_app(engine='fused'), scenario)
@@ -0,0 +1,86 @@
+'''
+Multi-file batch pricing tests
+'''
+import copy
+import gzip
+import json
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from zenmarket import batch, cli, encode_json
+from zenmarket.algo import level3
+from zenmarket.test.helpers import load_level
+
+
+def make_inputs(indir):
+    '''
+    Writes level3 inputs with two catalogs, a gzip one and a bad one
+    :returns {name: expected output bytes or None}
+    '''
+    data = load_level(3, 'data')
+    other = copy.deepcopy(data)
+    other['discounts'] = []
+    inputs = {
+        'a.json': data, 'b.json': other, 'c.json': data,
+        'd.json.gz': other, 'e.json': dict(data, carts=data['carts'][:1])}
+    expected = {}
+    for name, payload in inputs.items():
+        raw = json.dumps(payload).encode()
+        if name.endswith('.gz'):
+            raw = gzip.compress(raw)
+        indir.join(name).write_binary(raw)
+        expected[name] = encode_json(level3.price(copy.deepcopy(payload)))
+    bad = copy.deepcopy(data)
+    bad['carts'][0]['items'][0]['article_id'] = 999
+    indir.join('f.json').write(json.dumps(bad))
+    indir.join('notes.txt').write('ignored')
+    expected['f.json'] = None
+    return expected
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_price_directory(tmpdir, jobs):
+    '''
+    Outputs are the ones of level3, catalogs are compiled once whatever
+    the number of workers, failed files get no output
+    '''
+    expected = make_inputs(tmpdir.mkdir('in'))
+    outdir = tmpdir.join('out')
+    results = []
+    summary = batch.price_directory(
+        str(tmpdir.join('in')), str(outdir), jobs, on_result=results.append)
+    assert sorted(os.listdir(str(outdir))) == sorted(
+        name for name, body in expected.items() if body is not None)
+    for name, body in expected.items():
+        if body is None:
+            continue
+        raw = outdir.join(name).read_binary()
+        assert (gzip.decompress(raw) if name.endswith('.gz') else raw) == body
+    errors = {result.name: result.error for result in results}
+    assert errors.pop('f.json').startswith(
+        'zenmarket.algo.level1.UndefinedArticleReference')
+    assert set(errors.values()) == {None}
+    assert summary.files == 6 and summary.failed == 1
+    assert summary.carts == 4 * 5 + 1
+    assert summary.catalogs == 2
+    assert summary.compiled == 2
+
+
+def test_batch_command(tmpdir):
+    '''
+    zm-cli batch level3 prints a summary and fails when a file failed
+    '''
+    make_inputs(tmpdir.mkdir('in'))
+    result = CliRunner().invoke(cli, [
+        'batch', 'level3', str(tmpdir.join('in')), str(tmpdir.join('out')),
+        '--jobs', '1'])
+    assert result.exit_code == 1
+    assert '6 files (1 failed), 21 carts' in result.output
+    tmpdir.join('in', 'f.json').remove()
+    result = CliRunner().invoke(cli, [
+        'batch', 'level3', str(tmpdir.join('in')), str(tmpdir.join('out')),
+        '--jobs', '1'])
+    assert result.exit_code == 0
+    assert '5 files (0 failed)' in result.output
@@ -0,0 +1,101 @@
+'''
+Response cache tests
+'''
+import asyncio
+
+import pytest
+
+from zenmarket.server.cache import CachedResponse, ResponseCache
+from zenmarket.server.stats import Stats
+
+
+def response(body):
+    '''
+    :returns dummy cached response
+    '''
+    return CachedResponse(body, 'application/json', '"etag"')
+
+
+def test_lru_eviction():
+    '''
+    Least recently used entries are evicted first
+    '''
+    cache = ResponseCache(max_size=2, ttl=60)
+    cache.put('a', response(b'a'))
+    cache.put('b', response(b'b'))
+    assert cache.get('a').body == b'a'
+    cache.put('c', response(b'c'))
+    assert cache.get('b') is None
+    assert cache.get('a').body == b'a'
+    assert cache.get('c').body == b'c'
+
+
+def test_ttl():
+    '''
+    Expired entries are dropped
+    '''
+    cache = ResponseCache(max_size=2, ttl=-1)
+    cache.put('a', response(b'a'))
+    assert cache.get('a') is None
+
+
+def test_single_flight():
+    '''
+    Concurrent identical computations run once, errors reach every caller
+    and are not cached
+    '''
+    stats = Stats()
+    cache = ResponseCache(max_size=0, ttl=60, stats=stats)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return response(b'x')
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError('boom')
+
+    async def scenario():
+        results = await asyncio.gather(
+            *(cache.get_or_compute('k', compute) for _ in range(5)))
+        assert [result.body for result in results] == [b'x'] * 5
+        errors = await asyncio.gather(
+            *(cache.get_or_compute('e', failing) for _ in range(3)),
+            return_exceptions=True)
+        assert all(isinstance(error, ValueError) for error in errors)
+        with pytest.raises(ValueError):
+            await cache.get_or_compute('e', failing)
+
+    asyncio.run(scenario())
+    assert len(calls) == 3
+    assert stats.counters['cache.collapsed'] == 6
+
+
+def test_single_flight_cancellation():
+    '''
+    Callers waiting for a computation get its result when the caller that
+    started it is cancelled
+    '''
+    cache = ResponseCache(max_size=1, ttl=60)
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        return response(b'x')
+
+    async def scenario():
+        leader = asyncio.ensure_future(cache.get_or_compute('k', compute))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(cache.get_or_compute('k', compute))
+                     for _ in range(2)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        assert [result.body for result in results] == [b'x'] * 2
+        assert leader.cancelled()
+        assert cache.get('k').body == b'x'
+        assert not cache.in_flight
+
+    asyncio.run(scenario())
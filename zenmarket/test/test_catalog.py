@@ -0,0 +1,111 @@
+'''
+Compiled catalog tests
+'''
+import copy
+
+import pytest
+
+from zenmarket.algo import catalog, level1, level2, level3
+from zenmarket.test.helpers import load_level
+
+
+@pytest.fixture(name='level_data', params=[1, 2, 3])
+def level_data_fixture(request):
+    '''
+    Sample data and expected output of each level
+    '''
+    return load_level(request.param, 'data'), load_level(
+        request.param, 'output')
+
+
+def test_price_matches_levels(level_data):
+    '''
+    Compiled catalog pricing gives the documented outputs
+    '''
+    data, expected = level_data
+    assert catalog.price(data) == expected
+
+
+def test_open_mmap(tmpdir, level_data):
+    '''
+    A catalog written to disk prices the same once mapped
+    '''
+    data, expected = level_data
+    path = str(tmpdir.join('catalog.zmc'))
+    catalog.CompiledCatalog.write(data, path)
+    with catalog.CompiledCatalog.open(path) as compiled:
+        assert compiled.price_data({'carts': data['carts']}) == expected
+        assert compiled.digest == catalog.CompiledCatalog.from_data(
+            data).digest
+
+
+def test_compiled_sections():
+    '''
+    Articles are sorted, prices discounted and +Inf stored as INT64_MAX
+    '''
+    data = load_level(3, 'data')
+    compiled = catalog.CompiledCatalog.from_data(data)
+    assert list(compiled.article_ids) == sorted(
+        art['id'] for art in data['articles'])
+    assert compiled.article_price(2) == 200 - 25
+    assert compiled.article_price(5) == 999 * (100 - 30) // 100
+    assert compiled.base_prices[compiled.article_index(5)] == 999
+    assert list(compiled.fee_x) == [1000, 2000, catalog.INT64_MAX]
+    assert list(compiled.fee_y) == [800, 400, 0]
+    assert compiled.fee(10 ** 30) == 0
+
+
+def test_undefined_article():
+    '''
+    Undefined articles raise the level1 exception
+    '''
+    data = load_level(3, 'data')
+    data['carts'] = [{'id': 1, 'items': [{'article_id': 99, 'quantity': 1}]}]
+    with pytest.raises(level1.UndefinedArticleReference):
+        catalog.price(data)
+
+
+def test_fee_overflow():
+    '''
+    Totals above the last finite tier raise InterpolationError as level2 does
+    '''
+    data = load_level(2, 'data')
+    data['delivery_fees'] = data['delivery_fees'][:1]
+    data['carts'] = [{'id': 1, 'items': [{'article_id': 4, 'quantity': 5}]}]
+    with pytest.raises(level2.InterpolationError):
+        level2.price(copy.deepcopy(data))
+    with pytest.raises(level2.InterpolationError):
+        catalog.price(data)
+
+
+@pytest.mark.parametrize('data', [
+    {'articles': [{'id': 1, 'price': 100}]},
+    {'articles': [], 'discounts': [
+        {'article_id': 1, 'type': 'percentage', 'value': 101}]},
+    {'articles': [], 'carts': [{'id': 1}]},
+])
+def test_bad_data(data):
+    '''
+    Invalid catalogs and carts raise BadDataFormat
+    '''
+    with pytest.raises(level1.BadDataFormat):
+        catalog.price(data)
+
+
+def test_bad_buffer():
+    '''
+    Random bytes are rejected
+    '''
+    with pytest.raises(catalog.BadCatalogFormat):
+        catalog.CompiledCatalog(b'not a catalog')
+    buffer = catalog.CompiledCatalog.compile(load_level(3, 'data'))
+    with pytest.raises(catalog.BadCatalogFormat):
+        catalog.CompiledCatalog(buffer[:-8])
+
+
+def test_level3_parity():
+    '''
+    Same totals as level3.price on the level3 sample
+    '''
+    data = load_level(3, 'data')
+    assert catalog.price(copy.deepcopy(data)) == level3.price(data)
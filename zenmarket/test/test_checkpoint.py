@@ -0,0 +1,100 @@
+'''
+Checkpointed batch pricing tests
+'''
+import copy
+import os
+
+import pytest
+
+from zenmarket import checkpoint, encode_json
+from zenmarket.algo import level3
+from zenmarket.algo.catalog import CompiledCatalog
+from zenmarket.test.helpers import load_level
+
+
+def big_input(count=23):
+    '''
+    :returns level3 input of count carts
+    '''
+    data = load_level(3, 'data')
+    data['carts'] = [
+        dict(cart, id=cart_id)
+        for cart_id, cart in enumerate(data['carts'] * count)]
+    return data
+
+
+@pytest.mark.parametrize('count', [0, 1, 23])
+def test_output_matches_level3(tmpdir, count):
+    '''
+    Chunked output is byte for byte the output of zm-cli level3
+    '''
+    data = big_input(count)
+    path = str(tmpdir.join('output.json'))
+    checkpoint.price_chunks(data, path, chunk_carts=7)
+    with open(path, 'rb') as fp:
+        assert fp.read() == encode_json(level3.price(copy.deepcopy(data)))
+    assert not os.path.exists(path + '.ckpt')
+
+
+def test_resume(tmpdir, monkeypatch):
+    '''
+    An interrupted run resumed from its checkpoint gives the same output
+    '''
+    data = big_input()
+    path = str(tmpdir.join('output.json'))
+    price = CompiledCatalog.price
+    calls = []
+
+    def interrupted(self, batch):
+        calls.append(batch.cart_count)
+        if len(calls) == 4:
+            raise KeyboardInterrupt
+        return price(self, batch)
+
+    monkeypatch.setattr(CompiledCatalog, 'price', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        checkpoint.price_chunks(data, path, chunk_carts=10)
+    saved = checkpoint.Checkpoint.load(path + '.ckpt')
+    assert saved.input_offset == 30
+    with open(path, 'ab') as fp:
+        fp.write(b'garbage of a chunk written after the checkpoint')
+
+    monkeypatch.setattr(CompiledCatalog, 'price', price)
+    checkpoint.price_chunks(data, path, chunk_carts=10, resume=True)
+    with open(path, 'rb') as fp:
+        assert fp.read() == encode_json(level3.price(copy.deepcopy(data)))
+
+
+def test_resume_checks_catalog(tmpdir):
+    '''
+    A checkpoint can't be resumed with another catalog
+    '''
+    data = big_input()
+    path = str(tmpdir.join('output.json'))
+    with open(path, 'wb') as fp:
+        fp.write(checkpoint.HEAD)
+    checkpoint.Checkpoint(
+        10, len(checkpoint.HEAD), 'other', 69, None).save(path + '.ckpt')
+    with pytest.raises(checkpoint.CheckpointError):
+        checkpoint.price_chunks(data, path, chunk_carts=10, resume=True)
+
+
+def test_resume_checks_input(tmpdir):
+    '''
+    A checkpoint can't be resumed with another input of as many carts
+    '''
+    data = big_input()
+    path = str(tmpdir.join('output.json'))
+    with open(path, 'wb') as fp:
+        fp.write(checkpoint.HEAD)
+    compiled = CompiledCatalog.from_data(data)
+    checkpoint.Checkpoint(
+        0, len(checkpoint.HEAD), compiled.digest, len(data['carts']),
+        'input1').save(path + '.ckpt')
+    with pytest.raises(checkpoint.CheckpointError):
+        checkpoint.price_chunks(data, path, chunk_carts=10, resume=True,
+                                input_digest='input2')
+    checkpoint.price_chunks(data, path, chunk_carts=10, resume=True,
+                            input_digest='input1')
+    with open(path, 'rb') as fp:
+        assert fp.read() == encode_json(level3.price(copy.deepcopy(data)))
@@ -0,0 +1,73 @@
+'''
+Command line tests
+'''
+import gzip
+import json
+import mmap
+
+from click.testing import CliRunner
+
+from zenmarket import cli, decode_json, read_input, wire
+from zenmarket.algo.catalog import CompiledCatalog
+from zenmarket.test.helpers import level_path, load_level
+
+
+def test_regular_files_are_mapped():
+    '''
+    Regular files are mapped, the map is closed afterwards
+    '''
+    with open(level_path(3, 'data'), 'rb') as fp:
+        with read_input(fp) as raw:
+            assert isinstance(raw, mmap.mmap)
+            assert decode_json(raw) == load_level(3, 'data')
+        assert raw.closed
+
+
+def test_level3_inputs(tmpdir):
+    '''
+    Files, stdin and gzip compressed files give the same output
+    '''
+    runner = CliRunner()
+    expected = load_level(3, 'output')
+    result = runner.invoke(cli, ['level3', level_path(3, 'data'), '-'])
+    assert result.exit_code == 0
+    assert json.loads(result.stdout) == expected
+    with open(level_path(3, 'data'), 'rb') as fp:
+        raw = fp.read()
+    result = runner.invoke(cli, ['level3', '-', '-'], input=raw)
+    assert json.loads(result.stdout) == expected
+    path = str(tmpdir.join('data.json.gz'))
+    with open(path, 'wb') as fp:
+        fp.write(gzip.compress(raw))
+    output = str(tmpdir.join('output.json.gz'))
+    result = runner.invoke(cli, ['level3', path, output])
+    assert result.exit_code == 0
+    with open(output, 'rb') as fp:
+        assert json.loads(gzip.decompress(fp.read())) == expected
+
+
+def test_empty_input(tmpdir):
+    '''
+    Empty files can't be mapped, they fail as before
+    '''
+    path = str(tmpdir.join('empty.json'))
+    open(path, 'w').close()
+    result = CliRunner().invoke(cli, ['level1', path, '-'])
+    assert result.exit_code == 1
+
+
+def test_bad_binary_input(tmpdir):
+    '''
+    Errors decoding a mapped file are the ones of the decoder
+    '''
+    data = load_level(3, 'data')
+    catalog = str(tmpdir.join('catalog.zmc'))
+    CompiledCatalog.write(data, catalog)
+    path = str(tmpdir.join('carts.zmb'))
+    with open(path, 'wb') as fp:
+        fp.write(wire.encode_carts(data['carts'])[:-4])
+    result = CliRunner().invoke(cli, [
+        'level3', '--catalog', catalog, '--input-format', 'binary', path,
+        '-'])
+    assert result.exit_code == 1
+    assert 'BadDataFormat: truncated cart' in result.stderr
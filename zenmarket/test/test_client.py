@@ -0,0 +1,147 @@
+'''
+Async client tests
+'''
+import asyncio
+import copy
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import pytest
+
+from zenmarket import app
+from zenmarket.algo import level3
+from zenmarket.algo.catalog import CompiledCatalog
+from zenmarket.client import Client, PricingFailed, benchmark
+from zenmarket.test.helpers import load_level
+
+
+def run(application, scenario):
+    '''
+    Runs coroutine scenario(base_url) against application
+    '''
+    async def runner():
+        async with TestServer(application) as server:
+            return await scenario(str(server.make_url('')))
+    return asyncio.run(runner())
+
+
+def single_carts(data):
+    '''
+    :returns one input per cart of data
+    '''
+    return [dict(data, carts=[cart]) for cart in data['carts']]
+
+
+def test_coalescing():
+    '''
+    Concurrent calls sharing a catalog are sent as one request, each gets
+    its own response
+    '''
+    data = load_level(3)
+    inputs = single_carts(data) * 10
+    expected = [level3.price(copy.deepcopy(payload)) for payload in inputs]
+
+    async def scenario(base_url):
+        async with Client(base_url) as client:
+            responses = await asyncio.gather(*(
+                client.price(3, payload) for payload in inputs))
+            assert responses == expected
+            assert client.stats.counters['client.requests'] == 1
+            assert client.stats.counters['client.coalesced'] == len(inputs)
+        async with Client(base_url, batch_delay=None) as client:
+            responses = await asyncio.gather(*(
+                client.price(3, payload) for payload in inputs))
+            assert responses == expected
+            assert client.stats.counters['client.requests'] == len(inputs)
+        async with Client(base_url, batch_carts=5) as client:
+            await asyncio.gather(*(
+                client.price(3, payload) for payload in inputs))
+            assert client.stats.counters['client.requests'] == 10
+    run(app.make_app(), scenario)
+
+
+def test_split_on_error(tmpdir):
+    '''
+    A merged request rejected because of one call is sent call by call, the
+    faulty call gets the error it gets alone
+    '''
+    data = load_level(3)
+    inputs = single_carts(data)
+    inputs[2] = dict(data, carts=[{'id': 9, 'items': [
+        {'article_id': 404, 'quantity': 1}]}])
+    catalog = str(tmpdir.join('catalog.zmc'))
+    CompiledCatalog.write(data, catalog)
+
+    async def scenario(base_url):
+        async with Client(base_url, batch_delay=None) as client:
+            with pytest.raises(PricingFailed) as alone:
+                await client.price(3, inputs[2])
+        async with Client(base_url) as client:
+            responses = await asyncio.gather(*(
+                client.price(3, payload) for payload in inputs),
+                                             return_exceptions=True)
+            assert client.stats.counters['client.split'] == 1
+            assert client.stats.counters['client.retries'] == 0
+            responses.extend(await asyncio.gather(*(
+                client.price_catalog({'carts': payload['carts']})
+                for payload in inputs), return_exceptions=True))
+        return alone.value, responses
+
+    alone, responses = run(app.make_app(catalog=catalog), scenario)
+    assert alone.status == 400
+    for response in responses[2::len(inputs)]:
+        assert (response.status, response.reason) == (
+            alone.status, alone.reason)
+    valid = [level3.price(copy.deepcopy(payload))
+             for index, payload in enumerate(inputs) if index != 2]
+    assert [response for index, response in enumerate(responses)
+            if index % len(inputs) != 2] == valid * 2
+
+
+def test_retries():
+    '''
+    503 and connection errors are retried with backoff, 400 is not
+    '''
+    attempts = []
+
+    async def flaky(request):
+        attempts.append(request.path)
+        if request.path == '/api/level1/price':
+            return web.Response(status=400, reason='Bad input')
+        if len(attempts) < 3:
+            return web.Response(status=503, headers={'Retry-After': '0'})
+        return web.json_response({'carts': []})
+
+    application = web.Application()
+    application.router.add_post('/api/{tail:.*}', flaky)
+
+    async def scenario(base_url):
+        async with Client(base_url, backoff=0.001) as client:
+            assert await client.price(3, {'carts': []}) == {'carts': []}
+            assert client.stats.counters['client.retries'] == 2
+            with pytest.raises(PricingFailed):
+                await client.price(1, {'carts': []})
+            assert client.stats.counters['client.retries'] == 2
+        async with Client('http://127.0.0.1:9', retries=2,
+                          backoff=0.001) as client:
+            with pytest.raises(Exception):
+                await client.price(3, {'carts': []})
+            assert client.stats.counters['client.requests'] == 3
+    run(application, scenario)
+    assert len(attempts) == 4
+
+
+def test_benchmark():
+    '''
+    Benchmark modes price the same calls
+    '''
+    inputs = single_carts(load_level(3)) * 4
+
+    async def scenario(base_url):
+        return [await benchmark(base_url, 3, inputs, mode)
+                for mode in ('coalesced', 'pooled', 'naive')]
+
+    coalesced, pooled, naive = run(app.make_app(), scenario)
+    assert coalesced.requests == 1
+    assert pooled.requests == naive.requests == len(inputs)
+    assert 'calls/s' in coalesced.format()
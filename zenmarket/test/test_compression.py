@@ -0,0 +1,37 @@
+'''
+Compressed bodies tests
+'''
+import gzip
+import zlib
+
+import pytest
+
+from zenmarket.server.compression import (
+    accepted_encoding, compress, encoded_etag)
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip, deflate', 'gzip'),
+    ('deflate, gzip;q=0.5', 'deflate'),
+    ('gzip;q=0, deflate', 'deflate'),
+    ('*', 'gzip'),
+    ('identity', None),
+    ('', None),
+    (None, None),
+])
+def test_accepted_encoding(header, expected):
+    '''
+    Highest q-value wins, gzip first on ties, q=0 refuses
+    '''
+    assert accepted_encoding(header) == expected
+
+
+def test_compress():
+    '''
+    Compressed bodies round-trip, gzip ones are reproducible
+    '''
+    body = b'{"carts": []}' * 100
+    assert gzip.decompress(compress(body, 'gzip')) == body
+    assert compress(body, 'gzip') == compress(body, 'gzip')
+    assert zlib.decompress(compress(body, 'deflate')) == body
+    assert encoded_etag('"abc"', 'gzip') == '"abc-gzip"'
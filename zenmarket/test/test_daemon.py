@@ -0,0 +1,84 @@
+'''
+Unix socket daemon client tests
+'''
+import asyncio
+import copy
+import json
+
+import pytest
+from aiohttp import web
+from click.testing import CliRunner
+
+from zenmarket import app, cli, daemon, encode_json
+from zenmarket.algo import level3
+from zenmarket.test.helpers import load_level
+
+
+def run_daemon(path, scenario):
+    '''
+    Runs blocking scenario() while the application listens on Unix socket
+    path
+    '''
+    async def runner():
+        app_runner = web.AppRunner(app.make_app())
+        await app_runner.setup()
+        await web.UnixSite(app_runner, path).start()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, scenario)
+        finally:
+            await app_runner.cleanup()
+    return asyncio.run(runner())
+
+
+def test_daemon_pricing(tmpdir):
+    '''
+    Daemon responses encode to the bytes of local pricing, errors carry the
+    local error line
+    '''
+    path = str(tmpdir.join('zm.sock'))
+    data = load_level(3, 'data')
+    raw = json.dumps(data).encode()
+
+    def scenario():
+        response = daemon.price(path, 3, raw, engine='fused')
+        assert encode_json(response) == encode_json(
+            level3.price(copy.deepcopy(data)))
+        bad = copy.deepcopy(data)
+        bad['carts'][0]['items'][0]['article_id'] = 999
+        with pytest.raises(daemon.PricingFailed) as error:
+            daemon.price(path, 3, json.dumps(bad).encode())
+        assert str(error.value) == (
+            'zenmarket.algo.level1.UndefinedArticleReference: '
+            'Article(id=999) is not defined')
+    run_daemon(path, scenario)
+
+
+def test_daemon_unreachable(tmpdir):
+    '''
+    A missing socket is reported as DaemonError
+    '''
+    with pytest.raises(daemon.DaemonError):
+        daemon.price(str(tmpdir.join('missing.sock')), 1, b'{}')
+
+
+def test_cli_daemon_engine(tmpdir, monkeypatch):
+    '''
+    zm-cli levelN --daemon leaves the engine to the daemon unless --engine
+    is given
+    '''
+    engines = []
+
+    def price(path, level, raw, engine=None):
+        engines.append(engine)
+        return {'carts': []}
+    monkeypatch.setattr(daemon, 'price', price)
+    path = str(tmpdir.join('data.json'))
+    with open(path, 'w') as fp:
+        json.dump(load_level(1, 'data'), fp)
+    runner = CliRunner()
+    for options in ([], ['--engine', 'fused']):
+        result = runner.invoke(cli, ['level1', '--daemon', str(
+            tmpdir.join('zm.sock'))] + options + [path, '-'])
+        assert result.exit_code == 0
+    assert engines == [None, 'fused']
@@ -0,0 +1,104 @@
+'''
+Differential tests: every engine against the level processors
+'''
+import bisect
+import random
+
+import pytest
+
+from zenmarket.algo import differential, engines, level2
+
+
+class LeftBisectEngine(engines.FusedEngine):
+    '''
+    Broken engine: delivery fee of a total equal to a breakpoint taken from
+    the lower tier
+    '''
+    name = 'left-bisect'
+
+    class FeeFunction(level2.L2CartProcessor.DeliveryFeeFunction):
+        '''
+        bisect_left instead of bisect_right
+        '''
+
+        def __call__(self, aprice):
+            return self.y[min(bisect.bisect_left(self.x, aprice),
+                              len(self.y) - 1)]
+
+    def run(self, level, built):
+        prices, fee_data, carts = built
+        if fee_data is None:
+            return super().run(level, built)
+        fee_function = self.FeeFunction.from_list(fee_data)
+        totals = [
+            sum(prices[item['article_id']] * item['quantity']
+                for item in cart['items'])
+            for cart in carts]
+        return {'carts': [
+            {'id': cart['id'], 'total': total + fee_function(total)}
+            for cart, total in zip(carts, totals)]}
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_engines_match_reference(seed):
+    '''
+    Thousands of random payloads, no difference in outputs or exceptions
+    '''
+    report = differential.run(cases=1000, seed=seed)
+    assert report.cases == 1000
+    assert not report.mismatches, report.mismatches[:3]
+
+
+def test_generator_covers_corner_cases():
+    '''
+    Generated payloads reach every reference outcome
+    '''
+    rng = random.Random(0)
+    outcomes = set()
+    for case in range(1500):
+        level = case % 3 + 1
+        kind, value = differential.outcome(
+            lambda level, data: differential.LEVEL_PRICES[level](data),
+            level, differential.generate(rng, level))
+        outcomes.add(value.rsplit('.', 1)[-1] if kind == 'error' else kind)
+    assert outcomes == {
+        'ok', 'BadDataFormat', 'UndefinedArticleReference', 'Invalid',
+        'PriceRangeError', 'InterpolationError'}
+
+
+def test_perturbed_payloads_reach_divergences():
+    '''
+    Extra keys, numeric strings and integers out of the int64 range reach
+    the divergences documented by the engines, priced as documented
+    '''
+    rng = random.Random(0)
+    diverging = set()
+    for case in range(300):
+        level = case % 3 + 1
+        data = differential.perturb(rng, differential.generate(rng, level))
+        assert not differential.compare(level, data)
+        expected = differential.outcome(
+            lambda level, data: differential.LEVEL_PRICES[level](data),
+            level, data)
+        for name in ('compiled', 'fused'):
+            allowed = differential.documented(
+                engines.get(name), level, data, expected)
+            if allowed != [expected]:
+                diverging.add((name, allowed[0][0]))
+    assert diverging == {
+        ('compiled', 'ok'), ('compiled', 'error'), ('fused', 'ok'),
+        ('fused', 'error')}
+
+
+def test_harness_detects_divergence():
+    '''
+    A broken engine is reported
+    '''
+    engine = engines.register(LeftBisectEngine())
+    try:
+        report = differential.run(cases=300, seed=0, names=[engine.name])
+    finally:
+        del engines.ENGINES[engine.name]
+    assert report.mismatches
+    assert {mismatch.engine for mismatch in report.mismatches} == {
+        engine.name}
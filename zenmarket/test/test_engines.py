@@ -0,0 +1,98 @@
+'''
+Pricing engine registry tests
+'''
+import copy
+
+import pytest
+
+from zenmarket.algo import engines
+from zenmarket.test.helpers import load_level
+
+
+class Level3Only(engines.FusedEngine):
+    '''
+    Engine being rolled out on level3 only
+    '''
+    name = 'level3-only'
+    levels = (3,)
+
+
+@pytest.fixture(name='partial_engine')
+def partial_engine_fixture():
+    '''
+    Registers Level3Only for the duration of a test
+    '''
+    engine = engines.register(Level3Only())
+    yield engine
+    del engines.ENGINES[engine.name]
+
+
+@pytest.mark.parametrize('level', [1, 2, 3])
+@pytest.mark.parametrize('name', engines.names())
+def test_engines_outputs(name, level):
+    '''
+    Every engine gives the documented outputs
+    '''
+    data = load_level(level, 'data')
+    assert engines.price(level, data, name) == load_level(level, 'output')
+
+
+def test_stages():
+    '''
+    price runs validate, build and run
+    '''
+    engine = engines.get('fused')
+    data = load_level(3, 'data')
+    built = engine.build(3, engine.validate(3, copy.deepcopy(data)))
+    assert engine.run(3, built) == engine.price(3, data)
+
+
+def test_unknown_engine():
+    '''
+    Unknown engines raise UnknownEngine
+    '''
+    with pytest.raises(engines.UnknownEngine):
+        engines.get('nope')
+
+
+def test_levels(partial_engine):
+    '''
+    Engines refuse unsupported levels, resolve falls back to the reference
+    engine
+    '''
+    assert engines.get(partial_engine.name, 3) is partial_engine
+    with pytest.raises(engines.UnknownEngine):
+        engines.get(partial_engine.name, 1)
+    assert engines.resolve(partial_engine.name, 3) is partial_engine
+    assert engines.resolve(partial_engine.name, 1).name == 'reference'
+
+
+def outcome(name: str, level: int, data: dict):
+    '''
+    :returns response of engine name, or the type of the exception it raised
+    '''
+    try:
+        return engines.price(level, copy.deepcopy(data), name)
+    except Exception as exc:  # pylint: disable=broad-except
+        return type(exc)
+
+
+def test_documented_divergences():
+    '''
+    Engines only differ from the reference engine on the inputs of the
+    registry docstring
+    '''
+    data = load_level(3, 'data')
+    article, others = data['articles'][0], data['articles'][1:]
+    for level3_only in (
+            dict(data, articles=[dict(article, color='red')] + others),
+            dict(data, articles=[
+                dict(article, price=str(article['price']))] + others),
+            {key: value for key, value in data.items() if key != 'carts'}):
+        assert outcome('reference', 3, level3_only) in (KeyError, TypeError)
+        assert isinstance(outcome('compiled', 3, level3_only), dict)
+        assert outcome('fused', 3, level3_only) == outcome(
+            'compiled', 3, level3_only)
+    huge = dict(data, articles=[dict(article, price=2 ** 70)] + others)
+    assert outcome('fused', 3, huge) == outcome('reference', 3, huge)
+    assert outcome('compiled', 3, huge) is engines.level1.BadDataFormat
@@ -0,0 +1,114 @@
+'''
+Compiled delivery-fee function tests
+'''
+import random
+
+import pytest
+
+from zenmarket.algo import level2
+from zenmarket.algo.fees import (
+    DENSE_LIMIT, FeeCoverageError, FeeTable, FeeTables, UnknownFeeTable)
+
+
+def tiers(*bounds):
+    '''
+    :returns delivery_fees with (min_price, max_price, price) bounds
+    '''
+    return [{'eligible_transaction_volume': {
+        'min_price': min_price, 'max_price': max_price}, 'price': price}
+            for min_price, max_price, price in bounds]
+
+
+def random_tiers(rand, scale):
+    '''
+    :returns random delivery_fees, possibly overlapping, with gaps or
+    bounded, with breakpoints up to scale
+    '''
+    cuts = sorted(rand.sample(range(1, scale), rand.randint(1, 6)))
+    bounds = [(low, high, rand.randint(0, 1000))
+              for low, high in zip([0] + cuts, cuts + [None])]
+    if rand.random() < 0.3:
+        bounds.pop()
+    if rand.random() < 0.3:
+        low, high, price = bounds[0]
+        bounds.append((low, high, price + 1))
+    return tiers(*bounds)
+
+
+def reference_fees(fee_data, totals):
+    '''
+    :returns fees of L2CartProcessor.DeliveryFeeFunction, InterpolationError
+    for totals it can't interpolate
+    '''
+    function = level2.L2CartProcessor.DeliveryFeeFunction.from_list(fee_data)
+    fees = []
+    for total in totals:
+        try:
+            fees.append(function(total))
+        except level2.InterpolationError:
+            fees.append(level2.InterpolationError)
+    return fees
+
+
+@pytest.mark.parametrize('scale', [10, 5000, DENSE_LIMIT * 4])
+def test_fee_table_matches_reference(scale):
+    '''
+    Dense and sparse tables give the fees and errors of the reference
+    '''
+    rand = random.Random(scale)
+    dense = set()
+    for _ in range(200):
+        fee_data = random_tiers(rand, scale)
+        table = FeeTable.from_list(fee_data)
+        dense.add(table.buckets is not None)
+        totals = [rand.randrange(0, 2 * scale) for _ in range(50)] + [
+            0, scale, 2 ** 70] + table.max_prices[:-1]
+        expected = reference_fees(fee_data, totals)
+        assert [table.fee(total) if fee is not level2.InterpolationError
+                else fee for total, fee in zip(totals, expected)] == expected
+        if level2.InterpolationError in expected:
+            with pytest.raises(level2.InterpolationError):
+                table.fees(totals)
+        else:
+            assert table.fees(totals) == expected
+    assert dense == ({True} if scale < DENSE_LIMIT else {True, False})
+
+
+def test_fee_coverage():
+    '''
+    Strict tables reject overlaps, gaps and bounded tiers
+    '''
+    covered = tiers((1000, 2000, 400), (0, 1000, 800), (2000, None, 0))
+    assert FeeTable.from_list(covered, strict=True).fees(
+        [0, 999, 1000, 2500]) == [800, 800, 400, 0]
+    for fee_data, message in (
+            (tiers((0, 1000, 800), (900, None, 0)), 'Overlapping'),
+            (tiers((0, None, 800), (900, None, 0)), 'Overlapping'),
+            (tiers((0, None, 800), (0, 1000, 0)), 'Overlapping'),
+            (tiers((0, 1000, 800), (1000, None, 0), (1000, 2000, 400)),
+             'Overlapping'),
+            (tiers((0, 1000, 800), (1100, None, 0)), 'from 1000 to 1100'),
+            (tiers((10, None, 0)), 'from 0 to 10'),
+            (tiers((0, 1000, 800)), 'above 1000')):
+        FeeTable.from_list(fee_data)
+        with pytest.raises(FeeCoverageError) as error:
+            FeeTable.from_list(fee_data, strict=True)
+        assert message in str(error.value)
+    with pytest.raises(level2.PriceRangeError):
+        FeeTable.from_list(tiers((0, 0, 800)), strict=True)
+
+
+def test_fee_tables():
+    '''
+    Named tables evaluate each total with its own table
+    '''
+    zones = FeeTables.from_data({
+        'paris': tiers((0, 1000, 800), (1000, None, 400)),
+        'lyon': tiers((0, 1500, 600), (1500, None, 0)),
+    }, strict=True)
+    assert zones.names == ('lyon', 'paris')
+    assert zones.fees([1200, 1200, 2000, 0], ['paris', 'lyon', 'lyon',
+                                              'paris']) == [400, 600, 0, 800]
+    assert zones.table('lyon').fee(1499) == 600
+    with pytest.raises(UnknownFeeTable):
+        zones.fees([1200], ['nice'])
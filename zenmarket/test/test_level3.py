@@ -3,6 +3,7 @@ Level 3 pricing tests
 '''
 import pytest
 from zenmarket.algo import level3
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
 
 
 @pytest.fixture(scope='module', name='simple_cart', params=[
@@ -165,3 +166,30 @@ def test_price(sample_l3_data):
     cart = response['carts'][0]
     assert cart['id'] == input_cart['id']
     assert cart['total'] == total
+
+
+@pytest.mark.parametrize('discounts, price', [
+    ([('amount', 25), ('percentage', 30)], (999 - 25) * 70 // 100),
+    ([('percentage', 30), ('amount', 25)], 999 * 70 // 100 - 25),
+    ([('percentage', 33), ('percentage', 33)], 999 * 67 // 100 * 67 // 100),
+    ([('amount', 500), ('amount', 500), ('percentage', 50)], -1 * 50 // 100),
+])
+def test_stacked_discounts(discounts, price):
+    '''
+    Discounts of an article stack in input order, each one flooring the
+    price left by the previous ones; compiled catalogs give the same price
+    '''
+    data = {
+        "articles": [{"id": 5, "name": "ketchup", "price": 999}],
+        "carts": [{"id": 1, "items": [{"article_id": 5, "quantity": 3}]}],
+        "delivery_fees": [{"eligible_transaction_volume": {
+            "min_price": 0, "max_price": None}, "price": 0}],
+        "discounts": [
+            {"article_id": 5, "type": typ, "value": value}
+            for typ, value in discounts],
+    }
+    compiled = CompiledCatalog.from_data(data)
+    assert compiled.prices[0] == price
+    if price >= 0:
+        assert compiled.price(CartBatch.from_data(data)) == \
+            level3.price(data) == {'carts': [{'id': 1, 'total': 3 * price}]}
@@ -0,0 +1,114 @@
+'''
+Free-delivery nudge tests
+'''
+
+import colander
+import pytest
+
+from zenmarket.algo import level1, nudge
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+from zenmarket.test.helpers import load_level
+
+
+def fee_tiers(*tiers):
+    '''
+    :returns delivery_fees of (min_price, max_price, price) tiers
+    '''
+    return [
+        {'eligible_transaction_volume': {'min_price': low, 'max_price': high},
+         'price': fee}
+        for low, high, fee in tiers
+    ]
+
+
+def test_level3_sample():
+    '''
+    Totals are the level3 ones, suggestions cross the next breakpoint
+    '''
+    data = load_level(3, 'data')
+    response = nudge.nudges(data, limit=2)
+    expected = load_level(3, 'output')['carts']
+    assert [{'id': cart['id'], 'total': cart['total']}
+            for cart in response['carts']] == expected
+    first = response['carts'][0]
+    assert first['delivery_fee'] == 400
+    assert first['missing'] == 50
+    assert first['suggestions'] == [
+        {'article_id': 1, 'price': 100, 'delivery_fee': 0, 'total': 2050},
+        {'article_id': 8, 'price': 132, 'delivery_fee': 0, 'total': 2082},
+    ]
+
+
+def test_matches_scan():
+    '''
+    Suggestions are the cheapest articles lowering the fee, as found by
+    scanning the catalog
+    '''
+    data = {
+        'articles': [{'id': art_id, 'name': 'a', 'price': art_id * 37 % 500}
+                     for art_id in range(1, 60)],
+        'carts': [{'id': cart_id, 'items': [
+            {'article_id': cart_id, 'quantity': cart_id % 7}]}
+            for cart_id in range(1, 60)],
+        'delivery_fees': fee_tiers(
+            (0, 500, 800), (500, 1000, 800), (1000, 1500, 300),
+            (1500, None, 0)),
+        'discounts': [{'article_id': 3, 'type': 'percentage', 'value': 50}],
+    }
+    compiled = CompiledCatalog.from_data(data)
+    response = nudge.Nudger(compiled).nudges(CartBatch.from_data(data), 4)
+    for cart in response['carts']:
+        subtotal = cart['total'] - cart['delivery_fee']
+        options = sorted(
+            (aprice, art_id)
+            for art_id, aprice in zip(compiled.article_ids, compiled.prices)
+            if compiled.fee(subtotal + aprice) < cart['delivery_fee'])
+        assert [(item['price'], item['article_id'])
+                for item in cart['suggestions']] == options[:4]
+        if cart['suggestions']:
+            assert cart['missing'] <= cart['suggestions'][0]['price']
+
+
+def test_no_cheaper_tier():
+    '''
+    Carts already in the cheapest tier, or without fees, get no suggestion
+    '''
+    data = {
+        'articles': [{'id': 1, 'name': 'a', 'price': 100}],
+        'carts': [{'id': 1, 'items': [{'article_id': 1, 'quantity': 30}]}],
+        'delivery_fees': fee_tiers((0, 1000, 500), (1000, None, 0)),
+    }
+    assert nudge.nudges(data)['carts'][0]['suggestions'] == []
+    del data['delivery_fees']
+    assert nudge.nudges(data)['carts'] == [{
+        'id': 1, 'total': 3000, 'delivery_fee': 0, 'missing': 0,
+        'suggestions': []}]
+
+
+def test_last_tier_bound():
+    '''
+    Articles pushing the total past the last finite tier are not suggested
+    '''
+    data = {
+        'articles': [{'id': 1, 'name': 'a', 'price': 600},
+                     {'id': 2, 'name': 'b', 'price': 1200}],
+        'carts': [{'id': 1, 'items': []}],
+        'delivery_fees': fee_tiers((0, 500, 500), (500, 1000, 0)),
+    }
+    suggestions = nudge.nudges(data)['carts'][0]['suggestions']
+    assert [item['article_id'] for item in suggestions] == [1]
+
+
+def test_errors_match_pricing():
+    '''
+    Undefined articles and negative totals raise as pricing does
+    '''
+    data = load_level(3, 'data')
+    data['carts'][0]['items'][0]['article_id'] = 999
+    with pytest.raises(level1.UndefinedArticleReference):
+        nudge.nudges(data)
+    data = load_level(3, 'data')
+    data['discounts'].append(
+        {'article_id': 1, 'type': 'amount', 'value': 10000})
+    with pytest.raises(colander.Invalid):
+        nudge.nudges(data)
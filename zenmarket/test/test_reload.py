@@ -0,0 +1,96 @@
+'''
+Hot catalog reload tests
+'''
+import asyncio
+import json
+import os
+
+import pytest
+
+from zenmarket.algo.catalog import CartBatch, CompiledCatalog
+from zenmarket.server.reload import CatalogStore, ReloadError
+from zenmarket.server.stats import Stats
+from zenmarket.test.helpers import load_level
+
+
+def replace(data, path):
+    '''
+    Compiles data to path atomically, as a deployment would
+    '''
+    CompiledCatalog.write(data, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def test_reload_swaps_version(tmpdir):
+    '''
+    A reload bumps the version, requests started before keep the old one
+    '''
+    data = load_level(3, 'data')
+    path = str(tmpdir.join('catalog.zmc'))
+    replace(data, path)
+    stats = Stats()
+    store = CatalogStore(path, stats)
+    batch = CartBatch.from_data(data)
+    expected = load_level(3, 'output')
+
+    async def scenario():
+        with store.acquire() as old:
+            data['articles'][0]['price'] += 1
+            replace(data, path)
+            new = await store.reload()
+            assert (old.number, new.number) == (1, 2)
+            assert store.current is new
+            assert old.compiled.price(batch) == expected
+            assert new.compiled.price(batch) != expected
+            assert 1 in store.retired
+        assert not store.retired
+    asyncio.run(scenario())
+    gauges = stats.as_dict()['gauges']
+    assert gauges['catalog.version'] == 2
+    assert gauges['catalog.digest'] == store.current.compiled.digest
+    assert stats.as_dict()['observations']['catalog.reload_ms']['count'] == 1
+    store.close()
+
+
+def test_failed_reload_keeps_version(tmpdir):
+    '''
+    Invalid catalogs are rejected and the current version kept
+    '''
+    path = str(tmpdir.join('catalog.json'))
+    with open(path, 'w') as fp:
+        json.dump(load_level(3, 'data'), fp)
+    stats = Stats()
+    store = CatalogStore(path, stats)
+    digest = store.current.compiled.digest
+    with open(path, 'w') as fp:
+        fp.write('{"articles": [{"id": "x"}]}')
+    with pytest.raises(ReloadError):
+        asyncio.run(store.reload())
+    assert store.current.number == 1
+    assert store.current.compiled.digest == digest
+    assert stats.counters['catalog.reload_errors'] == 1
+
+
+def test_watch(tmpdir):
+    '''
+    The watcher reloads the catalog once its file changes
+    '''
+    data = load_level(3, 'data')
+    path = str(tmpdir.join('catalog.zmc'))
+    replace(data, path)
+    store = CatalogStore(path)
+
+    async def scenario():
+        task = asyncio.create_task(store.watch(0.01))
+        await asyncio.sleep(0.05)
+        assert store.current.number == 1
+        data['articles'][0]['price'] += 1
+        replace(data, path)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if store.current.number == 2:
+                break
+        task.cancel()
+        assert store.current.number == 2
+    asyncio.run(scenario())
+    store.close()
@@ -0,0 +1,156 @@
+'''
+Catalog-affinity router tests
+'''
+import asyncio
+import copy
+import json
+
+import aiohttp
+from aiohttp.test_utils import TestClient, TestServer
+
+from zenmarket import app
+from zenmarket.server.batching import catalog_key
+from zenmarket.algo.catalog import CompiledCatalog
+from zenmarket.server.router import HashRing, RouterConfig, make_router
+from zenmarket.test.helpers import load_level
+
+
+def run_cluster(size, scenario, backend_options=None, **options):
+    '''
+    Runs coroutine scenario(client, backends) against a router in front of
+    size backend servers made with backend_options
+    '''
+    async def runner():
+        backends = [TestServer(app.make_app(**backend_options or {}))
+                    for _ in range(size)]
+        for backend in backends:
+            await backend.start_server()
+        urls = [str(backend.make_url('')).rstrip('/') for backend in backends]
+        router = make_router(RouterConfig(
+            backends=urls, health_interval=None), **options)
+        try:
+            async with TestClient(TestServer(router)) as client:
+                return await scenario(client, dict(zip(urls, backends)))
+        finally:
+            for backend in backends:
+                await backend.close()
+    return asyncio.run(runner())
+
+
+def test_hash_ring():
+    '''
+    Every node is met once, and adding a node only moves the keys it takes
+    '''
+    ring = HashRing(['a', 'b', 'c'])
+    keys = ['catalog {}'.format(index) for index in range(1000)]
+    for key in keys[:10]:
+        assert sorted(ring.nodes_for(key)) == ['a', 'b', 'c']
+    grown = HashRing(['a', 'b', 'c', 'd'])
+    moved = [key for key in keys
+             if next(ring.nodes_for(key)) != next(grown.nodes_for(key))]
+    assert all(next(grown.nodes_for(key)) == 'd' for key in moved)
+    assert 100 < len(moved) < 400
+    assert not list(HashRing([]).nodes_for('key'))
+
+
+def test_router_affinity():
+    '''
+    Requests sharing a catalog go to the same backend, whatever their carts
+    and body format
+    '''
+    data = load_level(3, 'data')
+    expected = load_level(3, 'output')
+
+    async def scenario(client, backends):
+        for index in range(6):
+            payload = copy.deepcopy(data)
+            payload['carts'] = payload['carts'][index % 3:]
+            if index % 2:
+                form = aiohttp.FormData()
+                form.add_field('data', json.dumps(payload).encode(),
+                               filename='data.json',
+                               content_type='application/json')
+                resp = await client.post('/api/level3/price', data=form)
+            else:
+                resp = await client.post('/api/level3/price', json=payload)
+            assert resp.status == 200
+            assert (await resp.json())['carts'] == \
+                expected['carts'][index % 3:]
+        stats = await (await client.get('/api/stats')).json()
+        assert stats['counters']['router.requests'] == 6
+        used = [name for name in stats['counters'] if name.startswith('router.backend.')]
+        assert len(used) == 1 and stats['counters'][used[0]] == 6
+        ring = HashRing(list(backends))
+        assert used[0] == 'router.backend.' + next(
+            ring.nodes_for(catalog_key(data)))
+
+    run_cluster(3, scenario)
+
+
+def test_router_failover():
+    '''
+    Requests fail over to the next backend of the ring when theirs is down,
+    and get 502 once every backend is
+    '''
+    data = load_level(3, 'data')
+    key = catalog_key(data)
+
+    async def scenario(client, backends):
+        order = list(HashRing(list(backends)).nodes_for(key))
+        await backends[order[0]].close()
+        resp = await client.post('/api/level3/price', json=data)
+        assert resp.status == 200
+        stats = await (await client.get('/api/stats')).json()
+        assert stats['counters']['router.failovers'] == 1
+        assert stats['counters']['router.backend.' + order[1]] == 1
+        assert not stats['backends'][order[0]]
+        resp = await client.post('/api/level3/price', json=data)
+        assert resp.status == 200
+        stats = await (await client.get('/api/stats')).json()
+        assert stats['counters']['router.failovers'] == 1  # marked down, tried last
+        assert stats['counters']['router.backend.' + order[1]] == 2
+        await backends[order[1]].close()
+        resp = await client.post('/api/level3/price', json=data)
+        assert resp.status == 502
+
+    run_cluster(2, scenario)
+
+
+def test_router_broadcasts_admin_requests(tmpdir):
+    '''
+    Catalog reloads reach every backend, 502 when one did not answer
+    '''
+    catalog = str(tmpdir.join('catalog.zmc'))
+    CompiledCatalog.write(load_level(3, 'data'), catalog)
+
+    async def scenario(client, backends):
+        resp = await client.post('/api/admin/catalog/reload')
+        assert resp.status == 200
+        results = (await resp.json())['backends']
+        assert sorted(results) == sorted(backends)
+        for result in results.values():
+            assert result['status'] == 200
+            assert json.loads(result['body'])['version'] == 2
+        await backends[sorted(backends)[0]].close()
+        resp = await client.post('/api/admin/catalog/reload')
+        assert resp.status == 502
+        results = (await resp.json())['backends']
+        assert [result['status'] for _, result in sorted(
+            results.items())] == [None, 200]
+
+    run_cluster(2, scenario, backend_options={'catalog': catalog})
+
+
+def test_router_health_checks():
+    '''
+    Health checks mark stopped backends down
+    '''
+    async def scenario(client, backends):
+        url = list(backends)[0]
+        await backends[url].close()
+        await asyncio.sleep(0.3)
+        stats = await (await client.get('/api/stats')).json()
+        assert stats['backends'] == {url: False, list(backends)[1]: True}
+        assert stats['gauges']['router.healthy'] == 1
+
+    run_cluster(2, scenario, health_interval=0.05, timeout=1)
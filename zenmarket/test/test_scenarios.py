@@ -0,0 +1,147 @@
+'''
+Scenario pricing tests
+'''
+import copy
+import json
+import random
+
+from click.testing import CliRunner
+
+from zenmarket import cli
+from zenmarket.algo import differential, level1, level3, scenarios
+from zenmarket.algo.catalog import CartBatch
+from zenmarket.test.helpers import load_level
+
+
+def random_scenario(rng, data, name):
+    '''
+    :returns scenario replacing some sections of data
+    '''
+    scenario = {'name': name}
+    article_ids = [article['id'] for article in data['articles']]
+    if rng.random() < 0.6:
+        scenario['articles'] = [
+            dict(article, price=article['price'] * rng.choice([1, 1, 2]) +
+                 rng.choice([0, 0, 5, -5]))
+            for article in data['articles'] if rng.random() < 0.97]
+    if rng.random() < 0.4:
+        scenario['delivery_fees'] = differential.generate_fees(rng)
+    if rng.random() < 0.4:
+        scenario['discounts'] = differential.generate_discounts(
+            rng, article_ids)
+    return scenario
+
+
+def check_against_level3(seed):
+    '''
+    Checks the matrix of a random input against level3.price
+    :returns 'ok', 'invalid' or 'failed'
+    '''
+    rng = random.Random(seed)
+    data = differential.generate(rng, 3)
+    data['scenarios'] = [random_scenario(rng, data, 'scenario{}'.format(k))
+                         for k in range(rng.randint(0, 4))]
+    variants = [('base', data)] + [
+        (scenario['name'], dict(data, **scenario))
+        for scenario in data['scenarios']]
+    expected = [differential.outcome(
+        lambda _, variant: level3.price(variant), 3, variant)
+                for _, variant in variants]
+    try:
+        result = scenarios.evaluate(copy.deepcopy(data))
+    except level1.BadDataFormat:
+        assert ('error', 'zenmarket.algo.level1.BadDataFormat') in expected
+        return 'invalid'
+    except scenarios.ScenarioError as exc:
+        name, (_, error) = [
+            (name, outcome) for (name, _), outcome in zip(variants, expected)
+            if outcome[0] == 'error'][0]
+        assert str(exc).startswith('Scenario {!r}: {}:'.format(
+            name, error.rsplit('.', 1)[-1]))
+        return 'failed'
+    assert all(status == 'ok' for status, _ in expected)
+    for column, (_, response) in enumerate(expected):
+        assert [cart['totals'][column] for cart in result['carts']] == [
+            cart['total'] for cart in response['carts']]
+        assert result['scenarios'][column]['revenue'] == sum(
+            cart['total'] for cart in response['carts'])
+    return 'ok'
+
+
+def test_against_level3():
+    '''
+    Each column of the matrix is level3.price of the base input with the
+    sections of its scenario replaced, errors are the ones of the first
+    failing catalog
+    '''
+    outcomes = [check_against_level3(seed) for seed in range(300)]
+    assert {'ok', 'invalid', 'failed'} <= set(outcomes)
+
+
+def test_summaries():
+    '''
+    Summaries compare each scenario with the base catalog
+    '''
+    data = load_level(3)
+    free_delivery = [{'eligible_transaction_volume': {
+        'min_price': 0, 'max_price': None}, 'price': 0}]
+    data['scenarios'] = [
+        {'name': 'free delivery', 'delivery_fees': free_delivery},
+        {'name': 'no discounts', 'discounts': []},
+    ]
+    base = level3.price(load_level(3))
+    revenue = sum(cart['total'] for cart in base['carts'])
+    result = scenarios.evaluate(data, carts=False)
+    assert 'carts' not in result
+    base_summary, free, undiscounted = result['scenarios']
+    assert base_summary == {
+        'name': 'base', 'revenue': revenue,
+        'fee_revenue': base_summary['fee_revenue'], 'delta': 0,
+        'delta_percent': 0.0, 'carts_up': 0, 'carts_down': 0}
+    assert free['fee_revenue'] == 0
+    assert free['delta'] == -base_summary['fee_revenue']
+    assert free['carts_down'] == len(base['carts'])
+    assert undiscounted['delta'] > 0
+    assert undiscounted['delta_percent'] == round(
+        100 * undiscounted['delta'] / revenue, 2)
+
+
+def test_repricing_visits_changed_articles():
+    '''
+    Carts are indexed once, scenarios only update the lines of the articles
+    whose price changed
+    '''
+    data = load_level(3)
+    index = scenarios.CartIndex(CartBatch.from_list(data['carts']))
+    prices = [7] * len(index.article_ids)
+    subtotals = index.subtotals(prices)
+    assert index.repriced(subtotals, prices, list(prices)) is subtotals
+    changed = list(prices)
+    changed[0] += 3
+    article_id = index.article_ids[0]
+    assert index.repriced(subtotals, prices, changed) == [
+        total + 3 * sum(item['quantity'] for item in cart['items']
+                        if item['article_id'] == article_id)
+        for total, cart in zip(subtotals, data['carts'])]
+
+
+def test_cli(tmpdir):
+    '''
+    zm-cli scenarios writes the matrix, or the summaries only
+    '''
+    data = load_level(3)
+    data['scenarios'] = [{'name': 'no discounts', 'discounts': []}]
+    path = str(tmpdir.join('what-if.json'))
+    with open(path, 'w') as fp:
+        json.dump(data, fp)
+    runner = CliRunner()
+    result = runner.invoke(cli, ['scenarios', path, '-'])
+    assert result.exit_code == 0
+    assert json.loads(result.stdout) == scenarios.evaluate(data)
+    result = runner.invoke(cli, ['scenarios', '--summary-only', path, '-'])
+    assert json.loads(result.stdout) == scenarios.evaluate(data, carts=False)
+    data['scenarios'][0]['articles'] = []
+    with open(path, 'w') as fp:
+        json.dump(data, fp)
+    result = runner.invoke(cli, ['scenarios', path, '-'])
+    assert result.exit_code == 1
@@ -0,0 +1,123 @@
+'''
+Streaming request path tests
+'''
+import copy
+import json
+import random
+
+import pytest
+
+from zenmarket.algo import engines
+from zenmarket.algo.catalog import CompiledCatalog
+from zenmarket.server.limits import Limits
+from zenmarket.server.streaming import ObjectStream, StreamingPricer
+from zenmarket.test.helpers import load_level
+
+
+def feed(streamed, raw, rand):
+    '''
+    Feeds raw to streamed in random chunks
+    '''
+    position = 0
+    while position < len(raw):
+        size = rand.randint(1, 64)
+        streamed.feed(raw[position:position + size])
+        position += size
+    return streamed
+
+
+def test_object_stream_events():
+    '''
+    Members are returned whole, carts one by one, whatever the chunking
+    '''
+    raw = (b' {"a": {"b": [1, "]}\\""]}, "carts" : [ {"id": 1}, 2 ,[]],'
+           b' "c": -1.5e3, "d": "x" } ')
+    expected = [('member', 'a', {'b': [1, ']}"']}),
+                ('element', 'carts', {'id': 1}), ('element', 'carts', 2),
+                ('element', 'carts', []), ('end', 'carts', None),
+                ('member', 'c', -1500.0), ('member', 'd', 'x')]
+    for size in range(1, len(raw) + 1):
+        stream = ObjectStream()
+        events = []
+        for position in range(0, len(raw), size):
+            events.extend(stream.feed(raw[position:position + size]))
+        events.extend(stream.close())
+        assert events == expected
+
+
+@pytest.mark.parametrize('raw', [
+    b'', b'[]', b'{"carts": [}', b'{"a": 1,}', b'{"a": 1} {}', b'{"a" 1}',
+    b'{"a": 1, "a": 2}', b'{"a": tru}', b'{"a": "\xff"}', b'{"a": 1',
+])
+def test_object_stream_errors(raw):
+    '''
+    Anything json.loads rejects (and duplicate keys) raises StreamError
+    '''
+    streamed = StreamingPricer(level=1)
+    streamed.feed(raw)
+    assert streamed.finish() is None
+    assert streamed.failed.startswith('StreamError')
+
+
+@pytest.mark.parametrize('level', [1, 2, 3])
+def test_streamed_prices(level):
+    '''
+    Streamed responses are the ones of the engines, carts before or after
+    the catalog
+    '''
+    rand = random.Random(level)
+    data = load_level(level)
+    expected = engines.get('reference').price(level, copy.deepcopy(data))
+    carts_first = dict(carts=data['carts'], **{
+        key: value for key, value in data.items() if key != 'carts'})
+    for payload in (data, carts_first):
+        raw = json.dumps(payload, indent=2).encode()
+        streamed = feed(StreamingPricer(level=level), raw, rand)
+        assert streamed.finish() == expected, streamed.failed
+        assert streamed.payload() == data
+
+
+def test_streamed_catalog_prices():
+    '''
+    Carts are priced against a fixed catalog, other members are ignored
+    '''
+    data = load_level(3)
+    compiled = CompiledCatalog.from_data(data)
+    expected = compiled.price_data(data)
+    raw = json.dumps(data).encode()
+    streamed = feed(StreamingPricer(compiled=compiled), raw, random.Random())
+    assert streamed.finish() == expected
+
+
+@pytest.mark.parametrize('change', [
+    lambda data: data.update(carts=None),
+    lambda data: data['carts'].append({'id': 9, 'items': 'x'}),
+    lambda data: data['carts'][0]['items'].append(
+        {'article_id': 404, 'quantity': 1}),
+    lambda data: data['articles'][0].update(price=-10 ** 6),
+    lambda data: data.pop('delivery_fees'),
+    lambda data: data.pop('carts'),
+    lambda data: data.pop('articles'),
+    lambda data: data.update(delivery_fees=data['delivery_fees'][:1]),
+])
+def test_streaming_gives_up(change):
+    '''
+    Inputs the engines reject are left to them
+    '''
+    data = load_level(3)
+    change(data)
+    streamed = StreamingPricer(level=3)
+    streamed.feed(json.dumps(data).encode())
+    assert streamed.finish() is None
+    assert streamed.failed
+
+
+def test_streaming_limits():
+    '''
+    Streaming stops once the admission limits are exceeded
+    '''
+    data = load_level(3)
+    streamed = StreamingPricer(level=3, limits=Limits(max_carts=2))
+    streamed.feed(json.dumps(data).encode())
+    assert streamed.finish() is None
+    assert streamed.failed == 'StreamError: Over admission limits'
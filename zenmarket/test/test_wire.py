@@ -0,0 +1,74 @@
+'''
+Binary wire format tests
+'''
+import pytest
+
+from zenmarket import wire
+from zenmarket.algo.catalog import CartBatch
+from zenmarket.algo.level1 import BadDataFormat
+
+
+CARTS = [
+    {'id': 1, 'items': [
+        {'article_id': 1, 'quantity': 6},
+        {'article_id': 2, 'quantity': 2},
+    ]},
+    {'id': 2, 'items': []},
+    {'id': 3, 'items': [{'article_id': 4, 'quantity': 1}]},
+]
+
+
+@pytest.mark.parametrize('width', [4, 8])
+def test_carts_roundtrip(width):
+    '''
+    decode(encode(carts)) gives the columnar batch of carts
+    '''
+    batch = wire.decode_carts(wire.encode_carts(CARTS, width))
+    expected = CartBatch.from_list(CARTS)
+    assert [list(column) for column in batch] == [
+        list(column) for column in expected]
+
+
+def test_carts_layout():
+    '''
+    Documented layout: header, then (id, n_items, pairs...) per cart
+    '''
+    raw = wire.encode_carts(CARTS[2:], 4)
+    assert raw == wire.HEADER.pack(b'ZMW1', 4, 1) + bytes(
+        [3, 0, 0, 0, 1, 0, 0, 0, 4, 0, 0, 0, 1, 0, 0, 0])
+
+
+def test_totals_roundtrip():
+    '''
+    Totals survive the binary encoding
+    '''
+    response = {'carts': [{'id': 1, 'total': 2350}, {'id': 2, 'total': 0}]}
+    assert wire.decode_totals(wire.encode_totals(response)) == response
+
+
+def test_int32_overflow():
+    '''
+    Values that do not fit in int32 are rejected
+    '''
+    carts = [{'id': 2 ** 40, 'items': []}]
+    with pytest.raises(BadDataFormat):
+        wire.encode_carts(carts, 4)
+    assert list(wire.decode_carts(wire.encode_carts(carts, 8)).ids) == [
+        2 ** 40]
+    with pytest.raises(BadDataFormat):
+        wire.encode_totals({'carts': [{'id': 1, 'total': 2 ** 64}]})
+
+
+@pytest.mark.parametrize('raw', [
+    b'',
+    b'JSON{"carts": []}',
+    wire.encode_carts(CARTS, 4)[:-4],
+    wire.encode_carts(CARTS, 4) + b'\0\0\0\0',
+    wire.HEADER.pack(b'ZMW1', 3, 0),
+])
+def test_corrupted_carts(raw):
+    '''
+    Corrupted payloads raise BadDataFormat
+    '''
+    with pytest.raises(BadDataFormat):
+        wire.decode_carts(raw)
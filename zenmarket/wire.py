@@ -0,0 +1,133 @@
+'''
+Compact binary wire format for carts and cart totals, an alternative to JSON.
+
+Carts (content type application/vnd.zenmarket.carts), little-endian:
+
+    header   magic b'ZMW1', uint8 width (4 or 8), 3 reserved bytes,
+             uint32 n_carts
+    n_carts times, every field being a signed integer of <width> bytes:
+             cart_id, n_items, n_items times (article_id, quantity)
+
+Totals (content type application/vnd.zenmarket.totals), little-endian:
+
+    header   magic b'ZMT1', uint8 width (always 8), 3 reserved bytes,
+             uint32 n_carts
+    n_carts times (int64 cart_id, int64 total)
+
+Carts are decoded straight into the columnar CartBatch used by
+CompiledCatalog.price, without building any intermediate dict.
+'''
+import struct
+import sys
+from array import array
+
+from zenmarket.algo.catalog import CartBatch
+from zenmarket.algo.level1 import BadDataFormat
+
+CARTS_CONTENT_TYPE = 'application/vnd.zenmarket.carts'
+TOTALS_CONTENT_TYPE = 'application/vnd.zenmarket.totals'
+
+CARTS_MAGIC = b'ZMW1'
+TOTALS_MAGIC = b'ZMT1'
+HEADER = struct.Struct('<4sB3xI')
+FORMATS = {4: 'i', 8: 'q'}
+
+
+def _words(buffer, magic: bytes):
+    '''
+    Checks header and :returns (n_carts, body as a memoryview of ints)
+    '''
+    if sys.byteorder != 'little':
+        raise BadDataFormat('binary wire format is little-endian')
+    view = memoryview(buffer)
+    try:
+        header_magic, width, n_carts = HEADER.unpack_from(view)
+    except struct.error:
+        raise BadDataFormat('truncated header')
+    if header_magic != magic or width not in FORMATS:
+        raise BadDataFormat(
+            'Unknown wire format {!r}/{}'.format(header_magic, width))
+    body = view[HEADER.size:]
+    if len(body) % width:
+        raise BadDataFormat('truncated body')
+    return n_carts, body.cast(FORMATS[width])
+
+
+def encode_carts(carts, width: int = 4) -> bytes:
+    '''
+    :param carts: validated carts [{"id": 1, "items": [...]}] or a CartBatch
+    :param width: integer size in bytes, 4 or 8
+    '''
+    batch = carts if isinstance(carts, CartBatch) else CartBatch.from_list(
+        carts)
+    words = array(FORMATS[width])
+    offsets = batch.offsets
+    try:
+        for i, cart_id in enumerate(batch.ids):
+            start, stop = offsets[i], offsets[i + 1]
+            words.append(cart_id)
+            words.append(stop - start)
+            for j in range(start, stop):
+                words.append(batch.article_ids[j])
+                words.append(batch.quantities[j])
+    except OverflowError as exc:
+        raise BadDataFormat('{} for int{}'.format(exc, 8 * width))
+    return HEADER.pack(CARTS_MAGIC, width, batch.cart_count) + words.tobytes()
+
+
+def decode_carts(buffer) -> CartBatch:
+    '''
+    :returns CartBatch decoded from encode_carts output
+    :raises BadDataFormat
+    '''
+    n_carts, words = _words(buffer, CARTS_MAGIC)
+    ids, offsets = array('q'), array('q', [0])
+    article_ids, quantities = array('q'), array('q')
+    pos = 0
+    try:
+        for _ in range(n_carts):
+            ids.append(words[pos])
+            n_items = words[pos + 1]
+            if n_items < 0:
+                raise BadDataFormat('negative item count')
+            pairs = words[pos + 2:pos + 2 + 2 * n_items]
+            if len(pairs) != 2 * n_items:
+                raise BadDataFormat('truncated cart')
+            article_ids.extend(pairs[0::2])
+            quantities.extend(pairs[1::2])
+            offsets.append(len(article_ids))
+            pos += 2 + 2 * n_items
+    except IndexError:
+        raise BadDataFormat('truncated cart')
+    if pos != len(words):
+        raise BadDataFormat('trailing bytes after last cart')
+    return CartBatch(ids, offsets, article_ids, quantities)
+
+
+def encode_totals(response: dict) -> bytes:
+    '''
+    :param response: {'carts': [{'id': <id>, 'total': <total>}, ...]}
+    :raises BadDataFormat for totals out of int64 range
+    '''
+    words = array('q')
+    try:
+        for cart in response['carts']:
+            words.append(cart['id'])
+            words.append(cart['total'])
+    except OverflowError as exc:
+        raise BadDataFormat('{} for int64'.format(exc))
+    return HEADER.pack(TOTALS_MAGIC, 8, len(response['carts'])) + \
+        words.tobytes()
+
+
+def decode_totals(buffer) -> dict:
+    '''
+    :returns {'carts': [{'id': <id>, 'total': <total>}, ...]}
+    '''
+    n_carts, words = _words(buffer, TOTALS_MAGIC)
+    if len(words) != 2 * n_carts:
+        raise BadDataFormat('truncated totals')
+    return {'carts': [
+        {'id': cart_id, 'total': total}
+        for cart_id, total in zip(words[0::2], words[1::2])
+    ]}